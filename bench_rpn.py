@@ -0,0 +1,271 @@
+"""Benchmarks for rpn.py.
+
+> python bench_rpn.py --output new.json --compare old.json
+
+runs every benchmark, saves the results as JSON, and fails if any of them
+got slower than in old.json by more than the threshold. Benchmarks of the
+GUI are skipped when there is no display.
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+import rpn
+
+BENCHMARKS = {}  # Benchmark functions by name
+CLEANUPS = []  # Functions undoing the setup of the running benchmark
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function sets up the benchmark and returns a function
+    running it once, or None to skip it. Anything to undo afterwards, like
+    closing a window, goes in CLEANUPS."""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def time_call(run, repeat=5, min_time=0.2):
+    """Best time of one call of run, in seconds."""
+    timer = timeit.Timer(run)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+# Dispatch of the different kinds of operators
+
+def token_benchmark(token, operands):
+    """Apply token to operands, and put the operands back."""
+    calculator = rpn.RPN()
+    calculator.stack.extend(operands)
+
+    def run():
+        calculator.process_token(token)
+        calculator.stack[:] = operands
+    return run
+
+
+def stack_benchmark(token, operands):
+    """Apply token to a stack of operands, set up again on every run."""
+    calculator = rpn.RPN()
+
+    def run():
+        calculator.stack[:] = operands
+        calculator.process_token(token)
+    return run
+
+
+@benchmark('process_token operator_0 (π)')
+def bench_operator_0():
+    return token_benchmark('π', [])
+
+
+@benchmark('process_token operator_1 (sin)')
+def bench_operator_1():
+    return token_benchmark('sin', [0.5])
+
+
+@benchmark('process_token operator_1 (atanh)')
+def bench_operator_1_last():
+    return token_benchmark('atanh', [0.5])
+
+
+@benchmark('process_token operator_2 (+)')
+def bench_operator_2():
+    return token_benchmark('+', [1, 2])
+
+
+@benchmark('process_token operator_2 (nCk)')
+def bench_operator_2_comb():
+    return token_benchmark('nCk', [10, 3])
+
+
+@benchmark('process_number int')
+def bench_number_int():
+    return token_benchmark('12345', [])
+
+
+@benchmark('process_number float')
+def bench_number_float():
+    return token_benchmark('3.14159', [])
+
+
+@benchmark('process_token error (0 ln)')
+def bench_error():
+    calculator = rpn.RPN(error_policy='skip')
+    calculator.stack.append(0)
+    return lambda: calculator.process_token('ln')
+
+
+# Splitting the input into tokens
+
+def tokenize_benchmark(length):
+    program = '1 2 3 4 5 + * - / 12\u00d7'
+    text = (program * (length // len(program) + 1))[:length]
+    return lambda: rpn.tokenize(text)
+
+
+for length in (10, 1000, 100000):
+    benchmark(f'tokenize, {length} characters')(
+        lambda length=length: tokenize_benchmark(length))
+
+
+# Big integers
+
+for size in (1000, 10000, 100000):
+    benchmark(f'! of {size}')(
+        lambda size=size: stack_benchmark('!', [size]))
+    benchmark(f'nCk of {2 * size}, {size}')(
+        lambda size=size: stack_benchmark('nCk', [2 * size, size]))
+    benchmark(f'^ of 3, {10 * size}')(
+        lambda size=size: stack_benchmark('^', [3, 10 * size]))
+    benchmark(f'E of 7, {size}')(
+        lambda size=size: stack_benchmark('E', [7, size]))
+
+
+# Operators on the whole stack
+
+for depth in (1000, 50000):
+    values = [float(value) + 0.5 for value in range(depth)]
+    benchmark(f'\u03a3 of {depth} floats')(
+        lambda values=values: stack_benchmark('\u03a3', values))
+    benchmark(f'stdev of {depth} floats')(
+        lambda values=values: stack_benchmark('stdev', values))
+    benchmark(f'sort of {depth} floats')(
+        lambda values=values: stack_benchmark('sort', values[::-1]))
+
+
+# Monte Carlo runs
+
+benchmark('monte_carlo of 6 \u2684 6 \u2684 +, 100000 trials')(
+    lambda: lambda: rpn.monte_carlo('6 \u2684 6 \u2684 +', 100000, seed=1))
+
+
+# The display of the GUI
+
+def gui_app():
+    """A hidden CalculatorGUI, destroyed after the benchmark, or None if
+    there is no tkinter or no display."""
+    try:
+        import tkinter
+        import rpn_gui
+    except ImportError:
+        return None
+    try:
+        app = rpn_gui.CalculatorGUI(rpn.RPN())
+    except tkinter.TclError:  # No display
+        return None
+    app.withdraw()
+    CLEANUPS.append(app.destroy)
+    return app
+
+
+def display_benchmark(depth):
+    app = gui_app()
+    if app is None:
+        return None
+    app.rpn.stack.extend(float(value) + 0.5 for value in range(depth))
+    return app.update_display
+
+
+for depth in (10, 1000, 100000):
+    benchmark(f'update_display, {depth} entries')(
+        lambda depth=depth: display_benchmark(depth))
+
+
+def paste_benchmark(length):
+    app = gui_app()
+    if app is None:
+        return None
+    text = '\n'.join(['1'] + ['1 +'] * length)
+
+    def run():
+        app.rpn.stack.clear()
+        app.process_text(text)
+        while app.job is not None:
+            app.update()  # The tokens after the first BULK_TOKENS
+        app.update_display()
+    return run
+
+
+benchmark('process_text, 10000 lines')(lambda: paste_benchmark(10000))
+
+
+def run_benchmarks(selected=None):
+    """Run the benchmarks with selected in their name.
+
+    Returns the seconds per call by benchmark name."""
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if selected and selected not in name:
+            continue
+        try:
+            run = setup()
+            if run is None:
+                print(f"{name:40} skipped", file=sys.stderr)
+                continue
+            results[name] = time_call(run)
+        finally:
+            while CLEANUPS:
+                CLEANUPS.pop()()
+        print(f"{name:40} {1e6 * results[name]:12.3f} us", file=sys.stderr)
+    return results
+
+
+def compare(old, new, threshold):
+    """Print the change of every benchmark in both results.
+
+    Returns the names of the benchmarks slower by more than threshold."""
+    regressions = []
+    for name, seconds in new.items():
+        if name not in old:
+            continue
+        change = seconds / old[name] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:40} {1e6 * old[name]:12.3f} us "
+              + f"{1e6 * seconds:12.3f} us {100 * change:+7.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rpn.py.")
+    parser.add_argument('--output', metavar='FILE',
+                        help="save the results as JSON")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare with results saved earlier")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="fail if a benchmark is slower than in "
+                        + "--compare by more than this (default 0.25, "
+                        + "25%%, above the noise of about 12%%)")
+    parser.add_argument('--filter', metavar='TEXT',
+                        help="only run benchmarks with TEXT in their name")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.filter)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)['results']
+        regressions = compare(old, results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks got slower by more than "
+                  + f"{100 * args.threshold:.0f}%", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,219 +1,1738 @@
-import tkinter as tk
-from tkinter import messagebox
+import collections
+import functools
+import itertools
 import math
+import os
+from operator import add, mod, mul, sub
 import random
-import re
+import sys
+import time
 
+np = None  # NumPy, once enable_arrays() has imported it
+operator_cache = None  # The OperatorCache in use, see enable_cache()
+
+
+OPERATOR_ERRORS = (ArithmeticError, ValueError, TypeError)
+ERROR_POLICIES = ('raise', 'nan', 'skip')
+
+
+class RPNError(Exception):
+    """Base class for errors in RPN programs.
+
+    consumed is the number of operands the failing token would have
+    taken off the stack."""
+
+    def __init__(self, message, consumed=0):
+        super().__init__(message)
+        self.consumed = consumed
+
+
+class StackUnderflowError(RPNError, IndexError):
+    """An operator was given fewer operands than it takes."""
+
+
+class DomainError(RPNError, ValueError):
+    """The operands are outside the domain of the operator."""
+
+
+class RPNOverflowError(RPNError, OverflowError):
+    """The result is too large to represent."""
+
+
+class ParseError(RPNError, ValueError):
+    """A token is neither an operator nor a number."""
+
+
+def operator_error(error, operator=None):
+    """Translate an exception raised by an operator into an RPNError."""
+    if isinstance(error, RPNError):
+        if operator is not None:
+            error.consumed = operator.arity
+        return error
+    overflow = isinstance(error, OverflowError) or (
+        isinstance(error, FloatingPointError) and 'overflow' in str(error))
+    kind = RPNOverflowError if overflow else DomainError
+    if operator is None:
+        return kind(str(error))
+    return kind(f"{operator.name}: {error}", operator.arity)
+
+
+class Operator():
+    """An entry in the operator registry.
+
+    function takes arity operands and returns the result, or a tuple of
+    them if the operator gives other than one result. An arity of None
+    means the operator takes the whole stack, or with counted, the count
+    on top of the stack and that many values below it. A results of None
+    means as many results as operands. A pure operator
+    always gives the same result for the same operands. Exceptions of the
+    types in errors are reported as failed operations; anything else is a
+    bug and is raised.
+
+    If NumPy is installed, vector is the elementwise version of function
+    used when any operand is an array. call dispatches to the right one,
+    through the cache if there is one, see enable_cache()."""
+
+    def __init__(self, name, arity, function, pure=True,
+                 errors=OPERATOR_ERRORS, results=1, counted=False):
+        self.name = name
+        self.arity = arity
+        self.results = results
+        self.counted = counted
+        self.function = function
+        self.pure = pure
+        self.errors = errors
+        self.vector = None
+        self.cache = None
+        self.uncached = function  # call without the cache
+        self.call = function
+
+    def set_vector(self, vector):
+        """Use vector instead of function when an operand is an array.
+
+        vector runs with floating point errors raised, so division by
+        zero, overflow and operands outside the domain fail like they do
+        for the scalar function, rather than giving inf or NaN."""
+        function = self.function
+        array = np.ndarray
+        errstate = np.errstate
+
+        def call(*operands):
+            for operand in operands:
+                if isinstance(operand, array):
+                    with errstate(divide='raise', over='raise',
+                                  invalid='raise'):
+                        return vector(*operands)
+            return function(*operands)
+        self.vector = vector
+        self.uncached = call
+        self.set_cache(self.cache)
+
+    def set_cache(self, cache):
+        """Look results up in cache before computing them, or not if
+        cache is None.
+
+        Operators that are not pure, take no operands, or are cheaper
+        than a lookup are never cached."""
+        if not self.pure or not self.arity or self.name in CHEAP_OPERATORS:
+            cache = None
+        self.cache = cache
+        if cache is None:
+            self.call = self.uncached
+        else:
+            self.call = cache.wrap(self.name, self.uncached)
+
+    def __repr__(self):
+        return f"Operator({self.name!r}, {self.arity})"
+
+
+OPERATORS = {}  # Registry of operators by name
+OPERATOR_SETS = {0: set(), 1: set(), 2: set()}  # Operator names by arity
+TOKEN_PATTERNS = {}  # Cache of token_pattern(), cleared on registration
+PROGRAM_PLANS = {}  # Cache of plan_program(), cleared on registration
+WORDS = {}  # User-defined words by name, see define_word()
+
+
+def register_operator(name, arity, function=None, pure=True,
+                      errors=OPERATOR_ERRORS, results=1, counted=False):
+    """Add an operator to the registry.
+
+    Use as register_operator(name, arity, function) or as a decorator."""
+    def register(function):
+        if name in OPERATORS:
+            # Replacing an operator, possibly with a different arity
+            OPERATOR_SETS[OPERATORS[name].arity].discard(name)
+            WORDS.pop(name, None)
+        OPERATORS[name] = Operator(name, arity, function, pure, errors,
+                                   results, counted)
+        OPERATORS[name].set_cache(operator_cache)
+        OPERATOR_SETS.setdefault(arity, set()).add(name)
+        TOKEN_PATTERNS.clear()
+        PROGRAM_PLANS.clear()
+        return function
+    if function is None:
+        return register
+    return register(function)
+
+
+VECTORS = {}  # Array versions of operators by name
+
+
+def register_vector(name):
+    """Decorator adding the array version of operator name.
+
+    The array versions are put to use by enable_arrays()."""
+    def register(vector):
+        VECTORS[name] = vector
+        if np is not None:
+            OPERATORS[name].set_vector(vector)
+        return vector
+    return register
+
+
+def enable_arrays():
+    """Import NumPy and let the operators take arrays as operands.
+
+    NumPy is optional and slow to import, so this is only done when it is
+    needed. RPN() and RPN.compile() call it when NumPy has already been
+    imported by someone else, as there can not be any arrays otherwise.
+    Programs and words compiled before are compiled again, with the
+    array versions. Raises ImportError if NumPy is not installed."""
+    global np
+    if np is not None:
+        return
+    import numpy
+    np = numpy
+    for name, vector in VECTORS.items():
+        OPERATORS[name].set_vector(vector)
+    compile_program.cache_clear()  # Compiled with the scalar calls
+    for name, word in list(WORDS.items()):
+        define_word(name, ' '.join(word.tokens))  # Inlined already
+        WORDS[name] = word  # As it was written
+
+
+def arrays_in_use():
+    """Enable arrays if NumPy is loaded. Returns True if arrays work."""
+    if np is None and 'numpy' in sys.modules:
+        enable_arrays()
+    return np is not None
+
+
+# Faster than a cache lookup
+CHEAP_OPERATORS = {'+', '-', '\u00d7', 'swap', 'dup', 'drop'}
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   'hits misses evictions entries bytes')
+
+
+class OperatorCache():
+    """LRU cache of the results of pure operators and programs.
+
+    At most max_entries results are kept, taking at most max_bytes as
+    measured by sys.getsizeof() of the operands and the result. Only int
+    and float operands are cached, keyed with their type so 5 and 5.0 are
+    separate entries. Zero and NaN floats are not cached, as -0.0 == 0.0
+    and NaN != NaN. Operators cache the results of their exact functions,
+    which are the same in every mode of an RPN; approximations are never
+    cached."""
+
+    def __init__(self, max_entries=10000, max_bytes=2 ** 26):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # (result, size) by key
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fresh(self):
+        """An empty OperatorCache with the same limits."""
+        return OperatorCache(self.max_entries, self.max_bytes)
+
+    def key(self, name, operands):
+        """Key of name applied to operands, or None if not cacheable.
+
+        name is an operator name, or a program as a tuple of tokens with
+        the mode of the RPN running it."""
+        key = [name]
+        for operand in operands:
+            kind = type(operand)
+            if kind is float:
+                if not operand or operand != operand:
+                    return None
+            elif kind is not int:
+                return None
+            key.append(kind)
+            key.append(operand)
+        return tuple(key)
+
+    def lookup(self, key):
+        """Returns whether key is in the cache, and its result."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def store(self, key, result):
+        """Add a result, evicting the least recently used ones to make
+        room. Results too large for the cache are not stored."""
+        values = result if type(result) is tuple else (result,)
+        operands = key[2::2]
+        size = (sys.getsizeof(key)
+                + sum(sys.getsizeof(value) for value in operands + values))
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (result, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries \
+                or self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def wrap(self, name, call):
+        """call, with its results looked up in and added to the cache."""
+        def cached_call(*operands):
+            key = self.key(name, operands)
+            if key is None:
+                return call(*operands)
+            found, result = self.lookup(key)
+            if not found:
+                result = call(*operands)
+                self.store(key, result)
+            return result
+        return cached_call
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         len(self.entries), self.bytes)
+
+    def report(self):
+        """The statistics as text."""
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return (f"Cache: {self.hits} hits, {self.misses} misses "
+                + f"({rate:.1%} hits), {len(self.entries)} entries of "
+                + f"{self.bytes} bytes, {self.evictions} evicted")
+
+
+def enable_cache(cache=None):
+    """Cache the results of pure operators and programs in cache, an
+    OperatorCache, for every RPN. None turns caching off.
+
+    Programs given to RPN.run() that only use pure operators are cached as
+    a whole too, keyed by the operands they take off the stack."""
+    global operator_cache
+    operator_cache = cache
+    for operator in OPERATORS.values():
+        operator.set_cache(cache)
+    compile_program.cache_clear()  # Compiled with the old calls
+
+
+# Operators taking two operands
+
+register_operator('+', 2, add)
+register_operator('-', 2, sub)
+register_operator('\u00d7', 2, mul)  # times
+register_operator('^', 2, pow)
+register_operator('%', 2, mod)
+register_operator('E', 2, lambda operand1, operand2:
+                  operand1 * 10 ** operand2)
+register_operator('nCk', 2, math.comb)
+
+
+@register_operator('/', 2)
+def divide(operand1, operand2):
+    if operand2 == 0:
+        raise ZeroDivisionError("Division by zero is undefined.")
+    elif operand1 % operand2 == 0:
+        # Keeps the result an int if possible
+        return operand1 // operand2
+    else:
+        return operand1 / operand2
+
+
+@register_operator('\u00f7', 2)  # Division symbol for integer division
+def integer_divide(operand1, operand2):
+    if operand2 == 0:
+        raise ZeroDivisionError("Division by zero is undefined.")
+    return operand1 // operand2
+
+
+@register_operator('n\u221a', 2)  # nth root
+def nth_root(operand1, operand2):
+    if operand1 < 0:
+        raise ValueError("Root of negative numbers not supported.")
+    return operand1 ** (1/operand2)
+
+
+@register_operator('\u2295', 2)  # Circled pluss
+def root_sum_square(operand1, operand2):
+    return math.sqrt(operand1**2 + operand2**2)
+
+
+# Operators taking a single operand
+
+for name, function in (('sin', math.sin),
+                       ('cos', math.cos),
+                       ('tan', math.tan),
+                       ('asin', math.asin),
+                       ('acos', math.acos),
+                       ('atan', math.atan),
+                       ('sinh', math.sinh),
+                       ('cosh', math.cosh),
+                       ('tanh', math.tanh),
+                       ('asinh', math.asinh),
+                       ('acosh', math.acosh),
+                       ('atanh', math.atanh),
+                       ('ln', math.log),
+                       ('lg2', math.log2),
+                       ('log', math.log10),
+                       ('=', int),  # Rounds last operand to an int
+                       ('1/x', lambda operand: 1 / operand),
+                       ('x^2', lambda operand: operand ** 2),
+                       ('2^x', lambda operand: 2 ** operand),
+                       ):
+    register_operator(name, 1, function)
+
+
+@register_operator('\u221a', 1)  # root
+def square_root(operand):
+    if operand < 0:
+        raise ValueError("Root of negative numbers not supported.")
+    return math.sqrt(operand)
+
+
+@register_operator('!', 1)
+def factorial(operand):
+    if type(operand) == int:
+        return math.factorial(operand)
+    else:
+        return math.gamma(operand + 1)
+
+
+@register_operator('\u2684', 1, pure=False)  # dice5
+def dice(operand):
+    return math.ceil(operand * random.random())
+
+
+# Operators taking no operands
+
+register_operator('\u03c0', 0, lambda: math.pi)  # pi
+register_operator('\u03c4', 0, lambda: 2 * math.pi)  # tau
+register_operator('e', 0, lambda: math.e)
+register_operator('\u03c6', 0, lambda: (1 + math.sqrt(5))/2)  # phi
+register_operator('Rand', 0, random.random, pure=False)
+
+
+# Operators rearranging the stack
+
+register_operator('swap', 2, lambda operand1, operand2: (operand2, operand1),
+                  results=2)
+register_operator('dup', 1, lambda operand: (operand, operand), results=2)
+register_operator('drop', 1, lambda operand: (), results=0)
+
+
+# Operators taking the whole stack, like \u03a3, or the top k values of it
+# with the count k on top, like 3 \u03a3k
+
+def register_stack_operator(name, function=None, results=1):
+    """Register name on the whole stack, and name + 'k' on the top k
+    values. Use as a function or as a decorator."""
+    def register(function):
+        register_operator(name, None, function, results=results)
+        register_operator(name + 'k', None, function, results=results,
+                          counted=True)
+        return function
+    if function is None:
+        return register
+    return register(function)
+
+
+@register_stack_operator('\u03a3')  # Sum
+def stack_sum(*operands):
+    """Exact for ints, and correctly rounded for floats."""
+    total = sum(operands)
+    if type(total) is float:
+        return math.fsum(operands)
+    return total  # An int, or an Approx if an operand is one
+
+
+register_stack_operator('\u03a0', lambda *operands: math.prod(operands))
+register_stack_operator('min', lambda *operands: min(operands))
+register_stack_operator('max', lambda *operands: max(operands))
+register_stack_operator('sort', lambda *operands: sorted(operands),
+                        results=None)
+
+
+@register_stack_operator('mean')
+def mean(*operands):
+    if not operands:
+        raise ValueError("The mean of no values is undefined.")
+    return stack_sum(*operands) / len(operands)
+
+
+@register_stack_operator('var')  # Sample variance
+def variance(*operands):
+    if len(operands) < 2:
+        raise ValueError("The variance needs at least two values.")
+    average = mean(*operands)
+    return (stack_sum(*[(operand - average) ** 2 for operand in operands])
+            / (len(operands) - 1))
+
+
+register_stack_operator('stdev', lambda *operands:
+                        square_root_approximation(variance(*operands)))
+
+
+@register_stack_operator('dot')
+def dot(*operands):
+    """Dot product of the lower and upper half of the operands."""
+    half, odd = divmod(len(operands), 2)
+    if odd:
+        raise ValueError("The dot product needs an even number of values.")
+    return stack_sum(*map(mul, operands[:half], operands[half:]))
+
+
+# Array versions of the operators, used for operands that are NumPy arrays.
+# Every operator on numbers has one, if only to run under the floating point
+# error checks of Operator.set_vector(). Errors that the scalar version
+# raises for one operand are raised here if any element would cause them,
+# and integer results too large for int64 are computed exactly, on arrays of
+# Python ints.
+
+LANCZOS_G = 7
+LANCZOS_COEFFICIENTS = (0.99999999999980993, 676.5203681218851,
+                        -1259.1392167224028, 771.32342877765313,
+                        -176.61502916214059, 12.507343278686905,
+                        -0.13857109526572012, 9.9843695780195716e-6,
+                        1.5056327351493116e-7)
+FACTORIALS = tuple(math.factorial(n) for n in range(21))  # Fit in int64
+INT64_BITS = 63  # Values of int64 are below 2^63
 
-class RPN():
-    stack = []  # Stack for RPN calculation
-    operator_2 = {'+', '-', '\u00d7',  # times
-                  '/', '^', '\u00f7',  # int div
-                  '%', 'n\u221a',  # nth root
-                  'E', 'nCk',
-                  '\u2295',  # circled pluss
-                  }
-    operator_1 = {'\u221a',  # root
-                  'sin', 'cos', 'tan', 'asin', 'acos', 'atan',
-                  'sinh', 'cosh', 'tanh', 'asinh', 'acosh', 'atanh',
-                  'ln', 'log', 'lg2',
-                  '1/x', '!', '=', '2^x', 'x^2', '\u2684'}  # dice5
-    operator_0 = {'\u03c0', '\u03c4', '\u03c6', 'e', 'Rand'}  # pi, tau, phi, e
-
-    def evaluate_two(self, expression):
-        """Operate operators taking two operands."""
 
+def log_gamma_array(x):
+    """Natural logarithm of the gamma function for an array of x >= 0.5.
+
+    Uses the Lanczos approximation, good to about 15 digits."""
+    x = np.asarray(x, dtype=float) - 1
+    series = LANCZOS_COEFFICIENTS[0]
+    for index, coefficient in enumerate(LANCZOS_COEFFICIENTS[1:], 1):
+        series = series + coefficient / (x + index)
+    t = x + LANCZOS_G + 0.5
+    return (0.5 * math.log(2 * math.pi) + (x + 0.5) * np.log(t) - t
+            + np.log(series))
+
+
+def gamma_array(x):
+    """The gamma function for an array, using reflection below 0.5."""
+    x = np.asarray(x, dtype=float)
+    reflect = x < 0.5
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        result = np.exp(log_gamma_array(np.where(reflect, 1 - x, x)))
+        return np.where(reflect,
+                        math.pi / (np.sin(math.pi * x) * result),
+                        result)
+
+
+def is_integer_array(value):
+    """True for ints, and arrays of an integer dtype or of Python ints."""
+    if isinstance(value, int):
+        return True
+    value = np.asarray(value)
+    if value.dtype.kind == 'O':
+        return all(type(element) is int for element in value.flat)
+    return value.dtype.kind in 'iub'
+
+
+def float_array(operand):
+    """operand as an array of floats if it is an array of Python ints.
+
+    Raises OverflowError for ints too large for a float, like float()."""
+    operand = np.asarray(operand)
+    if operand.dtype.kind == 'O':
+        return operand.astype(float)
+    return operand
+
+
+def largest(operand):
+    """The largest absolute value in an integer array, as an int."""
+    operand = np.asarray(operand)
+    if not operand.size:
+        return 0
+    return max(int(operand.max()), -int(operand.min()))
+
+
+def exact_integers(bits, *operands):
+    """operands, as arrays of Python ints if an integer result below
+    2^bits may not fit in int64."""
+    if bits <= INT64_BITS:
+        return operands
+    return tuple(np.asarray(operand, dtype=object) for operand in operands)
+
+
+def check_no_zero(operand):
+    if np.any(np.asarray(operand) == 0):
+        raise ZeroDivisionError("Division by zero is undefined.")
+
+
+def check_no_negative(operand):
+    if np.any(np.asarray(operand) < 0):
+        raise ValueError("Root of negative numbers not supported.")
+
+
+def arithmetic_array(ufunc, bits):
+    """The array version of an arithmetic operator, the NumPy ufunc named
+    ufunc.
+
+    bits gives a bound of the bits of an integer result from the bits of
+    the operands. Floats overflow to inf and give NaN like they do in
+    Python, without an error."""
+    def vector(operand1, operand2):
+        if is_integer_array(operand1) and is_integer_array(operand2):
+            operand1, operand2 = exact_integers(
+                bits(largest(operand1).bit_length(),
+                     largest(operand2).bit_length()),
+                operand1, operand2)
+        with np.errstate(all='ignore'):
+            return getattr(np, ufunc)(operand1, operand2)
+    return vector
+
+
+register_vector('+')(arithmetic_array(
+    'add', lambda bits1, bits2: max(bits1, bits2) + 1))
+register_vector('-')(arithmetic_array(
+    'subtract', lambda bits1, bits2: max(bits1, bits2) + 1))
+multiply_array = register_vector('\u00d7')(arithmetic_array(
+    'multiply', lambda bits1, bits2: bits1 + bits2))
+
+
+@register_vector('^')
+def power_array(operand1, operand2):
+    if is_integer_array(operand2):
+        if np.any(np.asarray(operand2) < 0):
+            # NumPy refuses negative integer powers of integers
+            return np.float_power(float_array(operand1),
+                                  float_array(operand2))
+        if is_integer_array(operand1):
+            base = largest(operand1)
+            # With room for the rounding of the logarithm
+            bits = largest(operand2) * math.log2(base) + 0.01 \
+                if base > 1 else 0
+            operand1, operand2 = exact_integers(bits, operand1, operand2)
+    return np.power(operand1, operand2)
+
+
+@register_vector('E')
+def scientific_array(operand1, operand2):
+    return multiply_array(operand1, power_array(10, operand2))
+
+
+@register_vector('/')
+def divide_array(operand1, operand2):
+    check_no_zero(operand2)
+    if (is_integer_array(operand1) and is_integer_array(operand2)
+            and not np.any(np.remainder(operand1, operand2))):
+        # Keeps the result ints if possible
+        return np.floor_divide(operand1, operand2)
+    return np.true_divide(operand1, operand2)
+
+
+register_vector('%')(lambda operand1, operand2:
+                     np.remainder(operand1, operand2))
+
+
+@register_vector('\u00f7')  # Integer division
+def integer_divide_array(operand1, operand2):
+    check_no_zero(operand2)
+    return np.floor_divide(operand1, operand2)
+
+
+@register_vector('n\u221a')  # nth root
+def nth_root_array(operand1, operand2):
+    check_no_negative(operand1)
+    return np.power(float_array(operand1), np.true_divide(1, operand2))
+
+
+@register_vector('\u2295')  # Circled pluss
+def root_sum_square_array(operand1, operand2):
+    return np.hypot(float_array(operand1), float_array(operand2))
+
+
+@register_vector('nCk')
+def comb_array(operand1, operand2):
+    """n choose k through the log gamma function, rounded to whole numbers.
+
+    Exact while the result is below about 10^12."""
+    n = np.asarray(operand1)
+    k = np.asarray(operand2)
+    if np.any(n < 0) or np.any(k < 0):
+        raise ValueError("n and k must be non-negative")
+    possible = k <= n
+    rest = np.where(possible, n - k, 0)
+    with np.errstate(over='ignore'):
+        result = np.exp(log_gamma_array(n + 1) - log_gamma_array(k + 1)
+                        - log_gamma_array(rest + 1))
+    return np.where(possible, np.rint(result), 0.0)
+
+
+@register_vector('\u221a')  # root
+def square_root_array(operand):
+    check_no_negative(operand)
+    return np.sqrt(float_array(operand))
+
+
+@register_vector('!')
+def factorial_array(operand):
+    if is_integer_array(operand):
+        operand = np.asarray(operand)
+        if np.any(operand < 0):
+            raise ValueError("factorial() not defined for negative values")
+        if np.all(operand < len(FACTORIALS)):
+            # Exact while the factorials fit in int64
+            return np.array(FACTORIALS, dtype=np.int64)[
+                operand.astype(np.int64)]
+        return np.frompyfunc(math.factorial, 1, 1)(operand)
+    operand = np.add(float_array(operand), 1)
+    if np.any((operand <= 0) & (operand == np.floor(operand))):
+        raise ValueError("math domain error")  # Poles of the gamma function
+    result = gamma_array(operand)
+    if np.any(np.isinf(result) & np.isfinite(operand)):
+        raise OverflowError("math range error")
+    return result
+
+
+@register_vector('=')  # Rounds towards zero
+def truncate_array(operand):
+    if is_integer_array(operand):
+        return np.asarray(operand)
+    truncated = np.trunc(float_array(operand))
+    if np.all(np.abs(truncated) < 2.0 ** INT64_BITS):
+        return truncated.astype(np.int64)
+    # Exact, or an error for inf and NaN, like int()
+    return np.frompyfunc(int, 1, 1)(truncated)
+
+
+register_vector('1/x')(lambda operand: np.true_divide(1, operand))
+register_vector('x^2')(lambda operand: power_array(operand, 2))
+
+
+@register_vector('2^x')
+def power_of_two_array(operand):
+    return power_array(2, operand)
+
+
+@register_vector('\u2684')  # dice
+def dice_array(operand):
+    operand = float_array(operand)
+    return np.ceil(operand * np.random.random(operand.shape))
+
+
+def float_function_array(ufunc):
+    """The array version of an operator on floats, the NumPy ufunc named
+    ufunc."""
+    def vector(operand):
+        return getattr(np, ufunc)(float_array(operand))
+    return vector
+
+
+for name, ufunc in (('sin', 'sin'), ('cos', 'cos'), ('tan', 'tan'),
+                    ('asin', 'arcsin'), ('acos', 'arccos'),
+                    ('atan', 'arctan'),
+                    ('sinh', 'sinh'), ('cosh', 'cosh'), ('tanh', 'tanh'),
+                    ('asinh', 'arcsinh'), ('acosh', 'arccosh'),
+                    ('atanh', 'arctanh'),
+                    ('ln', 'log'), ('lg2', 'log2'), ('log', 'log10')):
+    register_vector(name)(float_function_array(ufunc))
+
+
+# Approximate numbers, for results too large to compute exactly. In the
+# approximate mode of an RPN the heavy operators give an Approx instead of
+# a huge int or an overflow, see RPN.set_approximate().
+
+APPROXIMATE_BITS = 2 ** 15  # Exact results larger than this are approximated
+LN10 = math.log(10)
+
+
+class Approx():
+    """The number sign \u00d7 10^log10.
+
+    log10 is a float, so the digits of its integer part leave fewer for
+    the fraction: the mantissa is known to about 15 significant digits
+    less the digits of the exponent, 9 for 100000 !. Only those are shown.
+
+    Arithmetic with numbers and other Approx gives an Approx, or a number
+    again once the result is small enough, and float() converts it back if
+    it fits. Its remainder is not known, so % raises ValueError. recipe is
+    the name of the operator and the operands that give the exact value,
+    so exact() can compute it on demand. It is None for values restored
+    from a session."""
+    __slots__ = ('sign', 'log10', 'recipe')
+
+    def __init__(self, sign, log10, recipe=None):
+        if not math.isfinite(log10):
+            raise OverflowError("Too large even to approximate.")
+        self.sign = sign
+        self.log10 = log10
+        self.recipe = recipe
+
+    def exact(self):
+        """The exact value, which may take long to compute.
+
+        Raises ValueError if the recipe is not known."""
+        if self.recipe is None:
+            raise ValueError("The exact value is not known.")
+        name, operands = self.recipe
+        return OPERATORS[name].function(*[
+            operand.exact() if isinstance(operand, Approx) else operand
+            for operand in operands])
+
+    def bit_length(self):
+        """Bits in the integer part of the exact value, like int has."""
+        return max(0, math.floor(self.log10 / math.log10(2)) + 1)
+
+    def significant_digits(self):
+        """The digits of the mantissa that log10 is precise enough for."""
+        return max(1, 15 - len(str(abs(math.floor(self.log10)))))
+
+    def __str__(self):
+        return format(self, '')
+
+    def __format__(self, spec):
+        """Format the mantissa by spec, like '.12g', but with no more
+        significant digits than are known."""
+        digits = self.significant_digits()
+        head, dot, precision = spec.rpartition('.')
+        if dot and precision[:-1].isdigit() and precision[-1:] in 'gG':
+            digits = min(digits, int(precision[:-1]))
+            spec = f"{head}.{digits}{precision[-1]}"
+        elif not spec:
+            spec = f".{digits}g"
+        exponent = math.floor(self.log10)
+        mantissa = round(self.sign * 10 ** (self.log10 - exponent),
+                         digits - 1)
+        if abs(mantissa) >= 10:
+            # Rounded up to the next power of 10
+            mantissa /= 10
+            exponent += 1
+        return f"{mantissa:{spec}}\u00d710^{exponent}"
+
+    def __repr__(self):
+        return f"Approx({self.sign}, {self.log10!r})"
+
+    def __float__(self):
         try:
-            operand1 = expression[0]
-            operand2 = expression[1]
-            operator = expression[2]  # Operator
-            # _ = float(operand1)
-            # _ = float(operand2)
-        except ValueError as e:
-            # Does this ever happen?
-            messagebox.showerror("ValueError", f"{str(e)}")
-            return None
-        except TypeError as e:
-            # Does this ever happen?
-            messagebox.showerror("TypeError", f"{str(e)}")
-            return None
-        except IndexError:
-            messagebox.showerror("IndexError",
-                                 f"Too few operands to {expression}.")
-            return None
-        # Perform the operation based on the operator
-        if operator == '+':
-            try:
-                return operand1 + operand2
-            except OverflowError as e:
-                messagebox.showerror("OverflowError", str(e))
-        elif operator == '-':
-            return operand1 - operand2
-        elif operator == '\u00d7':  # times
+            return self.sign * 10.0 ** self.log10
+        except OverflowError:
+            raise OverflowError("Too large for a float.") from None
+
+    def __int__(self):
+        return int(self.exact())
+
+    def __bool__(self):
+        return True  # Zero is never approximated
+
+    def __hash__(self):
+        return hash((self.sign, self.log10))
+
+    def __eq__(self, other):
+        if not isinstance(other, (int, float, Approx)):
+            return NotImplemented
+        return compare_key(self) == compare_key(other)
+
+    def __lt__(self, other):
+        return compare_key(self) < compare_key(other)
+
+    def __le__(self, other):
+        return compare_key(self) <= compare_key(other)
+
+    def __gt__(self, other):
+        return compare_key(self) > compare_key(other)
+
+    def __ge__(self, other):
+        return compare_key(self) >= compare_key(other)
+
+    def __neg__(self):
+        return Approx(-self.sign, self.log10, ('\u00d7', (self, -1)))
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Approx(1, self.log10, ('\u00d7', (self, self.sign)))
+
+    def __add__(self, other):
+        return approximate_sum(self, other, 1, ('+', (self, other)))
+
+    def __radd__(self, other):
+        return approximate_sum(other, self, 1, ('+', (other, self)))
+
+    def __sub__(self, other):
+        return approximate_sum(self, other, -1, ('-', (self, other)))
+
+    def __rsub__(self, other):
+        return approximate_sum(other, self, -1, ('-', (other, self)))
+
+    def __mul__(self, other):
+        return approximate_product(self, other, 1, ('\u00d7', (self, other)))
+
+    def __rmul__(self, other):
+        return approximate_product(other, self, 1, ('\u00d7', (other, self)))
+
+    def __truediv__(self, other):
+        return approximate_product(self, other, -1, ('/', (self, other)))
+
+    def __rtruediv__(self, other):
+        return approximate_product(other, self, -1, ('/', (other, self)))
+
+    def __floordiv__(self, other):
+        return floor_quotient(self / other)
+
+    def __rfloordiv__(self, other):
+        return floor_quotient(other / self)
+
+    def __mod__(self, other):
+        raise ValueError("The remainder of an approximation is not known, "
+                         + "use = for the exact value first.")
+
+    def __rmod__(self, other):
+        if not abs(self) > abs(other):
+            return self.__mod__(other)
+        if not other or (other > 0) == (self.sign > 0):
+            return other  # Like 5 % 7
+        return approximate_sum(other, self, 1, ('%', (other, self)))
+
+    def __pow__(self, other):
+        return approximate_power(self, other, ('^', (self, other)))
+
+    def __rpow__(self, other):
+        return approximate_power(other, self, ('^', (other, self)))
+
+
+def split_log(value):
+    """Sign and log10 of the absolute value of a number or Approx."""
+    if isinstance(value, Approx):
+        return value.sign, value.log10
+    if value == 0:
+        return 0, -math.inf
+    return (1 if value > 0 else -1), math.log10(abs(value))
+
+
+def compare_key(value):
+    """Key ordering numbers and Approx by value."""
+    sign, log10 = split_log(value)
+    return (sign, sign * log10) if sign else (0, 0)
+
+
+def approximation(sign, log10, recipe):
+    """sign \u00d7 10^log10 as an Approx, or as a float if it is small
+    enough to be one, or an int if that is within the precision."""
+    if not sys.float_info.min_10_exp < log10 < 15:
+        return Approx(sign, log10, recipe)
+    value = sign * 10 ** log10
+    rounded = round(value)
+    if rounded and abs(value - rounded) <= 1e-9 * abs(value):
+        return rounded
+    return value
+
+
+def floor_quotient(quotient):
+    """Round down the result of dividing with an Approx, unless the
+    fraction is below the precision."""
+    if not isinstance(quotient, Approx):
+        return math.floor(quotient)
+    if quotient.log10 < 0:
+        return 0 if quotient.sign > 0 else -1
+    return quotient
+
+
+def approximate_sum(operand1, operand2, direction, recipe):
+    """operand1 + direction \u00d7 operand2, direction 1 or -1, as an Approx
+    or a number, see approximation()."""
+    sign1, log1 = split_log(operand1)
+    sign2, log2 = split_log(operand2)
+    sign2 *= direction
+    if not sign2:
+        return operand1
+    if not sign1:
+        return operand2 if direction > 0 else -operand2
+    if log1 < log2:
+        sign1, log1, sign2, log2 = sign2, log2, sign1, log1
+    ratio = 10 ** (log2 - log1)  # Of the smaller to the larger, up to 1
+    if sign1 == sign2:
+        return approximation(sign1, log1 + math.log10(1 + ratio), recipe)
+    if ratio >= 1:
+        return 0
+    return approximation(sign1, log1 + math.log10(1 - ratio), recipe)
+
+
+def approximate_product(operand1, operand2, power, recipe):
+    """operand1 \u00d7 operand2^power, power 1 or -1, as an Approx or a
+    number, see approximation()."""
+    sign1, log1 = split_log(operand1)
+    sign2, log2 = split_log(operand2)
+    if not sign2 and power < 0:
+        raise ZeroDivisionError("Division by zero is undefined.")
+    if not sign1 or not sign2:
+        return 0
+    return approximation(sign1 * sign2, log1 + power * log2, recipe)
+
+
+def approximate_power(base, exponent, recipe):
+    """base^exponent as an Approx or a number, see approximation()."""
+    if isinstance(exponent, Approx):
+        if exponent.log10 > 15:
+            raise OverflowError("Too large even to approximate.")
+        exponent = float(exponent)
+    sign, log10 = split_log(base)
+    if exponent == 0:
+        return 1
+    if not sign:
+        if exponent < 0:
+            raise ZeroDivisionError("0 cannot be raised to a negative "
+                                    + "power.")
+        return 0
+    if sign < 0:
+        if exponent % 1:
+            raise ValueError("Negative numbers have no fractional powers.")
+        sign = -1 if exponent % 2 else 1
+    return approximation(sign, log10 * exponent, recipe)
+
+
+APPROXIMATIONS = {}  # Approximate versions of operators by name
+
+
+def register_approximation(name):
+    """Decorator adding the approximate version of operator name.
+
+    It is used in approximate mode when an operand is an Approx, when the
+    exact result would be larger than APPROXIMATE_BITS, or when the exact
+    version overflows."""
+    def register(approximation):
+        APPROXIMATIONS[name] = approximation
+        return approximation
+    return register
+
+
+@register_approximation('!')
+def factorial_approximation(operand):
+    if isinstance(operand, Approx):
+        raise OverflowError("Too large even to approximate.")
+    if operand < 0:
+        return factorial(operand)  # Never large
+    return Approx(1, math.lgamma(operand + 1) / LN10, ('!', (operand,)))
+
+
+@register_approximation('nCk')
+def comb_approximation(operand1, operand2):
+    if (type(operand1) is not int or type(operand2) is not int
+            or operand2 < 0 or operand2 > operand1):
+        return math.comb(operand1, operand2)  # An error, or 0
+    log = (math.lgamma(operand1 + 1) - math.lgamma(operand2 + 1)
+           - math.lgamma(operand1 - operand2 + 1))
+    return Approx(1, log / LN10, ('nCk', (operand1, operand2)))
+
+
+@register_approximation('^')
+def power_approximation(operand1, operand2):
+    return approximate_power(operand1, operand2, ('^', (operand1, operand2)))
+
+
+@register_approximation('2^x')
+def power_of_two_approximation(operand):
+    return approximate_power(2, operand, ('2^x', (operand,)))
+
+
+@register_approximation('E')
+def scientific_approximation(operand1, operand2):
+    if isinstance(operand2, Approx):
+        raise OverflowError("Too large even to approximate.")
+    sign, log10 = split_log(operand1)
+    if not sign:
+        return 0
+    return Approx(sign, log10 + operand2, ('E', (operand1, operand2)))
+
+
+@register_approximation('/')
+def divide_approximation(operand1, operand2):
+    if isinstance(operand1, Approx) or isinstance(operand2, Approx):
+        return approximate_product(operand1, operand2, -1,
+                                   ('/', (operand1, operand2)))
+    return divide(operand1, operand2)
+
+
+@register_approximation('\u221a')  # root
+def square_root_approximation(operand):
+    if not isinstance(operand, Approx):
+        return square_root(operand)
+    if operand.sign < 0:
+        raise ValueError("Root of negative numbers not supported.")
+    return Approx(1, operand.log10 / 2, ('\u221a', (operand,)))
+
+
+for name, function, scale in (('ln', math.log, LN10),
+                              ('log', math.log10, 1),
+                              ('lg2', math.log2, 1 / math.log10(2))):
+    def log_approximation(operand, function=function, scale=scale):
+        if not isinstance(operand, Approx):
+            return function(operand)
+        if operand.sign < 0:
+            raise ValueError("math domain error")
+        return operand.log10 * scale
+    register_approximation(name)(log_approximation)
+
+
+# Plain text spellings of operators
+ALIASES = {'*': '\u00d7', 'sum': '\u03a3', 'sumk': '\u03a3k',
+           'prod': '\u03a0', 'prodk': '\u03a0k'}
+
+
+def parse_number(text):
+    """Convert a number token to an int, or a float if it has a point
+    or an exponent.
+
+    Raises ValueError if text is not a number."""
+    if "." not in text and "e" not in text and "E" not in text:
+        return int(text)
+    else:
+        return float(text)
+
+
+def token_pattern():
+    """Regex matching the next token of a program, and whitespace before it.
+
+    Tried in order, a token is
+    - a signed number, if the sign starts a word, like -3 or +.5e-3
+    - the longest operator or alias starting here
+    - an unsigned number, like 3, 2.5, 1e5 or 1_000, that does not run
+      into an operator starting with a digit, so 21/x is 2 and 1/x
+    - anything else up to the next whitespace, which is not a number.
+    The pattern is anchored at every token, so splitting a program takes
+    time linear in its length."""
+    if 'token' not in TOKEN_PATTERNS:
+        import re
+
+        names = sorted(set(OPERATORS) | set(ALIASES), key=len, reverse=True)
+        operators = '|'.join(re.escape(name) for name in names)
+        digit_operators = '|'.join(re.escape(name) for name in names
+                                   if name[0].isdigit())
+        digit = rf'(?:(?!{digit_operators})\d)' if digit_operators \
+            else r'\d'
+        # Digits may be grouped by underscores, as int() and float() allow
+        digits = rf'{digit}+(?:_{digit}+)*'
+        number = (rf'(?:{digits}\.?(?:{digits})?|\.{digits})'
+                  + rf'(?:[eE][+-]?{digits})?')
+        TOKEN_PATTERNS['token'] = re.compile(
+            rf'\s*((?<!\S)[+-]{number}|{operators}|{number}|\S+)')
+    return TOKEN_PATTERNS['token']
+
+
+def tokenize(text):
+    """Split a program into tokens, with aliases replaced.
+
+    Tokens may be separated by whitespace or written together, so
+    '3 4 + 5 \u00d7' and '3 4+5\u00d7' are the same program.
+
+    >>> tokenize('1 2 3 4 5+*-/')
+    ['1', '2', '3', '4', '5', '+', '\u00d7', '-', '/']
+    >>> tokenize('2.5e-3 -4 21/x')
+    ['2.5e-3', '-4', '2', '1/x']
+    """
+    return [ALIASES.get(token, token) for token in
+            token_pattern().findall(text)]
+
+
+def split_program(program):
+    """Split a program into tokens, with aliases replaced.
+
+    program is a string, or a sequence of tokens already."""
+    if isinstance(program, str):
+        return tokenize(program)
+    return [ALIASES.get(token, token) for token in program]
+
+
+def operands_needed(tokens):
+    """How many values already on the stack the tokens take.
+
+    math.inf if that depends on the values, as for \u03a3."""
+    depth = 0
+    lowest = 0
+    for token in tokens:
+        operator = OPERATORS.get(token)
+        if operator is None:
+            depth += 1
+        elif operator.arity is None:
+            return math.inf
+        else:
+            depth -= operator.arity
+            lowest = min(lowest, depth)
+            depth += operator.results
+    return -lowest
+
+
+# Operators that can take seconds with large operands
+HEAVY_OPERATORS = {'!', 'nCk', '^', 'E', '2^x'}
+SLOW_BITS = 2 ** 20  # Size of a result that takes long enough to notice
+
+
+def result_size(operator, operands):
+    """Rough number of bits in the result of operator, as a measure of the
+    time it takes.
+
+    Only arithmetic on big ints gets slow, and the size of the result is
+    known up front for the heavy operators. Anything else counts as the
+    size of its largest operand, with 64 bits for floats.
+
+    >>> result_size(OPERATORS['!'], [100000]) > SLOW_BITS
+    True
+    """
+    sizes = [operand.bit_length() if type(operand) in (int, Approx) else 64
+             for operand in operands]
+    name = operator.name
+    if name not in HEAVY_OPERATORS or any(type(operand) is not int
+                                          for operand in operands):
+        return max(sizes, default=64)
+    if name == '!':
+        return operands[0] * sizes[0]  # log2(n!) < n log2(n)
+    if name == 'nCk':
+        return operands[0]  # n choose k < 2^n
+    if name == '^' and operands[1] > 0:
+        return sizes[0] * operands[1]
+    if name == 'E' and operands[1] > 0:
+        return sizes[0] + 4 * operands[1]  # log2(10) < 4
+    if name == '2^x':
+        return operands[0]
+    return max(sizes)
+
+
+def evaluate_tokens(operands, tokens):
+    """Apply tokens to a stack of operands and return the stack.
+
+    Meant for worker processes. Raises RPNError if a token fails."""
+    rpn = RPN()
+    rpn.stack.extend(operands)
+    for token in tokens:
+        rpn.apply_token(token)
+    return rpn.stack
+
+
+COMPILE_CACHE_SIZE = 4096  # Compiled programs kept by RPN.compile
+
+
+FOLD_BITS = 2 ** 10  # Largest result of constants folded by plan_program
+Plan = collections.namedtuple('Plan', 'items needed pure parsed')
+
+
+def plan_program(tokens):
+    """Plan the evaluation of a program, a tuple of tokens.
+
+    Numbers are parsed and operators looked up once, user-defined words
+    are inlined, and pure operators on constants are folded into their
+    result if it is small, so '\u03c0 2 \u00d7' becomes a single number.
+    Returns a Plan of
+    - items, the values to push and Operators to apply, in order
+    - needed, the number of operands taken off the stack, up to the first
+      operator taking a varying number of them, like \u03a3
+    - pure, True if the program only uses pure operators, and takes a
+      fixed number of operands
+    - parsed, False if a token is neither a number nor an operator.
+    Plans are cached by tokens."""
+    plan = PROGRAM_PLANS.get(tokens)
+    if plan is not None:
+        return plan
+    items = []
+    constants = 0  # Values at the end of items
+    depth = lowest = 0
+    pure = parsed = True
+    for token in inline_words(tokens) if WORDS else tokens:
+        operator = OPERATORS.get(token)
+        if operator is None:
             try:
-                return operand1 * operand2
-            except OverflowError as e:
-                messagebox.showerror("OverflowError", str(e))
-        elif operator == '/' or operator == '\u00f7':
-            # \u00f7 is division symbol for integer division
-            if operand2 == 0:
-                messagebox.showerror("Error",
-                                     "Division by zero is undefined.")
-            elif operand1 % operand2 == 0 or operator == '\u00f7':
-                # Keeps the result an int if possible
-                return operand1 // operand2
-            else:
-                return operand1 / operand2
-        elif operator == '^':
+                items.append(parse_number(token))
+            except ValueError:
+                pure = parsed = False
+                break
+            constants += 1
+            depth += 1
+            continue
+        arity = operator.arity
+        if arity is None:
+            # Takes a number of operands only known when run
+            if operator.counted:
+                lowest = min(lowest, depth - 1)
+            depth = math.inf
+            pure = False
+            items.append(operator)
+            constants = 0
+            continue
+        depth -= arity
+        if depth < lowest:
+            lowest = depth
+        depth += operator.results
+        if not operator.pure:
+            pure = False
+        elif constants >= arity:
+            operands = items[len(items) - arity:]
+            if (operator.name not in HEAVY_OPERATORS
+                    or result_size(operator, operands) <= FOLD_BITS):
+                try:
+                    value = operator.call(*operands)
+                except operator.errors:
+                    pass  # Fails when run, in the usual way
+                else:
+                    del items[len(items) - arity:]
+                    if operator.results == 1:
+                        items.append(value)
+                    else:
+                        items.extend(value)
+                    constants += operator.results - arity
+                    continue
+        items.append(operator)
+        constants = 0
+    plan = Plan(items, -lowest, pure, parsed)
+    if len(PROGRAM_PLANS) >= COMPILE_CACHE_SIZE:
+        PROGRAM_PLANS.clear()
+    PROGRAM_PLANS[tokens] = plan
+    return plan
+
+
+def check_program(tokens, depth):
+    """Raise the first error running tokens on depth values would hit
+    before computing anything: StackUnderflowError or ParseError. The
+    token attribute of the error is the token that would fail.
+
+    Underflow is only checked up to the first operator taking a varying
+    number of operands, like \u03a3."""
+    for token in tokens:
+        operator = OPERATORS.get(token)
+        error = None
+        if operator is None:
             try:
-                return operand1 ** operand2
-            except OverflowError as e:
-                messagebox.showerror("OverflowError", str(e))
-        elif operator == '%':
-            return operand1 % operand2
-        elif operator == 'n\u221a':
-            if operand1 < 0:
-                messagebox.showerror("Error",
-                                     "Root of negative numbers not supported.")
-                return None
+                parse_number(token)
+            except ValueError:
+                error = ParseError("Invalid input. \n"
+                                   + f"I don't think '{token}' is a number.")
+            depth += 1
+        elif operator.arity is None:
+            if operator.counted and depth < 1:
+                error = StackUnderflowError(f"Too few operands to {token}.",
+                                            depth)
+            depth = math.inf
+        elif depth < operator.arity:
+            error = StackUnderflowError(f"Too few operands to {token}.", depth)
+        else:
+            depth += operator.results - operator.arity
+        if error is not None:
+            error.token = token
+            raise error
+
+
+@functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_program(program, inputs=()):
+    """Build a Python function evaluating program.
+
+    program is normalized text, tokens separated by single spaces. Every
+    name in inputs is a slot in the program filled from the arguments of
+    the returned function, in order. The program is translated into a
+    single nested Python expression, so operators are looked up and
+    literals converted only once. Operators giving other than one result,
+    like swap, are assigned to variables, after what is below them on the
+    stack. Operator errors are raised as RPNError, naming the operator like
+    RPN.process_operator() does.
+
+    Raises StackUnderflowError if the program needs more operands than it
+    has, and ParseError for tokens that are not numbers or operators."""
+    tokens = program.split()
+    parameters = {name: f"_in{index}" for index, name in enumerate(inputs)}
+    for name in inputs:
+        if name in OPERATORS:
+            raise ValueError(f"Input name {name} is an operator.")
+    namespace = {}
+    operators = {}  # Operators by the name of their call in the source
+    lines = []  # Statements before the expression of the result
+    stack = []  # Python expressions of the values on the stack
+    depth = 0  # Highest stack depth reached
+    for index, token in enumerate(tokens):
+        if token in parameters:
+            stack.append(parameters[token])
+        elif token in OPERATORS:
+            operator = OPERATORS[token]
+            arity = operator.arity
+            if arity is None:
+                # The whole stack, or the values counted by a literal
+                arity = len(stack)
+                if operator.counted:
+                    count = namespace.get(stack[-1]) if stack else None
+                    if type(count) is not int or count < 0:
+                        raise ParseError(f"{token} needs a count written "
+                                         + "in the program.")
+                    stack.pop()
+                    arity = count
+            if len(stack) < arity:
+                raise StackUnderflowError(f"Too few operands to {token}.")
+            results = operator.results
+            if results is None:
+                results = arity
+            namespace[f"_op{index}"] = operator.call
+            operators[f"_op{index}"] = operator
+            if results != 1:
+                # Keep the order of evaluation of the stack below
+                for position, value in enumerate(stack):
+                    if '(' in value:
+                        lines.append(f"_s{index}_{position} = {value}")
+                        stack[position] = f"_s{index}_{position}"
+            operands = stack[len(stack) - arity:]
+            del stack[len(stack) - arity:]
+            call = f"_op{index}({', '.join(operands)})"
+            if results == 1:
+                stack.append(call)
             else:
-                return operand1 ** (1/operand2)
-        elif operator == '\u2295':  # Circled pluss
-            try:
-                return math.sqrt(operand1**2 + operand2**2)
-            except OverflowError as e:
-                messagebox.showerror("OverflowError",
-                                     f"{operand1}, {operand2}, {operator} "
-                                     + "does not work", str(e))
-        elif operator == 'E':
-            try:
-                return operand1 * 10 ** operand2
-            except OverflowError as e:
-                messagebox.showerror("OverflowError",
-                                     f"{operand1}, {operand2}, {operator} "
-                                     + "does not work", str(e))
-        elif operator == 'nCk':
+                names = [f"_r{index}_{position}"
+                         for position in range(results)]
+                if names:
+                    lines.append(f"{', '.join(names)}, = {call}")
+                else:
+                    lines.append(call)
+                stack.extend(names)
+        else:
             try:
-                return math.comb(operand1, operand2)
-            except TypeError as e:
-                messagebox.showerror("TypeError",
-                                     f"{operand1}, {operand2}, {operator} "
-                                     + "does not work", str(e))
+                namespace[f"_lit{index}"] = parse_number(token)
+            except ValueError:
+                raise ParseError(f"I don't think '{token}' is a number.")
+            stack.append(f"_lit{index}")
+        depth = max(depth, len(stack))
+
+    if len(stack) == 1:
+        result = stack[0]
+    else:
+        result = f"({', '.join(stack)})"  # Tuple of the remaining stack
+    source = (f"def evaluate({', '.join(parameters.values())}):\n"
+              + "    try:\n"
+              + "".join(f"        {line}\n" for line in lines)
+              + f"        return {result}\n"
+              + "    except _errors as error:\n"
+              + "        raise _operator_error(error, _failed_operator("
+              + "error.__traceback__.tb_lasti)) from error\n")
+    calls = {}  # Filled when the first error is raised
+
+    def failed_operator(offset):
+        if not calls:
+            calls.update(operator_calls(function, operators))
+        return calls.get(offset)
+    namespace['_errors'] = OPERATOR_ERRORS
+    namespace['_operator_error'] = operator_error
+    namespace['_failed_operator'] = failed_operator
+    exec(source, namespace)
+    function = namespace['evaluate']
+    function.program = program
+    function.inputs = inputs
+    function.depth = depth
+    function.source = source
+    return function
+
+
+def operator_calls(function, operators):
+    """The operators called by function, by the offset of the call in its
+    bytecode, where the traceback of an error raised by one points.
+
+    operators are by the name of the global holding their call. This way
+    errors in compiled programs name the operator that failed, like they
+    do when interpreted, without costing anything until one fails."""
+    import dis
+
+    calls = {}
+    loaded = []  # Operators of the calls still being built
+    call = None  # Offset and operator of the call just passed
+    for instruction in dis.get_instructions(function):
+        if call is not None:
+            # The traceback may point into the inline cache of the call
+            offset, operator = call
+            calls.update(dict.fromkeys(range(offset, instruction.offset),
+                                       operator))
+            call = None
+        if instruction.opname == 'LOAD_GLOBAL' \
+                and instruction.argval in operators:
+            loaded.append(operators[instruction.argval])
+        elif instruction.opname in ('CALL', 'CALL_FUNCTION') and loaded:
+            # Only operators are called before the handler of errors
+            call = instruction.offset, loaded.pop()
+    return calls
+
+
+Word = collections.namedtuple('Word', 'body tokens')
+# Regex of a definition, ': name body ;'
+DEFINITION = r'(?<!\S):\s+(\S+)(.*?)(?:\s;(?!\S)|$)'
+
+
+def inline_words(tokens):
+    """tokens, with the user-defined words replaced by their bodies."""
+    inlined = []
+    for token in tokens:
+        word = WORDS.get(token)
+        if word is None:
+            inlined.append(token)
         else:
-            messagebox.showerror("Error", f"Unknown 2operator {operator}.")
-        return None
+            inlined.extend(word.tokens)
+    return inlined
+
+
+def define_word(name, body):
+    """Define the word name as the program body, like ': name body ;'
+    in Forth.
+
+    The word takes the operands body needs, and gives what body leaves
+    on the stack. It is registered as an operator of that arity, pure if
+    every operator in body is, and compiled once. Programs using it
+    have its body inlined by RPN.run() and RPN.compile(). Words used in
+    body are inlined as they are now, so redefining them later does not
+    change this word.
+
+    Raises ParseError if name is a number, a built-in operator or a
+    spelling of one, like sum, or if body has a token that is neither a
+    number nor an operator, or one taking a varying number of operands,
+    like \u03a3."""
+    if name in (':', ';'):
+        raise ParseError(f"A word can't be called {name}.")
+    if name in OPERATORS and name not in WORDS:
+        raise ParseError(f"{name} is a built-in operator.")
+    if name in ALIASES:
+        raise ParseError(f"{name} is another spelling of {ALIASES[name]}.")
+    try:
+        parse_number(name)
+    except ValueError:
+        pass
+    else:
+        raise ParseError(f"{name} is a number.")
+    tokens = tuple(inline_words(split_program(body)))
+    arity = operands_needed(tokens)
+    if arity == math.inf:
+        raise ParseError("The stack effect of a word must be fixed, "
+                         + "so it can't use operators like \u03a3.")
+    check_program(tokens, arity)  # Raises ParseError for bad tokens
+    results = arity
+    for token in tokens:
+        operator = OPERATORS.get(token)
+        results += 1 if operator is None \
+            else operator.results - operator.arity
+    # The operands are the inputs at the bottom of the stack of the body
+    inputs = tuple(f":{index}" for index in range(arity))
+    function = compile_program(' '.join(inputs + tokens), inputs)
+    pure = all(OPERATORS[token].pure for token in tokens
+               if token in OPERATORS)
+    register_operator(name, arity, function, pure, results=results)
+    WORDS[name] = Word(' '.join(body.split()), tokens)
+
+
+def define_words(text):
+    """Define the words in text, written ': name body ;', and return the
+    rest of text.
+
+    A definition runs to the first ';' on its own, or the end of text.
+    Raises ParseError like define_word()."""
+    import re
+
+    definition = re.compile(DEFINITION, re.DOTALL)  # Cached by re
+    for match in definition.finditer(text):
+        define_word(match.group(1), match.group(2))
+    return definition.sub(' ', text)
+
+
+def format_duration(nanoseconds):
+    """Format a duration in ns, ms or us, as fits."""
+    for unit, size in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if nanoseconds >= size:
+            return f"{nanoseconds / size:.3g} {unit}"
+    return f"{nanoseconds} ns"
+
+
+class Instrumentation():
+    """Statistics on the tokens applied by an RPN, see RPN.instrument().
+
+    Per token it counts calls, errors and the types of the operands, and
+    keeps a histogram of the latency. Bucket n of the histogram counts the
+    calls that took less than 2^n ns, but at least 2^(n-1) ns. Numbers are
+    counted under 'number'. With trace, every token is also recorded as an
+    event for write_trace(), up to max_events of them."""
+
+    def __init__(self, trace=False, max_events=1000000):
+        self.trace = trace
+        self.max_events = max_events
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.operand_types = collections.defaultdict(collections.Counter)
+        self.histograms = collections.defaultdict(collections.Counter)
+        self.total_ns = collections.Counter()
+        self.max_depth = 0  # High-water mark of the stack depth
+        self.events = []
+        self.pid = os.getpid()
+
+    def fresh(self):
+        """An empty Instrumentation with the same settings."""
+        return Instrumentation(self.trace, self.max_events)
+
+    def record(self, name, types, started, elapsed, failed, depth):
+        """Record one token, timed in ns by time.perf_counter_ns()."""
+        self.calls[name] += 1
+        if failed:
+            self.errors[name] += 1
+        if types:
+            self.operand_types[name][types] += 1
+        self.histograms[name][elapsed.bit_length()] += 1
+        self.total_ns[name] += elapsed
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self.trace and len(self.events) < self.max_events:
+            self.events.append((name, started, elapsed, depth, self.pid))
+
+    def merge(self, other):
+        """Add the statistics of other, say from a worker process."""
+        self.calls.update(other.calls)
+        self.errors.update(other.errors)
+        for name, types in other.operand_types.items():
+            self.operand_types[name].update(types)
+        for name, histogram in other.histograms.items():
+            self.histograms[name].update(histogram)
+        self.total_ns.update(other.total_ns)
+        self.max_depth = max(self.max_depth, other.max_depth)
+        room = self.max_events - len(self.events)
+        self.events.extend(other.events[:max(room, 0)])
+
+    def report(self):
+        """The statistics as text, the most time consuming token first."""
+        lines = [f"{'token':>8} {'calls':>10} {'errors':>8} "
+                 + f"{'total ms':>10} {'mean us':>9}  operand types",
+                 ]
+        for name, total in self.total_ns.most_common():
+            calls = self.calls[name]
+            types = ", ".join(f"{'/'.join(kinds)} {count}" for kinds, count
+                              in self.operand_types[name].most_common(3))
+            lines.append(f"{name:>8} {calls:>10} {self.errors[name]:>8} "
+                         + f"{total / 1e6:>10.3f} {total / calls / 1e3:>9.3f}"
+                         + f"  {types}".rstrip())
+            histogram = self.histograms[name]
+            lines.append(" " * 9 + "latency: " + ", ".join(
+                f"<{format_duration(2 ** bucket)} {histogram[bucket]}"
+                for bucket in sorted(histogram)))
+        lines.append(f"Highest stack depth {self.max_depth}")
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """Write the events as a Chrome trace, for chrome://tracing."""
+        import json
+
+        events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': pid,
+                   'ts': started / 1e3, 'dur': elapsed / 1e3,
+                   'args': {'depth': depth}}
+                  for name, started, elapsed, depth, pid in self.events]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events}, file)
+
 
-    def evaluate_one(self, expression):
-        """Operate operators taking a single operand."""
-        # {'\u221a', 'sin', 'cos', 'tan', 'ln', 'log', 'x^2', '1/x'}
+class RPN():
+    """The calculator engine.
+
+    error_policy decides what happens when a token fails:
+    'raise' raises an RPNError, 'nan' replaces the operands of the failing
+    token by NaN and carries on, and 'skip' leaves the stack as it was and
+    carries on. With 'skip', run() skips the rest of the program and
+    restores the stack from before it. Failures are counted in
+    error_counts by type, whatever the policy.
+
+    With approximate, results too large to compute exactly are
+    approximated, see set_approximate()."""
+    operators = OPERATORS
+    instrumentation = None  # See instrument()
+    operator_2 = OPERATOR_SETS[2]
+    operator_1 = OPERATOR_SETS[1]
+    operator_0 = OPERATOR_SETS[0]
+    aliases = ALIASES
+
+    def __init__(self, error_policy='raise', approximate=False):
+        if error_policy not in ERROR_POLICIES:
+            raise ValueError(f"Unknown error policy {error_policy}.")
+        arrays_in_use()
+        self.stack = []  # Stack for RPN calculation, top is last
+        self.error_policy = error_policy
+        self.error_counts = collections.Counter()
+        self.approximate = False
+        if approximate:
+            self.set_approximate(True)
+
+    def evaluate(self, operator, operands):
+        """Apply operator to operands, raising RPNError if it fails."""
         try:
-            operand = expression[0]
-            operator = expression[1]
-        except IndexError:
-            messagebox.showerror("IndexError",
-                                 f"Too few arguments to {expression}.")
-            return None
-
-        if operator == '\u221a':
-            if operand < 0:
-                messagebox.showerror("Error",
-                                     "Root of negative numbers not supported.")
-                return None
-            else:
-                return math.sqrt(operand)
-        elif operator == 'sin':
-            return math.sin(operand)
-        elif operator == 'cos':
-            return math.cos(operand)
-        elif operator == 'tan':
-            return math.tan(operand)
-        elif operator == 'ln':
-            return math.log(operand)
-        elif operator == 'lg2':
-            return math.log2(operand)
-        elif operator == 'log':
-            return math.log10(operand)
-        elif operator == '1/x':
-            # print(operator, operand)
-            return 1 / operand
-        elif operator == 'asin':
-            return math.asin(operand)
-        elif operator == 'acos':
-            return math.acos(operand)
-        elif operator == 'atan':
-            return math.atan(operand)
-        elif operator == '!':
-            if type(operand) == int:
-                return math.factorial(operand)
-            else:
-                return math.gamma(operand + 1)
-        elif operator == '=':  # Rounds last operand to an int
-            return int(operand)
-        elif operator == 'x^2':  # Depricated  # Reintroduced
-            try:
-                return operand ** 2
-            except OverflowError as e:
-                messagebox.showerror("OverflowError", str(e))
-        elif operator == '2^x':
+            return operator.call(*operands)
+        except operator.errors as e:
+            raise operator_error(e, operator) from e
+
+    def set_approximate(self, approximate=True):
+        """Turn the approximate mode on or off.
+
+        In approximate mode, operators with an approximate version, like
+        ! and ^, give an Approx when the exact result would be larger than
+        APPROXIMATE_BITS, when the exact version overflows, or when an
+        operand is an Approx already. This takes microseconds where the
+        exact result could take minutes. The = operator gives the exact
+        value of an Approx. Like instrument(), this replaces evaluate of
+        this instance, so the mode costs nothing when off."""
+        self.approximate = approximate
+        if not approximate:
+            self.__dict__.pop('evaluate', None)
+            return
+        evaluate = RPN.evaluate
+
+        def approximate_evaluate(operator, operands):
+            approximation = APPROXIMATIONS.get(operator.name)
+            if approximation is None:
+                return evaluate(self, operator, operands)
+            if not any(isinstance(operand, Approx) for operand in operands) \
+                    and result_size(operator, operands) < APPROXIMATE_BITS:
+                try:
+                    return evaluate(self, operator, operands)
+                except RPNOverflowError:
+                    pass
             try:
-                return 2 ** operand
-            except OverflowError as e:
-                messagebox.showerror("OverflowError", str(e))
-        elif operator == '\u2684':  # dice5
-            return math.ceil(operand * random.random())
-        elif operator == 'sinh':
-            return math.sinh(operand)
-        elif operator == 'cosh':
-            return math.cosh(operand)
-        elif operator == 'tanh':
-            return math.tanh(operand)
-        elif operator == 'asinh':
-            return math.asinh(operand)
-        elif operator == 'acosh':
-            return math.acosh(operand)
-        elif operator == 'atanh':
-            return math.atanh(operand)
-        else:
-            messagebox.showerror("Error",
-                                 f"Unknown 1operator {operator}.")
-        return None
-
-    def evaluate_zero(self, text):
-        # {'Rand', '\u03c0', '\u03c4', 'e', '\u03c6}
-        text = text[0]
-        if text == '\u03c0':  # pi
-            return math.pi
-        elif text == '\u03c4':  # tau
-            return 2 * math.pi
-        elif text == 'e':
-            return math.e
-        elif text == '\u03c6':  # phi
-            return (1 + math.sqrt(5))/2
-        elif text == 'Rand':
-            return random.random()
-        else:
-            messagebox.showerror("Error",
-                                 f"Unknown 0operator {text}.")
-        return None
+                return approximation(*operands)
+            except operator.errors as e:
+                raise operator_error(e, operator) from e
+        self.evaluate = approximate_evaluate
 
-    def process_operator(self, operator, operand_count, eval_function=None):
+    def process_operator(self, operator):
         """
-        Helper function to handle the common tasks for processing operators.
+        Apply operator to the top of the stack, in place.
+
+        The operands are only popped once the result is known, so a failed
+        operation leaves the stack as it was.
         """
         # print("process_operator got operator ", operator)
-        self.stack.append(operator)
-
-        if eval_function:
-            # This is where thing might take time
-            result = eval_function(self.stack[-operand_count:])
-
-            if result is not None:
-                # Remove the operands from the stack if calculation is good
-                self.stack = self.stack[:-operand_count]
-                self.stack.append(result)
-            else:
-                # Remove failed operator from stack
-                self.stack = self.stack[:-1]
+        stack = self.stack
+        arity = operator.arity
+        if arity is None:
+            self.process_stack_operator(operator)
+            return
+        if len(stack) < arity:
+            raise StackUnderflowError(f"Too few operands to {operator.name}.",
+                                      len(stack))
+
+        # This is where thing might take time
+        result = self.evaluate(operator, stack[-arity:] if arity else ())
+
+        # Replace the operands with the result now the calculation is good
+        if arity:
+            del stack[-arity:]
+        if operator.results == 1:
+            stack.append(result)
+        else:
+            stack.extend(result)
+
+    def process_stack_operator(self, operator):
+        """Apply an operator taking the whole stack, or the count on top
+        of it and that many values below, in one go."""
+        stack = self.stack
+        base = 0
+        if operator.counted:
+            count = stack[-1] if stack else None
+            if type(count) is not int or count < 0:
+                raise DomainError(f"{operator.name}: the count on top of "
+                                  + "the stack must be a whole number.",
+                                  min(len(stack), 1))
+            if count >= len(stack):
+                raise StackUnderflowError(
+                    f"Too few operands to {operator.name}.", len(stack))
+            base = len(stack) - 1 - count
+        operands = stack[base:len(stack) - operator.counted]
+        try:
+            result = self.evaluate(operator, operands)
+        except RPNError as error:
+            error.consumed = len(stack) - base
+            raise
+        del stack[base:]
+        if operator.results == 1:
+            stack.append(result)
+        else:
+            stack.extend(result)
 
     def process_number(self, text):
         """
@@ -221,737 +1740,1021 @@ class RPN():
         """
         # print("process_number got ", text)
         try:
-            if "." not in text:
-                value = int(text)
-            else:
-                value = float(text)
-            self.stack.append(value)
+            self.stack.append(parse_number(text))
         except ValueError:
-            messagebox.showerror("ValueError",
-                                 "Invalid input. \n"
-                                 + f"I don't think '{text}' is a number.")
+            raise ParseError("Invalid input. \n"
+                             + f"I don't think '{text}' is a number.")
 
-    def process_token(self, text):
-        """Process token input to stack.
+    def apply_token(self, text):
+        """Apply one token to the stack, raising RPNError if it fails.
 
-        Separate numbers from operators and call the evaluate function
-        taking the correct number of operands for the current operator.
-        Do some of the job previously done by CalculatorGUI.process_input()"""
-
-        # print("process_token got ", text)
-        if text in self.operator_2:
-            # Operator takes two operands
-            self.process_operator(text, 3, self.evaluate_two)
-        elif text in self.operator_1:
-            # Operator takes one operand
-            self.process_operator(text, 2, self.evaluate_one)
-        elif text in self.operator_0:
-            # Operator takes no operands
-            self.process_operator(text, 1, self.evaluate_zero)
+        Look the token up in the operator registry and apply it,
+        or push it as a number if it is not an operator."""
+        operator = self.operators.get(self.aliases.get(text, text))
+        if operator is not None:
+            self.process_operator(operator)
         else:
             # Process a number
             self.process_number(text)
 
+    def instrument(self, instrumentation=None):
+        """Record statistics of every token in instrumentation.
 
-class CalculatorGUI(tk.Tk):
-    def __init__(self, rpn):
-        super().__init__()
-        self.rpn = rpn
-        self.title("RPN Calculator")
-        self.geometry("330x360")
-        self.history = []  # List of input
-
-        self.operators = \
-            self.rpn.operator_0 | self.rpn.operator_1 | self.rpn.operator_2
-
-        # Regex magic to allow operators to be entered together with the
-        # last number before the operator
-        self.sorted_operators = sorted(self.operators, key=len, reverse=True)
-        # Create a regex pattern to match the longest operator
-        # at the end of the string
-        pattern = '|'.join(re.escape(op) for op in self.sorted_operators)
-        # Match the operator only at the end
-        # and ensure there is something before it
-        self.pattern = f"^(.*?)(?={pattern})({pattern})$"
-
-        # Dictionary of help texts for each button
-        self.help_texts = {  # keep in gui
-            '.': "Decimal point. \n"
-            + "Separates the whole number from the fraction.",
-            '0': "0; Zero, \n"
-            + "The first digit and the basis of positional notation.",
-            '1': "1; One. First and foremost. Number one.",
-            '2': "2; Two is never first, but close.",
-            '3': "3; Three. First odd prime.",
-            '4': "4; Four in a row.",
-            '5': "5; Five is a handful.",
-            '6': "6; Six. First rectangular number.",
-            '7': "7; Seven. An excellent choise.",
-            '8': "8; Eight. The first digit in alphabetical order.",
-            '9': "9; Nine. First odd square.",
-            'π': "Pi is the circumference of a circle \n"
-            + "divided by its diameter.",
-            '\u03c4': "Tau is the circumference of a circle \n"
-            + "divided by its radius.",
-            'e': "e is a mathematical constant, \n"
-            + "the base of the natural logarithm and exponential function.\n"
-            + "e is approximately equal to 2.718281828459045235360287471352.",
-            '\u03c6': "Phi is the golden ratio. \n"
-            + "1 / phi = phi - 1.",
-            '+': "Addition operator. \n"
-            + "Adds two numbers.",
-            '-': "Subtraction operator. \n"
-            + "Subtracts the second number from the first.",
-            '\u00d7': "Multiplication operator. \n"
-            + "Multiplies two numbers.",
-            '/': "Division operator. \n"
-            + "Divides the first number by the second.",
-            '^': "Exponentiation operator. \n"
-            + "Raises the first number to the power of the second.",
-            '÷': "Integer division. \n"
-            + "Returns the integer part after division.",
-            '%': "Modulus operator. \n"
-            + "Returns the remainder of the division of two numbers.",
-            '√': "Square root operator. \n"
-            + "Returns the square root of a number.",
-            'sin': "Sine function. \n"
-            + "Returns the sine of an angle.",
-            'cos': "Cosine function. \n"
-            + "Returns the cosine of an angle.",
-            'tan': "Tangent function. \n"
-            + "Returns the tangent of an angle.",
-            'asin': "Inverse sine function. \n"
-            + "Returns the inverse of sin.",
-            'acos': "Inverse cosine function. \n"
-            + "Returns the inverse of cos.",
-            'atan': "Inverse tangent function. \n"
-            + "Returns the inverse of tan",
-            'sinh': "Hyperbolic sine function. \n"
-            + "Returns the hyperbolic sine of an angle.",
-            'cosh': "Hyperbolic cosine function. \n"
-            + "Returns the hyperbolic cosine of an angle.",
-            'tanh': "Hyperbolic tangent function. \n"
-            + "Returns the hyperbolic tangent of an angle.",
-            'asinh': "Inverse hyperbolic sine function. \n"
-            + "Returns the inverse of sinh.",
-            'acosh': "Inverse hyperbolic cosine function. \n"
-            + "Returns the inverse of cosh.",
-            'atanh': "Inverse hyperbolic tangent function. \n"
-            + "Returns the inverse of tanh.",
-            'ln': "Natural logarithm function. \n"
-            + "Returns the natural logarithm of a number.",
-            'lg2': "Base-2 logarithm function. \n"
-            + "Returns the logarithm of a number with base 2.",
-            'log': "Base-10 logarithm function. \n"
-            + "Returns the logarithm of a number with base 10.",
-            '1/x': "Reciprocal operator. \n"
-            + "Returns the reciprocal (1 divided by the number).",
-            '2^x': "Raise 2 to the power of x.",
-            'x^2': "Square x.",
-            '!': "Factorial function. \n"
-            + "Returns the factorial of a integer. \n"
-            + "For floats, it returns the \u0393(x+1), which is widely \n"
-            + "accepted as the factorial of non-integer numbers.",
-            '=': "'=' on an RPN? \n"
-            + "Yeah, this truncates the number i.e. rounds towards zero.",
-            'Rand': "Generates a random number between 0 and 1.",
-            'n√': "Nth root operator. \n"
-            + "Returns the nth root of the first number.",
-            '\u2295': "Root Sum Square operator. \n"
-            + "Returns the Euclidean norm (distance) between two numbers. \n"
-            + "Equivalent to ['a', 'x^2', 'b', 'x^2', '+', '√']",
-            'E': "Scientific notation. \n"
-            + "x, y, E is x * 10^y.",
-            'sci': "Toggle various scientific functions.",
-            '?': "This is the help button. \n"
-            + "Click '?' and another button to get help on that other button.",
-            '(-)': "Negative symbol for entering negative numbers.",
-            'hyp': "Toggle hyperbolic trigonometric functions.",
-            'nCk': "How many ways you can choose k from n.",
-            '\u2684': "Trow an n-sided dice. \n"
-            + "If n is not integer, the last side of the \n"
-            + "dice is a little smaller than the others. \n"
-            + "A \u03c4-sided dice will sometimes give 7.",
-            'Clear': "Clears the input, one character at a time. \n"
-            + "If no input, clears the stack.\n"
-            + "If no stack, clears history, \n"
-            + "If no history, takes a nap.",
-            'Enter': "Transfers your input number to the stack."
-        }
-
-        self.help_mode = False  # Initially not in help mode
-        self.sci_mode = 0  # Initially not in scientific mode
-        self.hyp_mode = 0  # Initailly not in hyperbola mode
-
-        self.colors = {
-            'digit': '#ade',  # close to 'lightblue',
-            'number': '#69b',  # slightly darker blue
-            'op1': '#9e9',  # 'lightgreen',
-            'op2': '#6b6',  # slightly darker green
-            'Clear': 'lightgray',
-            'Enter': 'darkgray',
-            'sci': ['#ffa', '#fd5', '#fa0'],  # yellows/orange
-            'help': ['#a66', '#a00']  # reds
-        }
-
-        self.button_objs = {}
-        self.main_buttons = []  # Trying to keep track of all buttons
-        self.main_labels = []
-
-        # settings
-        self.settings_digits = 17
-        self.settings_layout = 'small'  # 'small', 'wide', 'tall'
-
-        # Set layout
-        self.create_button_layout(self.settings_layout)
-
-        # Menu
-        menubar = tk.Menu()
-        self.config(menu=menubar)
-        # Create a 'Settings' menu
-        settings_menu = tk.Menu(menubar, tearoff=0)
-        menubar.add_cascade(label="Settings", menu=settings_menu)
-        settings_menu.add_command(label="Fairly square",
-                                  command=lambda: self.create_button_layout
-                                  ('small'))
-        settings_menu.add_command(label="Wide and nerdy",
-                                  command=lambda: self.create_button_layout
-                                  ('wide'))
-        settings_menu.add_command(label="A tall order",
-                                  command=lambda: self.create_button_layout
-                                  ('tall'))
-
-        # Create the 'Digits' setting submenu
-        digits_menu = tk.Menu(settings_menu, tearoff=0)
-        settings_menu.add_cascade(label="Show digits in stack",
-                                  menu=digits_menu)
-
-        # Define the valid choices for digits
-        valid_digits = [1, 2, 3, 5, 7, 11, 13, 17]
-
-        # Add the valid digits as menu items
-        for digit in valid_digits:
-            digits_menu.add_command(label=str(digit),
-                                    command=lambda digit=digit:
-                                        self.set_digits(digit))
-
-    def set_digits(self, digit: int = 17):
-        self.settings_digits = digit
-        self.update_display()
-
-    def create_button_layout(self, settings_layout):
-        """Set up button layout based on the selected layout
-        ('small', 'wide', or 'tall')."""
-
-        if settings_layout == 'small':
-            self.geometry("330x360")
-
-            self.buttons = [('\u221a', 3, 3, self.colors['op1']),  # root
-                            ('sci', 3, 4, self.colors['sci'][0]),
-                            ('7', 4, 0, self.colors['digit']),
-                            ('8', 4, 1, self.colors['digit']),
-                            ('9', 4, 2, self.colors['digit']),
-                            ('/', 4, 3, self.colors['op2']),
-                            ('\u03c0', 4, 4, self.colors['number']),  # pi
-                            ('4', 5, 0, self.colors['digit']),
-                            ('5', 5, 1, self.colors['digit']),
-                            ('6', 5, 2, self.colors['digit']),
-                            ('\u00d7', 5, 3, self.colors['op2']),  # x
-                            ('^', 5, 4, self.colors['op2']),
-                            ('1', 6, 0, self.colors['digit']),
-                            ('2', 6, 1, self.colors['digit']),
-                            ('3', 6, 2, self.colors['digit']),
-                            ('-', 6, 3, self.colors['op2']),
-                            ('%', 6, 4, self.colors['op2']),
-                            ('(-)', 7, 0, self.colors['digit']),
-                            ('0', 7, 1, self.colors['digit']),
-                            ('.', 7, 2, self.colors['digit']),
-                            ('+', 7, 3, self.colors['op2']),
-                            ('\u00f7', 7, 4, self.colors['op2']),  # div
-                            ]
-
-            # Set position for special buttons and fields
-            self.entry_grid = (0, 0, 5, '')
-            self.entry_width = 25
-            self.rpn.stack_label_grid = (1, 0, 5, '')
-            self.rpn.stack_label_width = 30
-            self.history_label_grid = (2, 0, 5, '')
-            self.history_label_width = 30
-            self.clear_button_grid = (3, 1, 2, 'e')
-            self.clear_button_width = 6
-            self.enter_button_grid = (3, 0, 2, 'w')
-            self.enter_button_width = 6
-            self.help_button_grid = (3, 1, 1, '')
-            self.help_button_width = 2
-
-        elif settings_layout == 'wide':
-            self.geometry("650x330")
-
-            # Wide layout (buttons rearranged for a wider view)
-            self.buttons = [('Rand', 3, 0, self.colors['number']),
-                            ('\u2684', 3, 1, self.colors['op1']),  # dice
-                            ('!', 3, 2, self.colors['op1']),
-                            ('1/x', 3, 3, self.colors['op1']),
-                            # 3, 4, to 3, 8, is the Enter Clear and ? buttons
-                            ('hyp', 3, 9, self.colors['sci'][0]),
-                            ('\u03c6', 4, 0, self.colors['number']),  # phi
-                            ('=', 4, 1, self.colors['op1']),
-                            ('x^2', 4, 2, self.colors['op1']),
-                            ('2^x', 4, 3, self.colors['op1']),
-                            ('7', 4, 4, self.colors['digit']),
-                            ('8', 4, 5, self.colors['digit']),
-                            ('9', 4, 6, self.colors['digit']),
-                            ('/', 4, 7, self.colors['op2']),
-                            ('\u00f7', 4, 8, self.colors['op2']),  # div
-                            ('\u221a', 4, 9, self.colors['op1']),  # root
-                            ('e', 5, 0, self.colors['number']),
-                            ('ln', 5, 1, self.colors['op1']),
-                            ('log', 5, 2, self.colors['op1']),
-                            ('lg2', 5, 3, self.colors['op1']),
-                            ('4', 5, 4, self.colors['digit']),
-                            ('5', 5, 5, self.colors['digit']),
-                            ('6', 5, 6, self.colors['digit']),
-                            ('\u00d7', 5, 7, self.colors['op2']),  # x
-                            ('^', 5, 8, self.colors['op2']),
-                            ('n\u221a', 5, 9, self.colors['op2']),  # nth root
-                            ('\u03c0', 6, 0, self.colors['number']),  # pi(?)
-                            ('sin', 6, 1, self.colors['op1']),
-                            ('cos', 6, 2, self.colors['op1']),
-                            ('tan', 6, 3, self.colors['op1']),
-                            ('1', 6, 4, self.colors['digit']),
-                            ('2', 6, 5, self.colors['digit']),
-                            ('3', 6, 6, self.colors['digit']),
-                            ('-', 6, 7, self.colors['op2']),
-                            ('%', 6, 8, self.colors['op2']),
-                            ('nCk', 6, 9, self.colors['op2']),
-                            ('\u03c4', 7, 0, self.colors['number']),  # tau
-                            ('asin', 7, 1, self.colors['op1']),
-                            ('acos', 7, 2, self.colors['op1']),
-                            ('atan', 7, 3, self.colors['op1']),
-                            ('(-)', 7, 4, self.colors['digit']),
-                            ('0', 7, 5, self.colors['digit']),
-                            ('.', 7, 6, self.colors['digit']),
-                            ('+', 7, 7, self.colors['op2']),
-                            ('\u2295', 7, 8, self.colors['op2']),
-                            ('E', 7, 9, self.colors['op2'])
-                            ]
-
-            # Set postion, size and shape for special buttons and fields
-            self.entry_grid = (0, 0, 3, '')
-            self.entry_width = 15
-            self.rpn.stack_label_grid = (0, 3, 7, 'w')
-            self.rpn.stack_label_width = 44
-            self.history_label_grid = (2, 0, 10, 'e')
-            self.history_label_width = 63
-            self.enter_button_grid = (3, 4, 2, '')
-            self.enter_button_width = 10
-            self.clear_button_grid = (3, 6, 2, '')
-            self.clear_button_width = 10
-            self.help_button_grid = (3, 8, 1, '')
-            self.help_button_width = 4
-
-        elif settings_layout == 'tall':
-            self.geometry("330x620")
-
-            # Wide layout (buttons rearranged for a wider view)
-            self.buttons = [('Rand', 3, 0, self.colors['number']),
-                            ('\u2684', 3, 1, self.colors['op1']),  # dice
-                            ('!', 3, 2, self.colors['op1']),
-                            ('1/x', 3, 3, self.colors['op1']),
-                            ('\u03c6', 4, 0, self.colors['number']),  # phi
-                            ('=', 4, 1, self.colors['op1']),
-                            ('x^2', 4, 2, self.colors['op1']),
-                            ('2^x', 4, 3, self.colors['op1']),
-                            ('\u221a', 4, 4, self.colors['op1']),  # root
-                            ('e', 5, 0, self.colors['number']),
-                            ('ln', 5, 1, self.colors['op1']),
-                            ('log', 5, 2, self.colors['op1']),
-                            ('lg2', 5, 3, self.colors['op1']),
-                            ('n\u221a', 5, 4, self.colors['op2']),  # nth root
-                            ('\u03c0', 6, 0, self.colors['number']),  # pi(?)
-                            ('sin', 6, 1, self.colors['op1']),
-                            ('cos', 6, 2, self.colors['op1']),
-                            ('tan', 6, 3, self.colors['op1']),
-                            ('nCk', 6, 4, self.colors['op2']),
-                            ('\u03c4', 7, 0, self.colors['number']),  # tau
-                            ('asin', 7, 1, self.colors['op1']),
-                            ('acos', 7, 2, self.colors['op1']),
-                            ('atan', 7, 3, self.colors['op1']),
-                            ('E', 7, 4, self.colors['op2']),
-                            ('hyp', 8, 4, self.colors['sci'][0]),
-                            ('7', 9, 0, self.colors['digit']),
-                            ('8', 9, 1, self.colors['digit']),
-                            ('9', 9, 2, self.colors['digit']),
-                            ('/', 9, 3, self.colors['op2']),
-                            ('\u00f7', 9, 4, self.colors['op2']),  # div
-                            ('4', 10, 0, self.colors['digit']),
-                            ('5', 10, 1, self.colors['digit']),
-                            ('6', 10, 2, self.colors['digit']),
-                            ('\u00d7', 10, 3, self.colors['op2']),  # x
-                            ('^', 10, 4, self.colors['op2']),
-                            ('1', 11, 0, self.colors['digit']),
-                            ('2', 11, 1, self.colors['digit']),
-                            ('3', 11, 2, self.colors['digit']),
-                            ('-', 11, 3, self.colors['op2']),
-                            ('%', 11, 4, self.colors['op2']),
-                            ('(-)', 12, 0, self.colors['digit']),
-                            ('0', 12, 1, self.colors['digit']),
-                            ('.', 12, 2, self.colors['digit']),
-                            ('+', 12, 3, self.colors['op2']),
-                            ('\u2295', 12, 4, self.colors['op2']),
-                            ]
-
-            self.entry_grid = (0, 0, 5, '')
-            self.entry_width = 25
-            self.rpn.stack_label_grid = (1, 0, 5, '')
-            self.rpn.stack_label_width = 30
-            self.history_label_grid = (2, 0, 5, '')
-            self.history_label_width = 30
-
-            self.enter_button_grid = (8, 0, 2, '')
-            self.enter_button_width = 10
-            self.clear_button_grid = (8, 2, 2, '')
-            self.clear_button_width = 10
-            self.help_button_grid = (3, 4, 1, '')
-            self.help_button_width = 4
-
-        else:
-            print(f"Invalid layout {settings_layout}")
+        This replaces apply_token of this instance with a timed version,
+        so it costs nothing when not in use. None turns it off again."""
+        self.instrumentation = instrumentation
+        if instrumentation is None:
+            self.__dict__.pop('apply_token', None)
             return
-
-        # Create the buttons for the number pad and operators with colors
-        self.forget_grid()
-        for (text, row, col, color) in self.buttons:
-            button = tk.Button(self, text=text,
-                               font=("Lucida Sans Unicode", 14),
-                               width=4, height=1, bg=color,
-                               command=self.create_button_handler(text))
-            button.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-            self.button_objs[text] = button
-
-        # Set correct font and colors on buttons
-        self.update_buttons()
-
-        # Entry field for RPN expression
-        self.entry = tk.Entry(self, font=("Lucida Sans Unicode", 14),
-                              borderwidth=1, relief="solid")
-        self.entry.grid(row=self.entry_grid[0], column=self.entry_grid[1],
-                        columnspan=self.entry_grid[2],
-                        pady=5,
-                        sticky=self.entry_grid[3])
-        self.entry.config(width=self.entry_width)
-        self.main_labels.append(self.entry)
-
-        # Show the stack
-        self.rpn.stack_label = tk.Label(self, text="Stack: []",
-                                        font=("Lucida Sans Unicode", 12),
-                                        height=1, anchor="e")
-        self.rpn.stack_label.grid(row=self.rpn.stack_label_grid[0],
-                                  column=self.rpn.stack_label_grid[1],
-                                  columnspan=self.rpn.stack_label_grid[2],
-                                  pady=5,
-                                  sticky=self.history_label_grid[3])
-        self.rpn.stack_label.config(width=self.rpn.stack_label_width)
-        self.main_labels.append(self.rpn.stack_label)
-
-        # Show input history
-        self.history_label = tk.Label(self, text="History: []",
-                                      font=("Lucida Sans Unicode", 12),
-                                      height=1, anchor="e")
-        self.history_label.grid(row=self.history_label_grid[0],
-                                column=self.history_label_grid[1],
-                                columnspan=self.history_label_grid[2],
-                                pady=5,
-                                sticky=self.history_label_grid[3])
-        self.history_label.config(width=self.history_label_width)
-        self.main_labels.append(self.history_label)
-
-        # "Clear" button to clear the input
-        self.clear_button = tk.Button(self, text="Clear",
-                                      font=("Lucida Sans Unicode", 14),
-                                      height=1,
-                                      bg=self.colors["Clear"],
-                                      # command=self.clear,
-                                      command=lambda: self.on_button_click
-                                      ("Clear"),
-                                      )
-        self.clear_button.grid(row=self.clear_button_grid[0],
-                               column=self.clear_button_grid[1],
-                               columnspan=self.clear_button_grid[2],
-                               pady=5,
-                               sticky=self.clear_button_grid[3])
-        self.clear_button.config(width=self.clear_button_width)
-        self.main_buttons.append(self.clear_button)
-
-        # "Enter" button to add current value to the stack
-        self.enter_button = tk.Button(self, text="Enter",
-                                      font=("Lucida Sans Unicode", 14),
-                                      height=1,
-                                      bg=self.colors["Enter"],
-                                      # command=self.process_input,
-                                      command=lambda: self.on_button_click
-                                      ("Enter"),
-                                      )
-        self.enter_button.grid(row=self.enter_button_grid[0],
-                               column=self.enter_button_grid[1],
-                               columnspan=self.enter_button_grid[2],
-                               pady=5,
-                               sticky=self.enter_button_grid[3])
-        self.enter_button.config(width=self.enter_button_width)
-        self.main_buttons.append(self.enter_button)
-
-        # "Help" button to activate help mode
-        self.help_button = tk.Button(self, text="?",
-                                     font=("Lucida Sans Unicode", 14),
-                                     height=1,
-                                     bg=self.colors['help'][0],
-                                     command=self.activate_help)
-        self.help_button.grid(row=self.help_button_grid[0],
-                              column=self.help_button_grid[1],
-                              pady=5)
-        self.help_button.config(width=self.help_button_width)
-        self.main_buttons.append(self.help_button)
-
-        # Update idsplay to keep stack, history visible
-        self.update_display()
-
-    def forget_grid(self):  # keep in gui
-        """Clear any previous buttons from the grid."""
-        # print(f"{len(self.button_objs)=}")
-        for key, button in self.button_objs.items():
-            button.grid_forget()
-        self.button_objs.clear()
-
-        for button in self.main_buttons:
-            button.grid_forget()
-
-        for label in self.main_labels:
-            label.grid_forget()
-
-    def create_button_handler(self, text):  # keep in gui
-        """Returns a function that calls
-        self.on_button_click with the button text."""
-        def handler():
-            self.on_button_click(text)
-        return handler
-
-    def update_buttons(self):
-        """ Update colors and fonts for the buttons. """
-        for k, _ in self.button_objs.items():
-            # Change the color of some of the buttons
-            if self.button_objs[k].cget('text') in self.rpn.operator_2:
-                self.button_objs[k].config(bg=self.colors['op2'])
-            if self.button_objs[k].cget('text') in self.rpn.operator_1:
-                self.button_objs[k].config(bg=self.colors['op1'])
-            if self.button_objs[k].cget('text') in self.rpn.operator_0:
-                self.button_objs[k].config(bg=self.colors['number'])
-            # Change font
-            if self.button_objs[k].cget('text') in {'\u03c0',
-                                                    '\u03c4',
-                                                    '\u03c6'}:
-                # greek letters
-                self.button_objs[k].config(font=("Symbol", 14))
-            else:
-                self.button_objs[k].config(font=("Lucida Sans Unicode", 14))
-
-    def toggle_sci_mode(self):  # keep in gui
-        """Toggle between scientific and normal mode."""
-        # There are 3 modes.
-        self.sci_mode = (self.sci_mode + 1) % 3  # Change to next mode
-
-        sci_layouts = [{'√': '√',
-                        '/': '/',
-                        '\u00d7': '\u00d7',  # times
-                        '-': '-',
-                        '+': '+',
-                        '\u03c0': '\u03c0',  # pi
-                        '%': '%',
-                        '÷': '÷',
-                        '^': '^',
-                        },
-                       {'√': 'n\u221a',  # root
-                        '/': '1/x',
-                        '\u00d7': 'tan',
-                        '-': 'cos',
-                        '+': 'sin',
-                        '\u03c0': '\u03c4',  # tau
-                        '%': 'ln',  # ln, was e
-                        '÷': 'log',  # log was ln
-                        '^': 'e',  # e was log
-                        },
-                       {'√': '\u2295',  # circled pluss
-                        '/': 'Rand',
-                        '\u00d7': 'atan',
-                        '-': 'acos',
-                        '+': 'asin',
-                        '\u03c0': '\u03c6',  # phi
-                        '%': '!',
-                        '÷': 'lg2',
-                        '^': '=',
-                        }
-                       ]
-
-        # Change button labels to scientific mode and update handlers
-        for k, v in sci_layouts[self.sci_mode].items():
-            self.button_objs[k].config(text=v)
-            self.button_objs[k].config(command=self.create_button_handler(v))
-        # Update colors and fonts
-        self.update_buttons()
-
-        # Update sci button bg color
-        self.button_objs['sci'].config(bg=self.colors['sci'][self.sci_mode])
-
-    def toggle_hyp_mode(self):
-        """Toggle between scientific and normal mode."""
-        # There are 2 modes.
-        self.hyp_mode = (self.hyp_mode + 1) % 2  # Change to next mode
-
-        hyp_layouts = [{'sin': 'sin',
-                        'cos': 'cos',
-                        'tan': 'tan',
-                        'asin': 'asin',
-                        'acos': 'acos',
-                        'atan': 'atan',
-                        },
-                       {'sin': 'sinh',
-                        'cos': 'cosh',
-                        'tan': 'tanh',
-                        'asin': 'asinh',
-                        'acos': 'acosh',
-                        'atan': 'atanh',
-                        }
-                       ]
-
-        # Change button labels to scientific mode and update handlers
-        for k, v in hyp_layouts[self.hyp_mode].items():
-            self.button_objs[k].config(text=v)
-            self.button_objs[k].config(command=self.create_button_handler(v))
-        # Update colors and fonts
-        self.update_buttons()
-
-        # Update hyp button bg color
-        self.button_objs['hyp'].config(bg=self.colors['sci'][self.hyp_mode])
-
-    def on_button_click(self, button_text):
-        """Handle button click."""
-        # print(button_text)
-        if self.help_mode:
-            # Show help text for the clicked button
-            help_text = self.help_texts.get(button_text,
-                                            "Sorry, can't help you there.")
-            messagebox.showinfo("Help", help_text)
-            self.deactivate_help()
-        elif button_text == 'sci':
-            self.toggle_sci_mode()
-        elif button_text == 'hyp':
-            self.toggle_hyp_mode()
-        elif button_text == "Enter":
-            self.process_input()
-        elif button_text == "Clear":
-            self.clear()
-        else:
-            # For operators, we insert the operator and immediately calculate
-            if button_text in self.operators:
-                # print("op")
-                # For operators like '+', '-', '\u00d7', '/', etc.
-                self.entry.insert(tk.END, button_text)
-                self.process_input()  # Automatically trigger calculation
+        apply_token = RPN.apply_token
+        perf_counter_ns = time.perf_counter_ns
+
+        def timed_apply_token(text):
+            operator = self.operators.get(self.aliases.get(text, text))
+            if operator is not None:
+                name = operator.name
+                operands = self.stack[-operator.arity:] if operator.arity \
+                    else ()
+                types = tuple(type(operand).__name__ for operand in operands)
             else:
-                # print("num")
-                # For numbers, just insert them into the entry field
-                if button_text == '(-)':
-                    # handle inputting negative numbers.
-                    self.entry.insert(tk.END, '-')
-                else:
-                    self.entry.insert(tk.END, button_text)
-
-    def process_input(self):
-        """Add the current value (operand or operator) to the stack
-        when Enter is pressed."""
-        current_text = self.entry.get().strip()
-        self.history.append(current_text)
-
-        if current_text:
-            match = re.search(self.pattern, current_text)
-            # print(f"Yes, {current_text=}")
-            # Number and operator entered together.
-            if match and match.group(1) and match.group(2):
-                # print("Yes, match")
-                # print(f"{match.group(1)}, {match.group(2)}")
-                self.rpn.process_token(match.group(1))
-                self.rpn.process_token(match.group(2))
-                self.entry.delete(0, tk.END)
+                name = 'number'
+                types = ()
+            failed = True
+            started = perf_counter_ns()
+            try:
+                apply_token(self, text)
+                failed = False
+            finally:
+                elapsed = perf_counter_ns() - started
+                instrumentation.record(name, types, started, elapsed, failed,
+                                       len(self.stack))
+        self.apply_token = timed_apply_token
+
+    def handle_error(self, error):
+        """Count error and deal with it according to the error policy."""
+        self.error_counts[type(error).__name__] += 1
+        if self.error_policy == 'raise':
+            raise error
+        elif self.error_policy == 'nan':
+            if error.consumed:
+                del self.stack[-error.consumed:]
+            self.stack.append(math.nan)
+
+    def process_token(self, text):
+        """Process token input to stack.
+
+        Failures are handled according to the error policy."""
+
+        # print("process_token got ", text)
+        try:
+            self.apply_token(text)
+        except RPNError as error:
+            self.handle_error(error)
+
+    def run(self, program):
+        """Process every token of program, a string or sequence of tokens.
+
+        Returns False if the program was skipped because of an error."""
+        tokens = tuple(split_program(program))
+        if operator_cache is not None:
+            return self.run_cached(tokens)
+        return self.run_tokens(tokens)
+
+    def run_cached(self, tokens):
+        """Run tokens, reusing the result from the cache if the program is
+        pure and has been run on the same operands before."""
+        plan = plan_program(tokens)
+        stack = self.stack
+        if not plan.pure or plan.needed > len(stack):
+            return self.run_tokens(tokens)
+        base = len(stack) - plan.needed
+        # The results depend on the mode, say an Approx or an exact int
+        key = operator_cache.key((tokens, self.approximate,
+                                  self.error_policy), stack[base:])
+        if key is None:
+            return self.run_tokens(tokens)
+        found, results = operator_cache.lookup(key)
+        if found:
+            del stack[base:]
+            stack.extend(results)
+            return True
+        errors = sum(self.error_counts.values())
+        if not self.run_tokens(tokens):
+            return False
+        if sum(self.error_counts.values()) == errors:
+            operator_cache.store(key, tuple(stack[base:]))
+        return True
+
+    def run_tokens(self, tokens):
+        """Process every token, see run().
+
+        Under the 'raise' and 'skip' policies the program is checked
+        first, and fails before anything is computed if it would underflow
+        the stack or has a token that is not a number or an operator. It
+        then runs as planned by plan_program()."""
+        if self.error_policy == 'nan':
+            for token in tokens:
+                self.process_token(token)
+            return True
+        plan = plan_program(tokens)
+        stack = self.stack
+        saved = stack[:] if self.error_policy == 'skip' else None
+        try:
+            if not plan.parsed or plan.needed > len(stack):
+                self.check_program(tokens)
+            if self.instrumentation is not None:
+                # Every token is timed, as it was written
+                for token in tokens:
+                    self.apply_token(token)
             else:
-                # print("No match", current_text)
-                self.rpn.process_token(current_text)
-            self.entry.delete(0, tk.END)
+                for item in plan.items:
+                    if type(item) is Operator:
+                        self.process_operator(item)
+                    else:
+                        stack.append(item)
+        except RPNError as error:
+            self.handle_error(error)  # Raises under 'raise'
+            stack[:] = saved
+            return False
+        return True
+
+    def check_program(self, tokens):
+        """check_program() on the stack, recording a rejection like a
+        failed token if instrumented."""
+        if self.instrumentation is None:
+            check_program(tokens, len(self.stack))
+            return
+        started = time.perf_counter_ns()
+        try:
+            check_program(tokens, len(self.stack))
+        except RPNError as error:
+            operator = self.operators.get(error.token)
+            self.instrumentation.record(
+                'number' if operator is None else operator.name, (), started,
+                time.perf_counter_ns() - started, True, len(self.stack))
+            raise
+
+    @staticmethod
+    def compile(program, inputs=()):
+        """Compile program into a reusable function of the inputs.
+
+        program is a string or a sequence of tokens; inputs names the
+        tokens in it that are filled from the arguments, in order.
+        The function returns the single value left on the stack, or a
+        tuple if there are several. Compiled programs are kept in an LRU
+        cache keyed by the normalized program text, see
+        compile_cache_info().
+
+        >>> hypotenuse = RPN.compile('a x^2 b x^2 + \u221a', ('a', 'b'))
+        >>> hypotenuse(3, 4)
+        5.0
+        """
+        arrays_in_use()
+        return compile_program(' '.join(inline_words(split_program(program))),
+                               tuple(inputs))
+
+    @staticmethod
+    def compile_cache_info():
+        """Hits, misses and size of the compiled program cache."""
+        return compile_program.cache_info()
+
+
+def int_to_string(value):
+    """All the decimal digits of an int, however large.
+
+    str() is quadratic in the number of digits and refuses ints of more
+    than 4300 digits in newer Pythons. This converts the binary halves
+    recursively with the decimal module instead, which multiplies large
+    numbers fast."""
+    import decimal
+
+    context = decimal.Context(prec=decimal.MAX_PREC, Emax=decimal.MAX_EMAX)
+    powers = {}  # Powers of two, as Decimal
+
+    def convert(value, bits):
+        if bits <= 4096:
+            return decimal.Decimal(value)
+        low_bits = bits // 2
+        if low_bits not in powers:
+            powers[low_bits] = context.power(2, low_bits)
+        high = convert(value >> low_bits, bits - low_bits)
+        low = convert(value & ((1 << low_bits) - 1), low_bits)
+        return context.add(context.multiply(high, powers[low_bits]), low)
+
+    text = str(convert(abs(value), value.bit_length()))
+    return '-' + text if value < 0 else text
+
+
+def abbreviate_int(value, digits=15):
+    """The leading digits of an int as mantissa\u00d710^exponent, with the
+    number of digits.
+
+    Only the top 128 bits are converted to decimal, so this takes
+    microseconds however large value is.
+
+    >>> abbreviate_int(2 ** 100000)
+    '9.99002093014384\u00d710^30102 (30103 digits)'
+    """
+    magnitude = abs(value)
+    if magnitude.bit_length() <= 128:
+        return str(value)
+    import decimal
+
+    shift = magnitude.bit_length() - 128
+    with decimal.localcontext() as context:
+        context.prec = 40
+        log10 = (decimal.Decimal(magnitude >> shift).log10()
+                 + shift * decimal.Decimal(2).log10())
+        exponent = int(log10)
+        fraction = log10 - exponent
+        # Close to a power of ten, the rounding of log10 may have taken us
+        # across it
+        close = decimal.Decimal('1e-30')
+        if fraction > 1 - close and magnitude >= 10 ** (exponent + 1):
+            exponent += 1
+            fraction = 0
+        elif fraction < close and magnitude < 10 ** exponent:
+            exponent -= 1
+            fraction = 1
+        unit = decimal.Decimal(1).scaleb(1 - digits)  # Last digit shown
+        mantissa = min(decimal.Decimal(10) ** fraction, 10 - unit)
+        mantissa = mantissa.quantize(
+            unit, rounding=decimal.ROUND_DOWN).normalize()
+    sign = '-' if value < 0 else ''
+    return f"{sign}{mantissa}\u00d710^{exponent} ({exponent + 1} digits)"
+
+
+def export_stack(path, stack):
+    """Write every value of stack to path, one per line, with all digits.
+
+    This can take a while for huge ints, so the GUI runs it in its
+    worker process."""
+    with open(path, 'w', encoding='utf-8') as file:
+        for value in stack:
+            file.write(format_value(value) + "\n")
+
+
+def format_value(value):
+    """Format a stack value for text output."""
+    if type(value) == float:
+        return repr(value)
+    if type(value) == int and value.bit_length() > 10000:
+        return int_to_string(value)
+    return str(value)  # Approx gives mantissa\u00d710^exponent
+
+
+def read_lines(path):
+    """Yield the lines of path as text, one at a time.
+
+    Files are memory-mapped so large inputs are never loaded in one go.
+    '-' reads from stdin."""
+    import mmap
+
+    if path == '-':
+        for line in sys.stdin.buffer:
+            yield line.decode('utf-8')
+        return
+    with open(path, 'rb') as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can not be mapped
+            return
+        with mapped:
+            for line in iter(mapped.readline, b''):
+                yield line.decode('utf-8')
+
+
+UNDO_DEPTH = 10000  # Changes kept by UndoLog, the oldest are dropped
+
 
-            # Always update the stack_label to show the current stack
-            self.update_display()
+class UndoLog():
+    """Changes of a stack, to undo and redo them.
+
+    A change is kept as the index it starts at, with the values above it
+    before and after. The values are shared with the stack rather than
+    copied, so recording or undoing an operation takes time and memory in
+    proportion to its operands and results, however deep the stack is,
+    and undoing a slow ! gives its operand back at once. Only the latest
+    depth changes are kept."""
+
+    def __init__(self, depth=UNDO_DEPTH):
+        self.undos = collections.deque(maxlen=depth)
+        self.redos = []
+
+    def record(self, stack, base, before):
+        """Record that stack[base:] has replaced the values before.
+
+        Nothing is recorded if they are the same values, and a new change
+        drops the changes that were undone."""
+        after = tuple(stack[base:])
+        if len(after) == len(before) \
+                and all(new is old for new, old in zip(after, before)):
+            return
+        self.undos.append((base, before, after))
+        self.redos.clear()
+
+    def undo(self, stack):
+        """Undo the latest change of stack. Returns False if there is
+        nothing to undo."""
+        if not self.undos:
+            return False
+        base, before, after = change = self.undos.pop()
+        del stack[base:]
+        stack.extend(before)
+        self.redos.append(change)
+        return True
+
+    def redo(self, stack):
+        """Redo the latest undone change of stack. Returns False if there
+        is nothing to redo."""
+        if not self.redos:
+            return False
+        base, before, after = change = self.redos.pop()
+        del stack[base:]
+        stack.extend(after)
+        self.undos.append(change)
+        return True
+
+
+class Journal():
+    """Append-only journal of the inputs of a session, one per line.
+
+    Inputs are kept in memory until batch_size of them are pending, or
+    flush() is called, and then appended to path in one write. The file
+    can be read back from the end with tail() or replayed into an RPN."""
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+
+    def append(self, text):
+        self.pending.append(" ".join(text.split()))  # One line
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending inputs to the file."""
+        if self.pending:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write("".join(text + "\n" for text in self.pending))
+            self.pending.clear()
+
+    def __iter__(self):
+        """Every input, oldest first."""
+        if os.path.exists(self.path):
+            for line in read_lines(self.path):
+                yield line.rstrip("\n")
+        yield from list(self.pending)
+
+    def tail(self, count, block_size=65536):
+        """The last count inputs, reading only the end of the file."""
+        data = b""
+        position = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as file:
+                position = file.seek(0, os.SEEK_END)
+                while position > 0 and data.count(b"\n") <= count:
+                    step = min(block_size, position)
+                    position -= step
+                    file.seek(position)
+                    data = file.read(step) + data
+        lines = data.decode('utf-8', 'replace').splitlines()
+        if position > 0:
+            lines = lines[1:]  # Cut off at the start of the block
+        lines.extend(self.pending)
+        return lines[-count:] if count > 0 else []
+
+    def replay(self, rpn):
+        """Apply every input to rpn, as the GUI did when it was typed,
+        defining the words in it.
+
+        Inputs failing with an RPNError are passed over. Returns the
+        number of inputs replayed."""
+        count = 0
+        for count, text in enumerate(self, 1):
+            try:
+                for token in tokenize(define_words(text)):
+                    rpn.process_token(token)
+            except RPNError:
+                pass
+        return count
+
+
+SESSION_MAGIC = b"RPN session 1\n"
+# Formats for struct of the parts of a session
+SESSION_HEADER = '<QQI'  # Stack size, history size, settings
+SESSION_FLOAT = '<cd'
+SESSION_COMPLEX = '<cdd'  # Real and imaginary parts
+SESSION_INT = '<cI'  # Followed by the bytes of the int
+SESSION_APPROX = '<cbd'  # Sign and log10 of an Approx
+SESSION_TEXT = '<I'  # Followed by the text in UTF-8
+
+
+def save_session(path, stack, history=(), settings=None):
+    """Save a stack, the history and settings to path in binary.
+
+    Floats are stored as doubles, complex numbers as two, and ints as their
+    two's complement bytes, so no value is converted to decimal and back.
+    Raises TypeError for other values, like arrays. Approx values lose their
+    recipe, so their exact value is not known after a restore. settings is
+    a dict that can be stored as JSON. The file is replaced in one go, so a
+    reader never sees half a session."""
+    import json
+    import struct
+
+    history = list(history)
+    settings = json.dumps(settings or {}).encode('utf-8')
+    parts = [SESSION_MAGIC,
+             struct.pack(SESSION_HEADER, len(stack), len(history),
+                         len(settings)),
+             settings]
+    for value in stack:
+        if type(value) is float:
+            parts.append(struct.pack(SESSION_FLOAT, b'f', value))
+        elif type(value) is complex:
+            parts.append(struct.pack(SESSION_COMPLEX, b'c', value.real,
+                                     value.imag))
+        elif type(value) is int:
+            data = value.to_bytes(value.bit_length() // 8 + 1, 'little',
+                                  signed=True)
+            parts.append(struct.pack(SESSION_INT, b'i', len(data)))
+            parts.append(data)
+        elif type(value) is Approx:
+            # Without the recipe, as it may hold huge operands
+            parts.append(struct.pack(SESSION_APPROX, b'a', value.sign,
+                                     value.log10))
         else:
+            raise TypeError(f"Can't save {type(value).__name__} {value!r}.")
+    for text in history:
+        data = text.encode('utf-8')
+        parts.append(struct.pack(SESSION_TEXT, len(data)))
+        parts.append(data)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(b"".join(parts))
+    os.replace(temporary, path)
+
+
+def load_session(path):
+    """Load a session saved by save_session().
+
+    Returns the stack, the history and the settings. The file is
+    memory-mapped and read in place. Raises ValueError if path is not a
+    session."""
+    import json
+    import mmap
+    import struct
+
+    header, float_part, complex_part, int_part, approx_part, text_part = map(
+        struct.Struct, (SESSION_HEADER, SESSION_FLOAT, SESSION_COMPLEX,
+                        SESSION_INT, SESSION_APPROX, SESSION_TEXT))
+
+    with open(path, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+            raise ValueError(f"{path} is not an RPN session.")
+        try:
+            position = len(SESSION_MAGIC)
+            depth, length, size = header.unpack_from(data, position)
+            position += header.size
+            settings = json.loads(data[position:position + size])
+            position += size
+            stack = []
+            for _ in range(depth):
+                kind = data[position:position + 1]
+                if kind == b'f':
+                    stack.append(float_part.unpack_from(data, position)[1])
+                    position += float_part.size
+                elif kind == b'c':
+                    _, real, imag = complex_part.unpack_from(data, position)
+                    stack.append(complex(real, imag))
+                    position += complex_part.size
+                elif kind == b'a':
+                    _, sign, log10 = approx_part.unpack_from(data, position)
+                    stack.append(Approx(sign, log10))
+                    position += approx_part.size
+                elif kind == b'i':
+                    size = int_part.unpack_from(data, position)[1]
+                    position += int_part.size
+                    stack.append(int.from_bytes(
+                        data[position:position + size], 'little',
+                        signed=True))
+                    position += size
+                else:
+                    raise ValueError(f"{path} has a value of unknown "
+                                     + f"kind {kind!r}.")
+            history = []
+            for _ in range(length):
+                size, = text_part.unpack_from(data, position)
+                position += text_part.size
+                history.append(
+                    data[position:position + size].decode('utf-8'))
+                position += size
+        except (struct.error, UnicodeDecodeError) as error:
+            raise ValueError(f"{path} is not a complete RPN session.") \
+                from error
+        if position > len(data):
+            # Slices of ints and texts stop short at the end of the file
+            raise ValueError(f"{path} is not a complete RPN session.")
+    return stack, history, settings
+
+
+def evaluate_line(rpn, line):
+    """Evaluate one RPN program on an empty stack.
+
+    Returns the text to output for the line: the remaining stack, the
+    error if the program failed under the 'raise' policy or its result
+    can't be written out, or nothing if it was skipped."""
+    rpn.stack.clear()
+    try:
+        if not rpn.run(line):
+            return ""
+        return " ".join(format_value(value) for value in rpn.stack)
+    except (RPNError, ValueError, OverflowError) as error:
+        # ValueError from str() of an array of ints of thousands of digits
+        return "Error: " + " ".join(str(error).split())  # One line
+
+
+def evaluate_lines(rpn, lines):
+    """Evaluate a chunk of lines.
+
+    Returns the output for all of them, the error counts, and the
+    Instrumentation of the chunk if rpn is instrumented."""
+    rpn.error_counts.clear()
+    output = ''.join([evaluate_line(rpn, line) + '\n' for line in lines])
+    statistics = rpn.instrumentation
+    if statistics is not None:
+        rpn.instrument(statistics.fresh())
+    return output, collections.Counter(rpn.error_counts), statistics
+
+
+def chunked(lines, chunk_size):
+    """Yield lists of up to chunk_size lines."""
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+worker_rpn = None  # The RPN of a batch worker process
+
+
+def start_worker(error_policy, instrumentation=None, approximate=False,
+                 cache=None):
+    global worker_rpn
+    if cache is not None:
+        enable_cache(cache.fresh())
+    worker_rpn = RPN(error_policy, approximate)
+    if instrumentation is not None:
+        worker_rpn.instrument(instrumentation.fresh())
+
+
+def evaluate_chunk(lines):
+    """Evaluate a chunk of lines in a worker process."""
+    return evaluate_lines(worker_rpn, lines)
+
+
+def evaluate_parallel(lines, error_policy, jobs, chunk_size,
+                      instrumentation=None, approximate=False, cache=None):
+    """Evaluate chunks of lines in a pool of worker processes.
+
+    Every worker gets an empty copy of cache, if given. Yields the results
+    of evaluate_lines in input order. At most two
+    chunks per worker are in flight, so memory use does not grow with
+    the input."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs, initializer=start_worker,
+                             initargs=(error_policy, instrumentation,
+                                       approximate, cache)) as pool:
+        pending = collections.deque()
+        for chunk in chunked(lines, chunk_size):
+            pending.append(pool.submit(evaluate_chunk, chunk))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(path, out=None, error_policy='raise', jobs=1,
+              chunk_size=10000, instrumentation=None, approximate=False):
+    """Evaluate every line of path, writing one result per line to out.
+
+    With jobs above 1, chunks of chunk_size lines are evaluated in that
+    many worker processes, each with its own RPN. The output is in the
+    same order as the input either way. If given, instrumentation
+    collects the statistics of all of them. approximate turns on the
+    approximate mode of the RPNs."""
+    out = sys.stdout if out is None else out
+    lines = read_lines(path)
+    if jobs > 1:
+        results = evaluate_parallel(lines, error_policy, jobs, chunk_size,
+                                    instrumentation, approximate,
+                                    operator_cache)
+    else:
+        rpn = RPN(error_policy, approximate)
+        if instrumentation is not None:
+            rpn.instrument(instrumentation.fresh())
+        results = (evaluate_lines(rpn, chunk)
+                   for chunk in chunked(lines, chunk_size))
+    count = 0
+    error_counts = collections.Counter()
+    start = time.perf_counter()
+    for output, errors, statistics in results:
+        out.write(output)
+        count += output.count('\n')
+        error_counts += errors
+        if statistics is not None:
+            instrumentation.merge(statistics)
+    elapsed = time.perf_counter() - start
+    out.flush()
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print(f"{count} expressions in {elapsed:.3f} s ({rate:.0f} expr/s)",
+          file=sys.stderr)
+    if error_counts:
+        counts = ", ".join(f"{name} {number}" for name, number
+                           in sorted(error_counts.items()))
+        print(f"{sum(error_counts.values())} errors: {counts}",
+              file=sys.stderr)
+    return 0
+
+
+# Monte Carlo runs of programs using Rand and \u2684. Every block of trials
+# draws from its own generator, seeded by the seed of the run and the number
+# of the block, so the results only depend on the seed, not on how many
+# workers ran the blocks.
+
+MONTE_CARLO_BLOCK = 2 ** 16  # Trials drawn at once
+MONTE_CARLO_BINS = 20  # Bars of the histogram
+PERCENTILES = (5, 25, 50, 75, 95)
+SAMPLERS = {}  # Versions of the random operators by name, see below
+Distribution = collections.namedtuple(
+    'Distribution',
+    'trials seed failures mean stdev minimum maximum percentiles '
+    + 'edges counts')
+
+
+def register_sampler(name):
+    """Register the version of the random operator name that draws from a
+    given generator.
+
+    The sampler takes the generator, the number of trials and the
+    operands. For one trial at a time the generator is a random.Random
+    and the number None, and with NumPy it is a numpy.random.Generator
+    and the sampler draws for every trial at once."""
+    def register(sampler):
+        SAMPLERS[name] = sampler
+        return sampler
+    return register
+
+
+@register_sampler('Rand')
+def random_sampler(generator, size):
+    if size is None:
+        return generator.random()
+    return generator.random(size)
+
+
+@register_sampler('\u2684')  # dice
+def dice_sampler(generator, size, operand):
+    if size is None:
+        return math.ceil(operand * generator.random())
+    return np.ceil(np.asarray(operand) * generator.random(size))
+
+
+def sample_block(tokens, operands, seed, block, size):
+    """Run tokens on operands for size trials, drawing from the generator
+    of block number block.
+
+    Returns the tops of the stacks of the trials that did not fail, and
+    the number that did. With NumPy, every trial runs at once on arrays,
+    see trial_vector(). Only if an operator without an array version
+    fails, the block is run again one trial at a time."""
+    try:
+        enable_arrays()
+    except ImportError:
+        pass
+    rpn = RPN()
+    if np is not None:
+        generator = np.random.default_rng(
+            np.random.SeedSequence(seed, spawn_key=(block,)))
+        failed = np.zeros(size, dtype=bool)
+        items = [trial_vector(item, failed)
+                 if type(item) is Operator and item.vector is not None
+                 else item
+                 for item in sampling_items(tokens, generator, size)]
+        rpn.stack.extend(operands)
+        try:
+            with np.errstate(all='ignore'):
+                for item in items:
+                    if type(item) is Operator:
+                        rpn.process_operator(item)
+                    else:
+                        rpn.stack.append(item)
+        except RPNError:
             pass
-            # messagebox.showerror("Error",
-            #                      "Please enter a valid number or operator.")
-
-    def clear(self):
-        """Clear various variables when the Clear button is pressed."""
-        text = self.entry.get().strip()
-        if text:
-            # There is something in the entry field; clear this piecewise
-            self.entry.delete(0, tk.END)
-            self.entry.insert(0, text[:-1])
-        elif self.rpn.stack:
-            # Entry field is empty, stack has something in it
-            self.rpn.stack.clear()
-            self.update_display()
-        elif self.history:
-            # Stack is also empty, history has something in it
-            self.history.clear()
-            self.update_display()
         else:
-            # Nothing more to clear
-            pass
-
-    def update_display(self):
-        """Update the stack and history display labels."""
-        # Update stack display
-        # Pretty print stack
-        stack_string = "Stack: ["
-        for idx, token in enumerate(self.rpn.stack):
-            if type(token) == float:
-                stack_string += f"{token:.{self.settings_digits}g}"
-            else:
-                # token should be type int
-                stack_string += str(token)
-            if idx + 1 < len(self.rpn.stack):
-                # Add the comma only for the entries which are not the last
-                stack_string += ", "
-        stack_string += "]"
-        self.rpn.stack_label.config(text=stack_string)
-        # Update stack display
-        self.history_label.config(text=f"History: {self.history}")
-
-    def activate_help(self):
-        """Activate help mode and wait for user to click a button."""
-        if self.help_mode:
-            # Provide help on help button
-            help_text = self.help_texts.get('?',
-                                            "No help for this button.")
-            messagebox.showinfo("Help", help_text)
-            self.deactivate_help()
+            if rpn.stack:
+                top = np.broadcast_to(rpn.stack[-1], (size,))
+                return top[~failed].tolist(), int(failed.sum())
+            return [], size
+    items = sampling_items(tokens, random.Random(f"{seed}:{block}"), None)
+    values = []
+    stack = rpn.stack
+    for _ in range(size):
+        stack[:] = operands
+        try:
+            for item in items:
+                if type(item) is Operator:
+                    rpn.process_operator(item)
+                else:
+                    stack.append(item)
+        except RPNError:
+            continue
+        if stack:
+            values.append(stack[-1])
+    return values, size - len(values)
+
+
+def trial_vector(operator, failed):
+    """operator for a block of trials, with its array version marking the
+    trials that fail in the boolean array failed instead of raising.
+
+    Non-finite results fail the trial. If the array version raises, the
+    operator is applied one trial at a time, and only the trials it raises
+    for fail. Later operators still compute the failed trials, they are
+    dropped at the end."""
+    vector = operator.vector
+    function = operator.function
+    errors = operator.errors
+
+    def call(*operands):
+        try:
+            result = vector(*operands)
+        except errors:
+            size = len(failed)
+            results = []
+            for index, elements in enumerate(zip(*[
+                    np.broadcast_to(operand, (size,)).tolist()
+                    for operand in operands])):
+                try:
+                    results.append(function(*elements))
+                except errors:
+                    results.append(math.nan)
+                    failed[index] = True
+            result = np.array(results)
+        if np.asarray(result).dtype.kind in 'fc':
+            np.logical_or(failed, ~np.isfinite(result), out=failed)
+        return result
+    return Operator(operator.name, operator.arity, call, False, errors,
+                    operator.results, operator.counted)
+
+
+def sampling_items(tokens, generator, size):
+    """The values and Operators of tokens, with the random operators
+    drawing from generator, see register_sampler()."""
+    items = []
+    for token in tokens:
+        operator = OPERATORS.get(token)
+        if operator is None:
+            items.append(parse_number(token))
+        elif operator.name in SAMPLERS:
+            items.append(Operator(operator.name, operator.arity,
+                                  functools.partial(SAMPLERS[operator.name],
+                                                    generator, size),
+                                  False, operator.errors))
         else:
-            self.help_mode = True
-            self.help_button.config(bg=self.colors['help'][1])
-            self.entry.delete(0, tk.END)
-            self.entry.insert(tk.END, "Click button for help.")
-
-    def deactivate_help(self):
-        self.help_button.config(bg=self.colors['help'][0])
-        self.entry.delete(0, tk.END)
-        self.help_mode = False
+            items.append(operator)
+    return items
+
+
+def monte_carlo(program, trials, seed=None, operands=(), jobs=1,
+                bins=MONTE_CARLO_BINS):
+    """Run program trials times and return the Distribution of the value
+    it leaves on top of the stack.
+
+    program is a string or a sequence of tokens, run on a stack of
+    operands. Rand and \u2684 draw from generators seeded by seed, so the
+    same seed gives the same Distribution; by default a seed is picked,
+    and given in the Distribution. The trials run in blocks, spread over
+    jobs worker processes. Trials that fail or leave an empty stack are
+    counted as failures. Raises ParseError or StackUnderflowError before
+    running anything, like RPN.run()."""
+    tokens = tuple(inline_words(split_program(program)))
+    check_program(tokens, len(operands))
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 63)
+    operands = list(operands)
+    blocks = [(tokens, operands, seed, block,
+               min(MONTE_CARLO_BLOCK, trials - start))
+              for block, start in enumerate(range(0, trials,
+                                                  MONTE_CARLO_BLOCK))]
+    if jobs > 1 and len(blocks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(jobs, len(blocks))) as pool:
+            samples = list(pool.map(sample_block, *zip(*blocks)))
+    else:
+        samples = [sample_block(*block) for block in blocks]
+    values = list(itertools.chain.from_iterable(
+        values for values, _ in samples))
+    failures = sum(failed for _, failed in samples)
+    return summarize(values, seed, failures, bins)
+
+
+def summarize(values, seed=None, failures=0, bins=MONTE_CARLO_BINS):
+    """Distribution of values, sorting them in place.
+
+    NaN values are dropped, and counted as failures. The histogram has
+    bins bars of equal width from the smallest to the largest value, or
+    one per integer if the values are integers that fit in fewer bars,
+    like the throws of dice."""
+    import bisect
+
+    count = len(values)
+    values[:] = [value for value in values if value == value]  # Not NaN
+    failures += count - len(values)
+    values.sort()
+    count = len(values)
+    if not count:
+        return Distribution(failures, seed, failures, math.nan, math.nan,
+                            math.nan, math.nan,
+                            (math.nan,) * len(PERCENTILES), (), ())
+    low, high = values[0], values[-1]
+    if high - low < bins and all(value % 1 == 0 for value in values):
+        edges = [low - 0.5 + step for step in range(int(high - low) + 2)]
+    else:
+        width = (high - low) / bins or 1
+        edges = [low + step * width for step in range(bins + 1)]
+    # Values from an edge up to the next one are in the same bar
+    ends = [bisect.bisect_left(values, edge) for edge in edges[1:-1]]
+    ends.append(count)
+    counts = [end - start for start, end in zip([0] + ends, ends)]
+    return Distribution(
+        count + failures, seed, failures, mean(*values),
+        math.sqrt(variance(*values)) if count > 1 else math.nan,
+        low, high,
+        tuple(values[min(count - 1, count * percent // 100)]
+              for percent in PERCENTILES),
+        tuple(edges), tuple(counts))
+
+
+def distribution_report(distribution, width=40):
+    """The statistics and the histogram of distribution as text."""
+    lines = [f"{distribution.trials} trials, seed {distribution.seed}, "
+             + f"{distribution.failures} failed",
+             f"mean {distribution.mean:.6g}, "
+             + f"stdev {distribution.stdev:.6g}, "
+             + f"min {distribution.minimum:.6g}, "
+             + f"max {distribution.maximum:.6g}",
+             "percentiles " + ", ".join(
+                 f"{percent}% {value:.6g}" for percent, value
+                 in zip(PERCENTILES, distribution.percentiles))]
+    edges = distribution.edges
+    most = max(distribution.counts, default=0)
+    for low, high, count in zip(edges, edges[1:], distribution.counts):
+        if high - low == 1 and (low + 0.5) % 1 == 0:
+            label = f"{low + 0.5:>25.6g}"  # One bar per integer
+        else:
+            label = f"{low:>12.6g} {high:<12.6g}"
+        lines.append(f"{label} {'#' * round(width * count / most):<{width}} "
+                     + f"{count}")
+    return "\n".join(lines)
+
+
+def report_instrumentation(instrumentation, stats, trace):
+    if instrumentation is None:
+        return
+    if stats:
+        print(instrumentation.report(), file=sys.stderr)
+        if operator_cache is not None and operator_cache.info().misses:
+            # Worker processes have caches of their own
+            print(operator_cache.report(), file=sys.stderr)
+    if trace:
+        instrumentation.write_trace(trace)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Reverse Polish Notation calculator.")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="evaluate one RPN program per line of FILE "
+                        + "('-' for stdin) without the GUI, "
+                        + "writing one result per line")
+    parser.add_argument('--errors', choices=ERROR_POLICIES, default='raise',
+                        help="what to do when an expression fails: "
+                        + "report it (raise, the default), push NaN and "
+                        + "carry on (nan), or skip the expression (skip)")
+    parser.add_argument('--approximate', action='store_true',
+                        help="give results too large to compute exactly, "
+                        + "like 100000 !, as mantissa\u00d710^exponent")
+    parser.add_argument('--cache', type=int, metavar='ENTRIES',
+                        help="keep the results of up to ENTRIES pure "
+                        + "operations and programs, and reuse them for the "
+                        + "same operands")
+    parser.add_argument('--monte-carlo', metavar='PROGRAM',
+                        help="run PROGRAM, using Rand or \u2684, many times "
+                        + "without the GUI, and print the distribution of "
+                        + "its result")
+    parser.add_argument('--trials', type=int, default=100000,
+                        help="number of runs for --monte-carlo "
+                        + "(default 100000)")
+    parser.add_argument('--seed', type=int,
+                        help="seed for --monte-carlo, to get the same "
+                        + "results again (default: a new one every time)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of worker processes for --batch and "
+                        + "--monte-carlo (default 1, 0 for one per CPU "
+                        + "core)")
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help="lines per chunk handed to a worker "
+                        + "(default 10000)")
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help="serve the calculator on localhost:PORT, "
+                        + "one RPN program per line and one reply per line")
+    parser.add_argument('--http', type=int, metavar='PORT',
+                        help="also serve POST requests of RPN programs on "
+                        + "localhost:PORT with --serve")
+    parser.add_argument('--stats', action='store_true',
+                        help="print statistics of every operator to stderr "
+                        + "at the end")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a Chrome trace of every token to FILE "
+                        + "at the end")
+    parser.add_argument('--journal', metavar='FILE',
+                        help="append every input of the GUI to FILE, and "
+                        + "show the last ones as history at start")
+    parser.add_argument('--session', metavar='FILE',
+                        help="restore the stack, history and settings of "
+                        + "the GUI from FILE, and save them there every "
+                        + "minute and when the window is closed")
+    parser.add_argument('--undo-depth', type=int, default=UNDO_DEPTH,
+                        help="number of changes of the stack the GUI can "
+                        + f"undo (default {UNDO_DEPTH})")
+    parser.add_argument('--startup-time', action='store_true',
+                        help="open the GUI, print how long it took to show "
+                        + "the first frame, and close it again")
+    args = parser.parse_args(argv)
+
+    if args.cache:
+        enable_cache(OperatorCache(args.cache))
+    instrumentation = None
+    if args.stats or args.trace:
+        instrumentation = Instrumentation(trace=bool(args.trace))
+
+    if args.batch:
+        jobs = args.jobs or os.cpu_count() or 1
+        status = run_batch(args.batch, error_policy=args.errors, jobs=jobs,
+                           chunk_size=args.chunk_size,
+                           instrumentation=instrumentation,
+                           approximate=args.approximate)
+        report_instrumentation(instrumentation, args.stats, args.trace)
+        return status
+
+    if args.monte_carlo:
+        try:
+            distribution = monte_carlo(args.monte_carlo, args.trials,
+                                       args.seed,
+                                       jobs=args.jobs or os.cpu_count() or 1)
+        except RPNError as error:
+            print(f"Error: {error}", file=sys.stderr)
+            return 1
+        print(distribution_report(distribution))
+        return 0
+
+    if args.serve:
+        import rpn_server
+        return rpn_server.main(args.serve, args.http, jobs=args.jobs)
+
+    start = time.perf_counter()
+    from rpn_gui import CalculatorGUI  # Only the GUI needs tkinter
+    # Create an instance of the Calculator class
+    rpn_calc = RPN(approximate=args.approximate)
+    if instrumentation is not None:
+        rpn_calc.instrument(instrumentation)
+    journal = Journal(args.journal) if args.journal else None
+    # Pass the calculator object to the GUI
+    app = CalculatorGUI(rpn_calc, journal=journal, session=args.session,
+                        undo=UndoLog(args.undo_depth))
+    if args.startup_time:
+        app.update()  # Draw the first frame
+        elapsed = time.perf_counter() - start
+        print(f"First frame after {1000 * elapsed:.0f} ms")
+        app.destroy()
+        return 0
+    app.mainloop()
+    report_instrumentation(instrumentation, args.stats, args.trace)
+    return 0
 
 
 if __name__ == "__main__":
-    rpn_calc = RPN()  # Create an instance of the Calculator class
-    app = CalculatorGUI(rpn_calc)  # Pass the calculator object to the GUI
-    app.mainloop()
+    # Let rpn_gui and friends import this module as rpn, rather than
+    # loading a second copy with its own RPN and error classes.
+    sys.modules.setdefault('rpn', sys.modules[__name__])
+    sys.exit(main())
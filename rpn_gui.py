@@ -0,0 +1,1173 @@
+import collections
+import functools
+import itertools
+import math
+import os
+import threading
+import time
+import tkinter as tk
+from tkinter import messagebox
+
+from rpn import (APPROXIMATIONS, HEAVY_OPERATORS, SLOW_BITS, WORDS, Approx,
+                 RPNError, UndoLog, abbreviate_int, define_word,
+                 define_words, distribution_report, evaluate_tokens,
+                 export_stack, format_value, inline_words, load_session,
+                 monte_carlo, operands_needed, result_size, save_session,
+                 tokenize)
+
+HISTORY_SIZE = 1000  # Inputs kept in memory, the journal keeps them all
+JOURNAL_FLUSH_MS = 10000  # Time between writes of the journal
+SESSION_SAVE_MS = 60000  # Time between autosaves of the session
+JOB_POLL_MS = 50  # Time between checks on an operation in the worker
+SLOW_SECONDS = 0.2  # Operations taking longer go to the worker next time
+ABBREVIATE_BITS = 1000  # Larger ints are shown by their leading digits
+MONTE_CARLO_TRIALS = 100000  # Runs of a program by Edit > Monte Carlo
+BULK_TOKENS = 10000  # Tokens applied between redraws of long input
+PASTE_CHARS = 1000  # Longer pastes are applied without the entry field
+HISTORY_CHARS = 100  # Longer inputs are cut short in the history shown
+
+
+class CalculatorGUI(tk.Tk):
+    def __init__(self, rpn, journal=None, session=None, undo=None):
+        super().__init__()
+        self.rpn = rpn
+        self.title("RPN Calculator")
+        self.geometry("330x360")
+        # The latest input, the oldest are dropped when it is full
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.journal = journal  # Optional rpn.Journal of all input
+        if self.journal is not None:
+            self.history.extend(self.journal.tail(HISTORY_SIZE))
+            self.after(JOURNAL_FLUSH_MS, self.flush_journal)
+        self.session = session  # Optional file to save the session in
+        self.saving = None  # Thread saving the session, if any
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        # Changes of the stack, to undo and redo them
+        self.undo_log = undo if undo is not None else UndoLog()
+        self.bind("<Control-z>", lambda event: self.undo())
+        self.bind("<Control-y>", lambda event: self.redo())
+
+        # Slow operations run in a worker process, one at a time
+        self.pool = None  # Started on first use
+        self.job = None  # (name, result, function taking it, deadline)
+        # Smallest result_size() seen to take SLOW_SECONDS, by operator
+        self.slow_sizes = {}
+
+        self.operators = set(self.rpn.operators)  # The operator registry
+
+        self.help_mode = False  # Initially not in help mode
+        self.sci_mode = 0  # Initially not in scientific mode
+        self.hyp_mode = 0  # Initailly not in hyperbola mode
+
+        self.colors = {
+            'digit': '#ade',  # close to 'lightblue',
+            'number': '#69b',  # slightly darker blue
+            'op1': '#9e9',  # 'lightgreen',
+            'op2': '#6b6',  # slightly darker green
+            'Clear': 'lightgray',
+            'Enter': 'darkgray',
+            'sci': ['#ffa', '#fd5', '#fa0'],  # yellows/orange
+            'help': ['#a66', '#a00']  # reds
+        }
+
+        self.button_objs = {}
+        self.main_buttons = []  # Trying to keep track of all buttons
+        self.main_labels = []
+
+        # settings
+        self.settings_digits = 17
+        self.settings_shown = 8  # Stack and history entries shown
+        self.settings_layout = 'small'  # 'small', 'wide', 'tall'
+        self.settings_timeout = 60  # Seconds a slow operation may take
+
+        # Formatted stack entries by stack index, as (value, digits, text)
+        self.stack_strings = {}
+        self.refresh_pending = False  # See refresh()
+
+        settings = {}
+        if self.session is not None:
+            if os.path.exists(self.session):
+                settings = self.restore_session()
+            self.after(SESSION_SAVE_MS, self.autosave)
+
+        # Set layout
+        self.create_button_layout(self.settings_layout)
+        # Scientific and hyperbolic modes of the saved session
+        while ('sci' in self.button_objs
+               and self.sci_mode != settings.get('sci_mode', 0)):
+            self.toggle_sci_mode()
+        while ('hyp' in self.button_objs
+               and self.hyp_mode != settings.get('hyp_mode', 0)):
+            self.toggle_hyp_mode()
+
+        # The menu is not needed for the first frame
+        self.after_idle(self.create_menu)
+
+    @functools.cached_property
+    def help_texts(self):  # keep in gui
+        """Dictionary of help texts for each button.
+
+        Built the first time help is asked for, not at startup."""
+        return {
+            '.': "Decimal point. \n"
+            + "Separates the whole number from the fraction.",
+            '0': "0; Zero, \n"
+            + "The first digit and the basis of positional notation.",
+            '1': "1; One. First and foremost. Number one.",
+            '2': "2; Two is never first, but close.",
+            '3': "3; Three. First odd prime.",
+            '4': "4; Four in a row.",
+            '5': "5; Five is a handful.",
+            '6': "6; Six. First rectangular number.",
+            '7': "7; Seven. An excellent choise.",
+            '8': "8; Eight. The first digit in alphabetical order.",
+            '9': "9; Nine. First odd square.",
+            'π': "Pi is the circumference of a circle \n"
+            + "divided by its diameter.",
+            '\u03c4': "Tau is the circumference of a circle \n"
+            + "divided by its radius.",
+            'e': "e is a mathematical constant, \n"
+            + "the base of the natural logarithm and exponential function.\n"
+            + "e is approximately equal to 2.718281828459045235360287471352.",
+            '\u03c6': "Phi is the golden ratio. \n"
+            + "1 / phi = phi - 1.",
+            '+': "Addition operator. \n"
+            + "Adds two numbers.",
+            '-': "Subtraction operator. \n"
+            + "Subtracts the second number from the first.",
+            '\u00d7': "Multiplication operator. \n"
+            + "Multiplies two numbers.",
+            '/': "Division operator. \n"
+            + "Divides the first number by the second.",
+            '^': "Exponentiation operator. \n"
+            + "Raises the first number to the power of the second.",
+            '÷': "Integer division. \n"
+            + "Returns the integer part after division.",
+            '%': "Modulus operator. \n"
+            + "Returns the remainder of the division of two numbers.",
+            '√': "Square root operator. \n"
+            + "Returns the square root of a number.",
+            'sin': "Sine function. \n"
+            + "Returns the sine of an angle.",
+            'cos': "Cosine function. \n"
+            + "Returns the cosine of an angle.",
+            'tan': "Tangent function. \n"
+            + "Returns the tangent of an angle.",
+            'asin': "Inverse sine function. \n"
+            + "Returns the inverse of sin.",
+            'acos': "Inverse cosine function. \n"
+            + "Returns the inverse of cos.",
+            'atan': "Inverse tangent function. \n"
+            + "Returns the inverse of tan",
+            'sinh': "Hyperbolic sine function. \n"
+            + "Returns the hyperbolic sine of an angle.",
+            'cosh': "Hyperbolic cosine function. \n"
+            + "Returns the hyperbolic cosine of an angle.",
+            'tanh': "Hyperbolic tangent function. \n"
+            + "Returns the hyperbolic tangent of an angle.",
+            'asinh': "Inverse hyperbolic sine function. \n"
+            + "Returns the inverse of sinh.",
+            'acosh': "Inverse hyperbolic cosine function. \n"
+            + "Returns the inverse of cosh.",
+            'atanh': "Inverse hyperbolic tangent function. \n"
+            + "Returns the inverse of tanh.",
+            'ln': "Natural logarithm function. \n"
+            + "Returns the natural logarithm of a number.",
+            'lg2': "Base-2 logarithm function. \n"
+            + "Returns the logarithm of a number with base 2.",
+            'log': "Base-10 logarithm function. \n"
+            + "Returns the logarithm of a number with base 10.",
+            '1/x': "Reciprocal operator. \n"
+            + "Returns the reciprocal (1 divided by the number).",
+            '2^x': "Raise 2 to the power of x.",
+            'x^2': "Square x.",
+            '!': "Factorial function. \n"
+            + "Returns the factorial of a integer. \n"
+            + "For floats, it returns the \u0393(x+1), which is widely \n"
+            + "accepted as the factorial of non-integer numbers.",
+            '=': "'=' on an RPN? \n"
+            + "Yeah, this truncates the number i.e. rounds towards zero.\n"
+            + "On an approximate number, like 2.8\u00d710^456573, "
+            + "it computes the exact value.",
+            'Rand': "Generates a random number between 0 and 1.",
+            'n√': "Nth root operator. \n"
+            + "Returns the nth root of the first number.",
+            '\u2295': "Root Sum Square operator. \n"
+            + "Returns the Euclidean norm (distance) between two numbers. \n"
+            + "Equivalent to ['a', 'x^2', 'b', 'x^2', '+', '√']",
+            'E': "Scientific notation. \n"
+            + "x, y, E is x * 10^y.",
+            'sci': "Toggle various scientific functions.",
+            '?': "This is the help button. \n"
+            + "Click '?' and another button to get help on that other button.",
+            '(-)': "Negative symbol for entering negative numbers.",
+            'hyp': "Toggle hyperbolic trigonometric functions.",
+            'nCk': "How many ways you can choose k from n.",
+            '\u2684': "Trow an n-sided dice. \n"
+            + "If n is not integer, the last side of the \n"
+            + "dice is a little smaller than the others. \n"
+            + "A \u03c4-sided dice will sometimes give 7.",
+            'Clear': "Clears the input, one character at a time. \n"
+            + "If no input, clears the stack.\n"
+            + "If no stack, clears history, \n"
+            + "If no history, takes a nap.",
+            'Enter': "Transfers your input number to the stack."
+        }
+
+    def create_menu(self):
+        """Create the edit and settings menus."""
+        menubar = tk.Menu()
+        self.config(menu=menubar)
+        # Create an 'Edit' menu, with all the digits of the stack
+        edit_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Edit", menu=edit_menu)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z",
+                              command=self.undo)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y",
+                              command=self.redo)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Copy top of stack",
+                              command=self.copy_top)
+        edit_menu.add_command(label="Export stack\u2026",
+                              command=self.export_stack)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Monte Carlo of the entry",
+                              command=self.monte_carlo)
+        # Create a 'Settings' menu
+        settings_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Settings", menu=settings_menu)
+        settings_menu.add_command(label="Fairly square",
+                                  command=lambda: self.create_button_layout
+                                  ('small'))
+        settings_menu.add_command(label="Wide and nerdy",
+                                  command=lambda: self.create_button_layout
+                                  ('wide'))
+        settings_menu.add_command(label="A tall order",
+                                  command=lambda: self.create_button_layout
+                                  ('tall'))
+
+        # Create the 'Digits' setting submenu
+        digits_menu = tk.Menu(settings_menu, tearoff=0)
+        settings_menu.add_cascade(label="Show digits in stack",
+                                  menu=digits_menu)
+
+        # Define the valid choices for digits
+        valid_digits = [1, 2, 3, 5, 7, 11, 13, 17]
+
+        # Add the valid digits as menu items
+        for digit in valid_digits:
+            digits_menu.add_command(label=str(digit),
+                                    command=lambda digit=digit:
+                                        self.set_digits(digit))
+
+        # Create the 'Time limit' setting submenu
+        timeout_menu = tk.Menu(settings_menu, tearoff=0)
+        settings_menu.add_cascade(label="Time limit of slow operations",
+                                  menu=timeout_menu)
+        for seconds in [1, 10, 60, 600]:
+            timeout_menu.add_command(label=f"{seconds} s",
+                                     command=lambda seconds=seconds:
+                                         self.set_timeout(seconds))
+
+        # Approximate mode, for results too large to compute exactly
+        self.approximate = tk.BooleanVar(value=self.rpn.approximate)
+        settings_menu.add_checkbutton(label="Approximate huge results",
+                                      variable=self.approximate,
+                                      command=lambda: self.rpn.set_approximate
+                                      (self.approximate.get()))
+        # Create a 'Words' menu, with the user-defined words
+        self.words_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="Words", menu=self.words_menu)
+        self.update_words_menu()
+
+    def update_words_menu(self):
+        """List the user-defined words in the Words menu."""
+        self.operators = set(self.rpn.operators)
+        self.words_menu.delete(0, tk.END)
+        if not WORDS:
+            self.words_menu.add_command(label="Define one like "
+                                        + ": sq dup \u00d7 ;",
+                                        state=tk.DISABLED)
+        for name in sorted(WORDS):
+            self.words_menu.add_command(label=name,
+                                        command=lambda name=name:
+                                            self.on_button_click(name))
+
+    def set_timeout(self, seconds: int = 60):
+        self.settings_timeout = seconds
+
+    def set_digits(self, digit: int = 17):
+        self.settings_digits = digit
+        self.update_display()
+
+    def create_button_layout(self, settings_layout):
+        """Set up button layout based on the selected layout
+        ('small', 'wide', or 'tall')."""
+
+        if settings_layout == 'small':
+            self.geometry("330x360")
+
+            self.buttons = [('\u221a', 3, 3, self.colors['op1']),  # root
+                            ('sci', 3, 4, self.colors['sci'][0]),
+                            ('7', 4, 0, self.colors['digit']),
+                            ('8', 4, 1, self.colors['digit']),
+                            ('9', 4, 2, self.colors['digit']),
+                            ('/', 4, 3, self.colors['op2']),
+                            ('\u03c0', 4, 4, self.colors['number']),  # pi
+                            ('4', 5, 0, self.colors['digit']),
+                            ('5', 5, 1, self.colors['digit']),
+                            ('6', 5, 2, self.colors['digit']),
+                            ('\u00d7', 5, 3, self.colors['op2']),  # x
+                            ('^', 5, 4, self.colors['op2']),
+                            ('1', 6, 0, self.colors['digit']),
+                            ('2', 6, 1, self.colors['digit']),
+                            ('3', 6, 2, self.colors['digit']),
+                            ('-', 6, 3, self.colors['op2']),
+                            ('%', 6, 4, self.colors['op2']),
+                            ('(-)', 7, 0, self.colors['digit']),
+                            ('0', 7, 1, self.colors['digit']),
+                            ('.', 7, 2, self.colors['digit']),
+                            ('+', 7, 3, self.colors['op2']),
+                            ('\u00f7', 7, 4, self.colors['op2']),  # div
+                            ]
+
+            # Set position for special buttons and fields
+            self.entry_grid = (0, 0, 5, '')
+            self.entry_width = 25
+            self.rpn.stack_label_grid = (1, 0, 5, '')
+            self.rpn.stack_label_width = 30
+            self.history_label_grid = (2, 0, 5, '')
+            self.history_label_width = 30
+            self.clear_button_grid = (3, 1, 2, 'e')
+            self.clear_button_width = 6
+            self.enter_button_grid = (3, 0, 2, 'w')
+            self.enter_button_width = 6
+            self.help_button_grid = (3, 1, 1, '')
+            self.help_button_width = 2
+
+        elif settings_layout == 'wide':
+            self.geometry("650x330")
+
+            # Wide layout (buttons rearranged for a wider view)
+            self.buttons = [('Rand', 3, 0, self.colors['number']),
+                            ('\u2684', 3, 1, self.colors['op1']),  # dice
+                            ('!', 3, 2, self.colors['op1']),
+                            ('1/x', 3, 3, self.colors['op1']),
+                            # 3, 4, to 3, 8, is the Enter Clear and ? buttons
+                            ('hyp', 3, 9, self.colors['sci'][0]),
+                            ('\u03c6', 4, 0, self.colors['number']),  # phi
+                            ('=', 4, 1, self.colors['op1']),
+                            ('x^2', 4, 2, self.colors['op1']),
+                            ('2^x', 4, 3, self.colors['op1']),
+                            ('7', 4, 4, self.colors['digit']),
+                            ('8', 4, 5, self.colors['digit']),
+                            ('9', 4, 6, self.colors['digit']),
+                            ('/', 4, 7, self.colors['op2']),
+                            ('\u00f7', 4, 8, self.colors['op2']),  # div
+                            ('\u221a', 4, 9, self.colors['op1']),  # root
+                            ('e', 5, 0, self.colors['number']),
+                            ('ln', 5, 1, self.colors['op1']),
+                            ('log', 5, 2, self.colors['op1']),
+                            ('lg2', 5, 3, self.colors['op1']),
+                            ('4', 5, 4, self.colors['digit']),
+                            ('5', 5, 5, self.colors['digit']),
+                            ('6', 5, 6, self.colors['digit']),
+                            ('\u00d7', 5, 7, self.colors['op2']),  # x
+                            ('^', 5, 8, self.colors['op2']),
+                            ('n\u221a', 5, 9, self.colors['op2']),  # nth root
+                            ('\u03c0', 6, 0, self.colors['number']),  # pi(?)
+                            ('sin', 6, 1, self.colors['op1']),
+                            ('cos', 6, 2, self.colors['op1']),
+                            ('tan', 6, 3, self.colors['op1']),
+                            ('1', 6, 4, self.colors['digit']),
+                            ('2', 6, 5, self.colors['digit']),
+                            ('3', 6, 6, self.colors['digit']),
+                            ('-', 6, 7, self.colors['op2']),
+                            ('%', 6, 8, self.colors['op2']),
+                            ('nCk', 6, 9, self.colors['op2']),
+                            ('\u03c4', 7, 0, self.colors['number']),  # tau
+                            ('asin', 7, 1, self.colors['op1']),
+                            ('acos', 7, 2, self.colors['op1']),
+                            ('atan', 7, 3, self.colors['op1']),
+                            ('(-)', 7, 4, self.colors['digit']),
+                            ('0', 7, 5, self.colors['digit']),
+                            ('.', 7, 6, self.colors['digit']),
+                            ('+', 7, 7, self.colors['op2']),
+                            ('\u2295', 7, 8, self.colors['op2']),
+                            ('E', 7, 9, self.colors['op2'])
+                            ]
+
+            # Set postion, size and shape for special buttons and fields
+            self.entry_grid = (0, 0, 3, '')
+            self.entry_width = 15
+            self.rpn.stack_label_grid = (0, 3, 7, 'w')
+            self.rpn.stack_label_width = 44
+            self.history_label_grid = (2, 0, 10, 'e')
+            self.history_label_width = 63
+            self.enter_button_grid = (3, 4, 2, '')
+            self.enter_button_width = 10
+            self.clear_button_grid = (3, 6, 2, '')
+            self.clear_button_width = 10
+            self.help_button_grid = (3, 8, 1, '')
+            self.help_button_width = 4
+
+        elif settings_layout == 'tall':
+            self.geometry("330x620")
+
+            # Wide layout (buttons rearranged for a wider view)
+            self.buttons = [('Rand', 3, 0, self.colors['number']),
+                            ('\u2684', 3, 1, self.colors['op1']),  # dice
+                            ('!', 3, 2, self.colors['op1']),
+                            ('1/x', 3, 3, self.colors['op1']),
+                            ('\u03c6', 4, 0, self.colors['number']),  # phi
+                            ('=', 4, 1, self.colors['op1']),
+                            ('x^2', 4, 2, self.colors['op1']),
+                            ('2^x', 4, 3, self.colors['op1']),
+                            ('\u221a', 4, 4, self.colors['op1']),  # root
+                            ('e', 5, 0, self.colors['number']),
+                            ('ln', 5, 1, self.colors['op1']),
+                            ('log', 5, 2, self.colors['op1']),
+                            ('lg2', 5, 3, self.colors['op1']),
+                            ('n\u221a', 5, 4, self.colors['op2']),  # nth root
+                            ('\u03c0', 6, 0, self.colors['number']),  # pi(?)
+                            ('sin', 6, 1, self.colors['op1']),
+                            ('cos', 6, 2, self.colors['op1']),
+                            ('tan', 6, 3, self.colors['op1']),
+                            ('nCk', 6, 4, self.colors['op2']),
+                            ('\u03c4', 7, 0, self.colors['number']),  # tau
+                            ('asin', 7, 1, self.colors['op1']),
+                            ('acos', 7, 2, self.colors['op1']),
+                            ('atan', 7, 3, self.colors['op1']),
+                            ('E', 7, 4, self.colors['op2']),
+                            ('hyp', 8, 4, self.colors['sci'][0]),
+                            ('7', 9, 0, self.colors['digit']),
+                            ('8', 9, 1, self.colors['digit']),
+                            ('9', 9, 2, self.colors['digit']),
+                            ('/', 9, 3, self.colors['op2']),
+                            ('\u00f7', 9, 4, self.colors['op2']),  # div
+                            ('4', 10, 0, self.colors['digit']),
+                            ('5', 10, 1, self.colors['digit']),
+                            ('6', 10, 2, self.colors['digit']),
+                            ('\u00d7', 10, 3, self.colors['op2']),  # x
+                            ('^', 10, 4, self.colors['op2']),
+                            ('1', 11, 0, self.colors['digit']),
+                            ('2', 11, 1, self.colors['digit']),
+                            ('3', 11, 2, self.colors['digit']),
+                            ('-', 11, 3, self.colors['op2']),
+                            ('%', 11, 4, self.colors['op2']),
+                            ('(-)', 12, 0, self.colors['digit']),
+                            ('0', 12, 1, self.colors['digit']),
+                            ('.', 12, 2, self.colors['digit']),
+                            ('+', 12, 3, self.colors['op2']),
+                            ('\u2295', 12, 4, self.colors['op2']),
+                            ]
+
+            self.entry_grid = (0, 0, 5, '')
+            self.entry_width = 25
+            self.rpn.stack_label_grid = (1, 0, 5, '')
+            self.rpn.stack_label_width = 30
+            self.history_label_grid = (2, 0, 5, '')
+            self.history_label_width = 30
+
+            self.enter_button_grid = (8, 0, 2, '')
+            self.enter_button_width = 10
+            self.clear_button_grid = (8, 2, 2, '')
+            self.clear_button_width = 10
+            self.help_button_grid = (3, 4, 1, '')
+            self.help_button_width = 4
+
+        else:
+            print(f"Invalid layout {settings_layout}")
+            return
+        self.settings_layout = settings_layout
+
+        # Create the buttons for the number pad and operators with colors
+        self.forget_grid()
+        for (text, row, col, color) in self.buttons:
+            button = tk.Button(self, text=text,
+                               font=("Lucida Sans Unicode", 14),
+                               width=4, height=1, bg=color,
+                               command=self.create_button_handler(text))
+            button.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
+            self.button_objs[text] = button
+
+        # Set correct font and colors on buttons
+        self.update_buttons()
+
+        # Entry field for RPN expression
+        self.entry = tk.Entry(self, font=("Lucida Sans Unicode", 14),
+                              borderwidth=1, relief="solid")
+        self.entry.grid(row=self.entry_grid[0], column=self.entry_grid[1],
+                        columnspan=self.entry_grid[2],
+                        pady=5,
+                        sticky=self.entry_grid[3])
+        self.entry.config(width=self.entry_width)
+        self.entry.bind("<Return>", lambda event: self.process_input())
+        self.entry.bind("<KP_Enter>", lambda event: self.process_input())
+        self.entry.bind("<<Paste>>", self.paste)
+        self.main_labels.append(self.entry)
+
+        # Show the stack
+        self.rpn.stack_label = tk.Label(self, text="Stack: []",
+                                        font=("Lucida Sans Unicode", 12),
+                                        height=1, anchor="e")
+        self.rpn.stack_label.grid(row=self.rpn.stack_label_grid[0],
+                                  column=self.rpn.stack_label_grid[1],
+                                  columnspan=self.rpn.stack_label_grid[2],
+                                  pady=5,
+                                  sticky=self.history_label_grid[3])
+        self.rpn.stack_label.config(width=self.rpn.stack_label_width)
+        self.main_labels.append(self.rpn.stack_label)
+
+        # Show input history
+        self.history_label = tk.Label(self, text="History: []",
+                                      font=("Lucida Sans Unicode", 12),
+                                      height=1, anchor="e")
+        self.history_label.grid(row=self.history_label_grid[0],
+                                column=self.history_label_grid[1],
+                                columnspan=self.history_label_grid[2],
+                                pady=5,
+                                sticky=self.history_label_grid[3])
+        self.history_label.config(width=self.history_label_width)
+        self.main_labels.append(self.history_label)
+
+        # "Clear" button to clear the input
+        self.clear_button = tk.Button(self, text="Clear",
+                                      font=("Lucida Sans Unicode", 14),
+                                      height=1,
+                                      bg=self.colors["Clear"],
+                                      # command=self.clear,
+                                      command=lambda: self.on_button_click
+                                      ("Clear"),
+                                      )
+        self.clear_button.grid(row=self.clear_button_grid[0],
+                               column=self.clear_button_grid[1],
+                               columnspan=self.clear_button_grid[2],
+                               pady=5,
+                               sticky=self.clear_button_grid[3])
+        self.clear_button.config(width=self.clear_button_width)
+        self.main_buttons.append(self.clear_button)
+
+        # "Enter" button to add current value to the stack
+        self.enter_button = tk.Button(self, text="Enter",
+                                      font=("Lucida Sans Unicode", 14),
+                                      height=1,
+                                      bg=self.colors["Enter"],
+                                      # command=self.process_input,
+                                      command=lambda: self.on_button_click
+                                      ("Enter"),
+                                      )
+        self.enter_button.grid(row=self.enter_button_grid[0],
+                               column=self.enter_button_grid[1],
+                               columnspan=self.enter_button_grid[2],
+                               pady=5,
+                               sticky=self.enter_button_grid[3])
+        self.enter_button.config(width=self.enter_button_width)
+        self.main_buttons.append(self.enter_button)
+
+        # "Help" button to activate help mode
+        self.help_button = tk.Button(self, text="?",
+                                     font=("Lucida Sans Unicode", 14),
+                                     height=1,
+                                     bg=self.colors['help'][0],
+                                     command=self.activate_help)
+        self.help_button.grid(row=self.help_button_grid[0],
+                              column=self.help_button_grid[1],
+                              pady=5)
+        self.help_button.config(width=self.help_button_width)
+        self.main_buttons.append(self.help_button)
+
+        # Update idsplay to keep stack, history visible
+        self.update_display()
+
+    def forget_grid(self):  # keep in gui
+        """Clear any previous buttons from the grid."""
+        # print(f"{len(self.button_objs)=}")
+        for key, button in self.button_objs.items():
+            button.grid_forget()
+        self.button_objs.clear()
+
+        for button in self.main_buttons:
+            button.grid_forget()
+
+        for label in self.main_labels:
+            label.grid_forget()
+
+    def create_button_handler(self, text):  # keep in gui
+        """Returns a function that calls
+        self.on_button_click with the button text."""
+        def handler():
+            self.on_button_click(text)
+        return handler
+
+    def update_buttons(self):
+        """ Update colors and fonts for the buttons. """
+        for k, _ in self.button_objs.items():
+            # Change the color of some of the buttons
+            if self.button_objs[k].cget('text') in self.rpn.operator_2:
+                self.button_objs[k].config(bg=self.colors['op2'])
+            if self.button_objs[k].cget('text') in self.rpn.operator_1:
+                self.button_objs[k].config(bg=self.colors['op1'])
+            if self.button_objs[k].cget('text') in self.rpn.operator_0:
+                self.button_objs[k].config(bg=self.colors['number'])
+            # Change font
+            if self.button_objs[k].cget('text') in {'\u03c0',
+                                                    '\u03c4',
+                                                    '\u03c6'}:
+                # greek letters
+                self.button_objs[k].config(font=("Symbol", 14))
+            else:
+                self.button_objs[k].config(font=("Lucida Sans Unicode", 14))
+
+    def toggle_sci_mode(self):  # keep in gui
+        """Toggle between scientific and normal mode."""
+        # There are 3 modes.
+        self.sci_mode = (self.sci_mode + 1) % 3  # Change to next mode
+
+        sci_layouts = [{'√': '√',
+                        '/': '/',
+                        '\u00d7': '\u00d7',  # times
+                        '-': '-',
+                        '+': '+',
+                        '\u03c0': '\u03c0',  # pi
+                        '%': '%',
+                        '÷': '÷',
+                        '^': '^',
+                        },
+                       {'√': 'n\u221a',  # root
+                        '/': '1/x',
+                        '\u00d7': 'tan',
+                        '-': 'cos',
+                        '+': 'sin',
+                        '\u03c0': '\u03c4',  # tau
+                        '%': 'ln',  # ln, was e
+                        '÷': 'log',  # log was ln
+                        '^': 'e',  # e was log
+                        },
+                       {'√': '\u2295',  # circled pluss
+                        '/': 'Rand',
+                        '\u00d7': 'atan',
+                        '-': 'acos',
+                        '+': 'asin',
+                        '\u03c0': '\u03c6',  # phi
+                        '%': '!',
+                        '÷': 'lg2',
+                        '^': '=',
+                        }
+                       ]
+
+        # Change button labels to scientific mode and update handlers
+        for k, v in sci_layouts[self.sci_mode].items():
+            self.button_objs[k].config(text=v)
+            self.button_objs[k].config(command=self.create_button_handler(v))
+        # Update colors and fonts
+        self.update_buttons()
+
+        # Update sci button bg color
+        self.button_objs['sci'].config(bg=self.colors['sci'][self.sci_mode])
+
+    def toggle_hyp_mode(self):
+        """Toggle between scientific and normal mode."""
+        # There are 2 modes.
+        self.hyp_mode = (self.hyp_mode + 1) % 2  # Change to next mode
+
+        hyp_layouts = [{'sin': 'sin',
+                        'cos': 'cos',
+                        'tan': 'tan',
+                        'asin': 'asin',
+                        'acos': 'acos',
+                        'atan': 'atan',
+                        },
+                       {'sin': 'sinh',
+                        'cos': 'cosh',
+                        'tan': 'tanh',
+                        'asin': 'asinh',
+                        'acos': 'acosh',
+                        'atan': 'atanh',
+                        }
+                       ]
+
+        # Change button labels to scientific mode and update handlers
+        for k, v in hyp_layouts[self.hyp_mode].items():
+            self.button_objs[k].config(text=v)
+            self.button_objs[k].config(command=self.create_button_handler(v))
+        # Update colors and fonts
+        self.update_buttons()
+
+        # Update hyp button bg color
+        self.button_objs['hyp'].config(bg=self.colors['sci'][self.hyp_mode])
+
+    def on_button_click(self, button_text):
+        """Handle button click."""
+        # print(button_text)
+        if self.job is not None:
+            # Busy with a slow operation, Clear is Cancel
+            if button_text == "Clear":
+                self.cancel_job()
+            else:
+                self.bell()
+        elif self.help_mode:
+            # Show help text for the clicked button
+            if button_text in WORDS:
+                operator = self.rpn.operators[button_text]
+                help_text = (f": {button_text} {WORDS[button_text].body} ;\n"
+                             + f"Takes {operator.arity} values from the "
+                             + f"stack and gives {operator.results}.")
+            else:
+                help_text = self.help_texts.get(
+                    button_text, "Sorry, can't help you there.")
+            messagebox.showinfo("Help", help_text)
+            self.deactivate_help()
+        elif button_text == 'sci':
+            self.toggle_sci_mode()
+        elif button_text == 'hyp':
+            self.toggle_hyp_mode()
+        elif button_text == "Enter":
+            self.process_input()
+        elif button_text == "Clear":
+            self.clear()
+        else:
+            # For operators, we insert the operator and immediately calculate
+            if button_text in self.operators:
+                # print("op")
+                # For operators like '+', '-', '\u00d7', '/', etc.
+                self.entry.insert(tk.END, button_text)
+                self.process_input()  # Automatically trigger calculation
+            else:
+                # print("num")
+                # For numbers, just insert them into the entry field
+                if button_text == '(-)':
+                    # handle inputting negative numbers.
+                    self.entry.insert(tk.END, '-')
+                else:
+                    self.entry.insert(tk.END, button_text)
+
+    def process_input(self):
+        """Add the current value (operand or operator) to the stack
+        when Enter is pressed."""
+        if self.job is not None:
+            self.bell()
+            return
+        current_text = self.entry.get().strip()
+
+        if current_text:
+            # print(f"Yes, {current_text=}")
+            if self.process_text(current_text):
+                self.entry.delete(0, tk.END)
+        else:
+            pass
+            # messagebox.showerror("Error",
+            #                      "Please enter a valid number or operator.")
+
+    def process_text(self, text):
+        """Apply a program to the stack, defining the words in it, and
+        add it to the history.
+
+        Returns False if a definition in it failed."""
+        self.history.append(text)
+        if self.journal is not None:
+            self.journal.append(text)
+        try:
+            # Definitions of words, like ': sq dup \u00d7 ;'
+            program = define_words(text)
+        except RPNError as error:
+            messagebox.showerror(type(error).__name__, str(error))
+            return False
+        if program != text:
+            self.update_words_menu()
+        # Numbers and operators may be entered together,
+        # like '3 4+5\u00d7'
+        self.process_tokens(tokenize(program))
+        # Always update the stack_label to show the current stack
+        self.refresh()
+        return True
+
+    def paste(self, event=None):
+        """Paste the clipboard into the entry field.
+
+        Text of several lines, or long text, is applied to the stack at
+        once after what is in the entry field, rather than going through
+        the entry field."""
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return "break"  # Nothing to paste
+        if "\n" not in text.strip() and len(text) < PASTE_CHARS:
+            return None  # Pasted into the entry field by Tk
+        if self.job is not None:
+            self.bell()
+        elif self.process_text(f"{self.entry.get()} {text}".strip()):
+            self.entry.delete(0, tk.END)
+        return "break"
+
+    def process_tokens(self, tokens):
+        """Apply tokens to the stack, until one fails.
+
+        Up to BULK_TOKENS tokens are applied in one go, and recorded as one
+        change to undo. The rest waits for the next turn of the event
+        loop, so long programs leave the window responsive. An operation
+        predicted to be slow is handed to the worker, and the tokens after
+        it are applied when it is done."""
+        stack = self.rpn.stack
+        rest = tokens[BULK_TOKENS:]
+        tokens = tokens[:BULK_TOKENS]
+        needed = operands_needed(tokens)
+        base = max(0, len(stack) - needed) if needed != math.inf else 0
+        before = tuple(stack[base:])
+        try:
+            for index, token in enumerate(tokens):
+                operator = self.rpn.operators.get(token)
+                if operator is None or operator.arity is None \
+                        or len(stack) < operator.arity:
+                    # A number, an operator on the whole stack or the top k
+                    # values, or one failing for want of operands
+                    self.rpn.process_token(token)
+                    continue
+                operands = stack[len(stack) - operator.arity:]
+                size = result_size(operator, operands)
+                if size >= self.slow_size(operator.name) \
+                        and not (self.rpn.approximate
+                                 and operator.name in APPROXIMATIONS):
+                    # The worker may not know the words defined since
+                    # it started, so words are sent as their bodies
+                    body = WORDS[token].tokens if token in WORDS \
+                        else [token]
+                    self.start_job(operator.name, evaluate_tokens,
+                                   (operands, list(body)),
+                                   functools.partial(self.commit, operator,
+                                                     tokens[index + 1:]
+                                                     + rest))
+                    return
+                started = time.perf_counter()
+                self.rpn.process_token(token)
+                if time.perf_counter() - started > SLOW_SECONDS \
+                        and size > 64:
+                    # Learn that operands this large are slow
+                    self.slow_sizes[operator.name] = min(
+                        size, self.slow_size(operator.name))
+        except RPNError as error:
+            messagebox.showerror(type(error).__name__, str(error))
+            rest = None
+        finally:
+            self.undo_log.record(stack, base, before)
+        if rest:
+            # Let the window redraw and handle events before the rest
+            self.set_job(("input", None, None, None))
+            self.after(1, self.resume_input, self.job, rest)
+
+    def resume_input(self, job, tokens):
+        """Carry on with the tokens of job, unless it was cancelled."""
+        if self.job is job:
+            self.set_job(None)
+            self.process_tokens(tokens)
+
+    def slow_size(self, name):
+        """Smallest result_size() that makes operator name slow."""
+        if name in self.slow_sizes:
+            return self.slow_sizes[name]
+        if name in HEAVY_OPERATORS or name == '=':
+            # = computes the exact value of an Approx
+            return SLOW_BITS
+        return math.inf
+
+    def start_job(self, name, function, args, finish):
+        """Call function(*args) in the worker process, and finish with
+        its result once it is back.
+
+        Operations leave their operands on the stack until finish commits
+        the result, so a cancelled operation leaves the stack as it was."""
+        if self.pool is None:
+            import multiprocessing  # Only needed for slow operations
+            self.pool = multiprocessing.Pool(1)
+        result = self.pool.apply_async(function, args)
+        deadline = time.monotonic() + self.settings_timeout
+        self.set_job((name, result, finish, deadline))
+        self.after(JOB_POLL_MS, self.poll_job)
+
+    def set_job(self, job):
+        """Show that we are busy with job, and that Clear cancels it, or
+        that we are not if job is None."""
+        self.job = job
+        self.config(cursor="" if job is None else "watch")
+        self.clear_button.config(text="Clear" if job is None else "Cancel")
+        self.refresh()
+
+    def end_job(self):
+        self.set_job(None)
+
+    def poll_job(self):
+        """Finish the job once the worker is done with it."""
+        if self.job is None:
+            return  # Cancelled
+        name, result, finish, deadline = self.job
+        if not result.ready():
+            if time.monotonic() < deadline:
+                self.after(JOB_POLL_MS, self.poll_job)
+                return
+            self.cancel_job()
+            messagebox.showerror("Timeout",
+                                 f"{name} took longer than "
+                                 + f"{self.settings_timeout} s.")
+            return
+        self.end_job()
+        try:
+            value = result.get()
+        except RPNError as error:
+            # Handled like on this side, by the error policy
+            try:
+                self.rpn.handle_error(error)
+            except RPNError:
+                messagebox.showerror(type(error).__name__, str(error))
+        except OSError as error:
+            messagebox.showerror(type(error).__name__, str(error))
+        else:
+            finish(value)
+        self.refresh()
+
+    def commit(self, operator, tokens, stack):
+        """Replace the operands of operator with its results from the
+        worker, and carry on with the tokens after it."""
+        base = len(self.rpn.stack) - operator.arity
+        before = tuple(self.rpn.stack[base:])
+        del self.rpn.stack[base:]
+        self.rpn.stack.extend(stack)
+        self.undo_log.record(self.rpn.stack, base, before)
+        self.process_tokens(tokens)
+
+    def cancel_job(self):
+        """Stop the operation in the worker, leaving the stack as it was,
+        or the rest of a long input."""
+        if self.job[1] is not None:
+            self.pool.terminate()  # The only way to stop it
+            self.pool = None
+        self.end_job()
+
+    def copy_top(self):
+        """Copy the top of the stack to the clipboard, with all digits.
+
+        The digits of huge ints are worked out in the worker process."""
+        if self.job is not None or not self.rpn.stack:
+            self.bell()
+            return
+        value = self.rpn.stack[-1]
+        if type(value) == int and value.bit_length() > ABBREVIATE_BITS:
+            self.start_job("copy", format_value, (value,),
+                           self.set_clipboard)
+        else:
+            self.set_clipboard(format_value(value))
+
+    def set_clipboard(self, text):
+        self.clipboard_clear()
+        self.clipboard_append(text)
+
+    def export_stack(self):
+        """Write the whole stack to a file, in the worker process."""
+        if self.job is not None:
+            self.bell()
+            return
+        from tkinter import filedialog
+        path = filedialog.asksaveasfilename(title="Export stack",
+                                            defaultextension=".txt")
+        if path:
+            self.start_job("export", export_stack,
+                           (path, list(self.rpn.stack)), lambda _: None)
+
+    def monte_carlo(self):
+        """Run the program in the entry many times on the stack, in the
+        worker process, and show the distribution of its result.
+
+        The stack is left as it was."""
+        text = self.entry.get().strip()
+        if self.job is not None or not text:
+            self.bell()
+            return
+        # The worker may not know the words defined since it started
+        tokens = inline_words(tokenize(text))
+        self.start_job("Monte Carlo", monte_carlo,
+                       (tokens, MONTE_CARLO_TRIALS, None,
+                        list(self.rpn.stack)),
+                       lambda distribution: messagebox.showinfo(
+                           "Monte Carlo", distribution_report(distribution)))
+
+    def clear(self):
+        """Clear various variables when the Clear button is pressed."""
+        text = self.entry.get().strip()
+        if text:
+            # There is something in the entry field; clear this piecewise
+            self.entry.delete(0, tk.END)
+            self.entry.insert(0, text[:-1])
+        elif self.rpn.stack:
+            # Entry field is empty, stack has something in it
+            before = tuple(self.rpn.stack)
+            self.rpn.stack.clear()
+            self.undo_log.record(self.rpn.stack, 0, before)
+            self.refresh()
+        elif self.history:
+            # Stack is also empty, history has something in it
+            self.history.clear()
+            self.refresh()
+        else:
+            # Nothing more to clear
+            pass
+
+    def undo(self):
+        """Undo the latest change of the stack, if any."""
+        if self.job is not None or not self.undo_log.undo(self.rpn.stack):
+            self.bell()
+            return
+        self.refresh()
+
+    def redo(self):
+        """Redo the latest undone change of the stack, if any."""
+        if self.job is not None or not self.undo_log.redo(self.rpn.stack):
+            self.bell()
+            return
+        self.refresh()
+
+    def flush_journal(self):
+        """Write the journal now and then, rather than on every input."""
+        self.journal.flush()
+        self.after(JOURNAL_FLUSH_MS, self.flush_journal)
+
+    def restore_session(self):
+        """Load the stack, history and settings saved in self.session.
+
+        Returns the settings, the modes are set once the buttons exist."""
+        try:
+            stack, history, settings = load_session(self.session)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Session not restored", str(error))
+            return {}
+        self.rpn.stack[:] = stack
+        self.history.clear()
+        self.history.extend(history)
+        self.settings_digits = settings.get('digits', self.settings_digits)
+        self.settings_timeout = settings.get('timeout', self.settings_timeout)
+        self.rpn.set_approximate(settings.get('approximate',
+                                              self.rpn.approximate))
+        for name, body in settings.get('words', {}).items():
+            try:
+                define_word(name, body)
+            except RPNError as error:
+                messagebox.showerror(f"Word {name} not restored", str(error))
+        if settings.get('layout') in ('small', 'wide', 'tall'):
+            self.settings_layout = settings['layout']
+        return settings
+
+    def session_state(self):
+        """Copy of the stack, history and settings to save.
+
+        The values themselves are immutable, so only the lists are
+        copied, and they can be saved while the GUI carries on."""
+        settings = {'digits': self.settings_digits,
+                    'layout': self.settings_layout,
+                    'sci_mode': self.sci_mode,
+                    'hyp_mode': self.hyp_mode,
+                    'timeout': self.settings_timeout,
+                    'approximate': self.rpn.approximate,
+                    # Inlined, so they do not depend on each other
+                    'words': {name: ' '.join(word.tokens)
+                              for name, word in WORDS.items()},
+                    }
+        return list(self.rpn.stack), list(self.history), settings
+
+    def autosave(self):
+        """Save the session in a thread, so Tk is not kept waiting."""
+        if self.saving is None or not self.saving.is_alive():
+            self.saving = threading.Thread(target=save_session,
+                                           args=(self.session,
+                                                 *self.session_state()),
+                                           daemon=True)
+            self.saving.start()
+        self.after(SESSION_SAVE_MS, self.autosave)
+
+    def close(self):
+        """Stop the worker, write the rest of the journal, save the session
+        and close the window.
+
+        The window is closed even if the session can't be saved."""
+        if self.pool is not None:
+            self.pool.terminate()
+        if self.journal is not None:
+            self.journal.flush()
+        if self.session is not None:
+            if self.saving is not None:
+                self.saving.join()
+            try:
+                save_session(self.session, *self.session_state())
+            except (OSError, TypeError) as error:
+                messagebox.showerror("Session not saved", str(error))
+        self.destroy()
+
+    def format_entry(self, index):
+        """Formatted stack entry at index, reusing the cached text
+        while the entry is the same object."""
+        value = self.rpn.stack[index]
+        cached = self.stack_strings.get(index)
+        if cached and cached[0] is value \
+                and cached[1] == self.settings_digits:
+            return cached
+        if type(value) == float or type(value) == Approx:
+            text = f"{value:.{self.settings_digits}g}"
+        elif type(value) == int and value.bit_length() > ABBREVIATE_BITS:
+            # All the digits take long to compute, and do not fit anyway
+            text = abbreviate_int(value, self.settings_digits)
+        else:
+            # Smaller ints, complex numbers and arrays
+            text = str(value)
+        return value, self.settings_digits, text
+
+    def refresh(self):
+        """Update the display once the event loop is idle, so a burst of
+        changes is drawn once."""
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.after_idle(self.update_display)
+
+    def update_display(self):
+        """Update the stack and history display labels.
+
+        Only the top settings_shown entries are formatted and shown, so
+        the time per update does not grow with the depth of the stack."""
+        self.refresh_pending = False
+        depth = len(self.rpn.stack)
+        shown = range(max(0, depth - self.settings_shown), depth)
+        # Keep only the visible entries, the rest are formatted again if
+        # they come back into view
+        self.stack_strings = {index: self.format_entry(index)
+                              for index in shown}
+        entries = [self.stack_strings[index][2] for index in shown]
+        if depth > len(entries):
+            entries.insert(0, f"\u2026{depth - len(entries)} more")
+        if self.job is not None:
+            stack_string = f"Working on {self.job[0]}\u2026"
+        else:
+            stack_string = f"Stack: [{', '.join(entries)}]"
+        self.rpn.stack_label.config(text=stack_string)
+        # Update history display
+        history = [text if len(text) <= HISTORY_CHARS
+                   else text[:HISTORY_CHARS] + "\u2026"
+                   for text in itertools.islice(reversed(self.history),
+                                                self.settings_shown)][::-1]
+        if len(self.history) > len(history):
+            history.insert(0, f"\u2026{len(self.history) - len(history)}")
+        self.history_label.config(text=f"History: {history}")
+
+    def activate_help(self):
+        """Activate help mode and wait for user to click a button."""
+        if self.help_mode:
+            # Provide help on help button
+            help_text = self.help_texts.get('?',
+                                            "No help for this button.")
+            messagebox.showinfo("Help", help_text)
+            self.deactivate_help()
+        else:
+            self.help_mode = True
+            self.help_button.config(bg=self.colors['help'][1])
+            self.entry.delete(0, tk.END)
+            self.entry.insert(tk.END, "Click button for help.")
+
+    def deactivate_help(self):
+        self.help_button.config(bg=self.colors['help'][0])
+        self.entry.delete(0, tk.END)
+        self.help_mode = False
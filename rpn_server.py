@@ -0,0 +1,215 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import math
+import sys
+import threading
+
+from rpn import (HEAVY_OPERATORS, RPN, RPNError, format_value,
+                 operands_needed, split_program)
+
+HOST = '127.0.0.1'  # Only ever serve localhost
+LINE_LIMIT = 2 ** 24  # Longest program accepted, in bytes
+POOL_BITS = 2 ** 15  # Ints larger than this take milliseconds to format
+
+
+def evaluate_remote(operands, tokens):
+    """Evaluate tokens on a stack of operands, in a worker process.
+
+    Returns the resulting stack and the reply, as formatting a large
+    result takes time too."""
+    rpn = RPN()
+    rpn.stack.extend(operands)
+    try:
+        rpn.run(tokens)
+    except RPNError as error:
+        return None, error_reply(error)
+    return rpn.stack, top_reply(rpn.stack)
+
+
+def large(values):
+    """True if any of values is an int too large to work on in the event
+    loop."""
+    return any(type(value) is int and value.bit_length() > POOL_BITS
+               for value in values)
+
+
+def error_reply(error):
+    return "Error: " + " ".join(str(error).split())
+
+
+def top_reply(stack):
+    return format_value(stack[-1]) if stack else ""
+
+
+class WorkerPool(ProcessPoolExecutor):
+    """A ProcessPoolExecutor that can drop the work not started yet.
+
+    shutdown(cancel_futures=True) does this from Python 3.9 on."""
+
+    def __init__(self, jobs=None):
+        super().__init__(jobs)
+        self.pending = set()
+        self.lock = threading.Lock()  # Futures finish in another thread
+
+    def submit(self, function, *args, **kwargs):
+        future = super().submit(function, *args, **kwargs)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.forget)
+        return future
+
+    def forget(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def cancel_pending(self):
+        """Cancel the work that has not started yet."""
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+
+
+class Session():
+    """The calculator of one client connection."""
+
+    def __init__(self, pool):
+        self.rpn = RPN()
+        self.pool = pool
+
+    async def evaluate(self, line):
+        """Apply the program in line to the stack.
+
+        Returns the reply: the top of the stack, or the error. The stack
+        is left as it was if the program fails."""
+        tokens = split_program(line)
+        stack = self.rpn.stack
+        needed = operands_needed(tokens)
+        underflow = len(stack) < needed < math.inf
+        # All of the stack for operators on the whole stack
+        base = max(0, len(stack) - needed)
+        operands = stack[base:]
+        loop = asyncio.get_running_loop()
+        # Lines using heavy operators or huge operands are evaluated in a
+        # worker process, so they do not hold up other clients
+        if underflow or (HEAVY_OPERATORS.isdisjoint(tokens)
+                         and not large(operands)):
+            try:
+                self.rpn.run(tokens)
+            except RPNError as error:
+                del stack[base:]
+                stack.extend(operands)
+                return error_reply(error)
+            if large(stack[-1:]):
+                # Formatting is the slow part then, say after a drop
+                return await loop.run_in_executor(self.pool, top_reply,
+                                                  stack[-1:])
+            return top_reply(stack)
+
+        # Hand the operands to a worker, and put back the results
+        results, reply = await loop.run_in_executor(
+            self.pool, evaluate_remote, operands, tokens)
+        if results is not None:
+            del stack[base:]
+            stack.extend(results)
+        return reply
+
+
+class Server():
+    """Line protocol and HTTP servers with a shared worker pool."""
+
+    def __init__(self, jobs=None):
+        self.pool = WorkerPool(jobs)
+
+    async def handle_line_client(self, reader, writer):
+        """Reply to every line from the client, in order.
+
+        Clients may send many lines without waiting for the replies."""
+        session = Session(self.pool)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await session.evaluate(line.decode('utf-8'))
+                writer.write(reply.encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError is a line longer than LINE_LIMIT
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http_client(self, reader, writer):
+        """Answer one HTTP request.
+
+        POST a body of RPN programs, one per line, to get one reply per
+        line back. Every request is a new session."""
+        try:
+            request = await reader.readline()
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            method = request.split(b' ', 1)[0]
+            if method != b'POST':
+                await self.send_http(writer, '405 Method Not Allowed',
+                                     "POST RPN programs, one per line.\n")
+                return
+            length = int(headers.get('content-length', 0))
+            body = await reader.readexactly(length)
+            session = Session(self.pool)
+            replies = [await session.evaluate(line)
+                       for line in body.decode('utf-8').splitlines()]
+            await self.send_http(writer, '200 OK',
+                                 ''.join(reply + '\n' for reply in replies))
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send_http(self, writer, status, text):
+        body = text.encode('utf-8')
+        writer.write(f"HTTP/1.1 {status}\r\n".encode('latin-1')
+                     + b"Content-Type: text/plain; charset=utf-8\r\n"
+                     + f"Content-Length: {len(body)}\r\n".encode('latin-1')
+                     + b"Connection: close\r\n\r\n" + body)
+        await writer.drain()
+
+    async def start(self, port, http_port=None):
+        """Start listening. Returns the asyncio servers."""
+        servers = [await asyncio.start_server(self.handle_line_client,
+                                              HOST, port, limit=LINE_LIMIT)]
+        if http_port is not None:
+            servers.append(await asyncio.start_server(
+                self.handle_http_client, HOST, http_port, limit=LINE_LIMIT))
+        return servers
+
+    def close(self):
+        """Stop the workers once the work they have started is done."""
+        self.pool.cancel_pending()
+        self.pool.shutdown()
+
+
+async def serve(port, http_port=None, jobs=None):
+    server = Server(jobs)
+    try:
+        servers = await server.start(port, http_port)
+        for listening in servers:
+            for socket in listening.sockets:
+                print(f"Serving on {socket.getsockname()}", file=sys.stderr)
+        await asyncio.gather(*(listening.serve_forever()
+                               for listening in servers))
+    finally:
+        server.close()
+
+
+def main(port, http_port=None, jobs=None):
+    try:
+        asyncio.run(serve(port, http_port, jobs or None))
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,84 @@
+import pytest
+
+import bench_rpn
+
+
+@pytest.fixture
+def benchmarks(monkeypatch):
+    monkeypatch.setattr(bench_rpn, 'BENCHMARKS', {})
+    monkeypatch.setattr(bench_rpn, 'time_call', lambda run: run() or 1e-6)
+    return bench_rpn.BENCHMARKS
+
+
+def test_setup_is_undone_after_each_benchmark(benchmarks):
+    closed = []
+
+    @bench_rpn.benchmark('window')
+    def window():
+        bench_rpn.CLEANUPS.append(lambda: closed.append('window'))
+        return lambda: None
+
+    @bench_rpn.benchmark('failing')
+    def failing():
+        bench_rpn.CLEANUPS.append(lambda: closed.append('failing'))
+        return lambda: 1 / 0
+
+    with pytest.raises(ZeroDivisionError):
+        bench_rpn.run_benchmarks()
+    assert closed == ['window', 'failing']
+    assert bench_rpn.CLEANUPS == []
+
+
+def test_threshold_is_above_the_noise(benchmarks, tmp_path):
+    @bench_rpn.benchmark('noisy')
+    def noisy():
+        return lambda: None
+
+    old = tmp_path / 'old.json'
+    old.write_text('{"results": {"noisy": 0.87e-6}}')  # 15% faster
+    assert bench_rpn.main(['--compare', str(old)]) == 0
+    assert bench_rpn.main(['--compare', str(old), '--threshold', '0.1']) == 1
+
+
+def test_gui_app_is_skipped_only_without_a_display(monkeypatch):
+    tkinter = pytest.importorskip('tkinter')
+    import rpn_gui
+
+    def no_display(calculator):
+        raise tkinter.TclError("no display name")
+    monkeypatch.setattr(rpn_gui, 'CalculatorGUI', no_display)
+    assert bench_rpn.gui_app() is None
+
+    def broken(calculator):
+        raise AttributeError("a bug")
+    monkeypatch.setattr(rpn_gui, 'CalculatorGUI', broken)
+    with pytest.raises(AttributeError):
+        bench_rpn.gui_app()
+
+
+class PastingApp():
+    """Stands in for a CalculatorGUI leaving the end of long input to the
+    event loop."""
+
+    def __init__(self):
+        self.rpn = bench_rpn.rpn.RPN()
+        self.job = None
+        self.updates = 0
+
+    def process_text(self, text):
+        self.job = ('input', None, None, None)
+
+    def update(self):
+        self.updates += 1
+        self.job = None
+
+    def update_display(self):
+        pass
+
+
+def test_paste_benchmark_waits_for_all_of_the_input(monkeypatch):
+    app = PastingApp()
+    monkeypatch.setattr(bench_rpn, 'gui_app', lambda: app)
+    bench_rpn.paste_benchmark(10)()
+    assert app.job is None
+    assert app.updates == 1
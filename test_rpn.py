@@ -0,0 +1,754 @@
+import math
+import operator
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import rpn
+from rpn import RPN, RPNError
+
+
+def outcome(program, *operands, **options):
+    """The stack left by program on operands, or the type of its error."""
+    calculator = RPN(**options)
+    calculator.stack.extend(operands)
+    try:
+        calculator.run(program)
+    except RPNError as error:
+        return type(error)
+    return calculator.stack
+
+
+def python(script):
+    """What script prints when run in a fresh interpreter."""
+    return subprocess.run([sys.executable, '-c', script], check=True,
+                          capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(rpn.__file__))
+                          ).stdout
+
+
+# Operators dispatch as before the registry
+
+def old_divide(operand1, operand2):
+    if operand2 == 0:
+        raise ZeroDivisionError
+    return operand1 // operand2 if operand1 % operand2 == 0 \
+        else operand1 / operand2
+
+
+def old_integer_divide(operand1, operand2):
+    if operand2 == 0:
+        raise ZeroDivisionError
+    return operand1 // operand2
+
+
+def old_root(operand, degree=2):
+    if operand < 0:
+        raise ValueError
+    return math.sqrt(operand) if degree == 2 else operand ** (1 / degree)
+
+
+def old_dice(operand):
+    return math.ceil(operand * random.random())
+
+
+# What the if/elif chains of evaluate_two, evaluate_one and evaluate_zero
+# gave, or raised where they showed an error
+OLD_OPERATORS = {
+    2: {'+': operator.add, '-': operator.sub, '\u00d7': operator.mul,
+        '/': old_divide, '^': operator.pow, '%': operator.mod,
+        '\u00f7': old_integer_divide,
+        'n\u221a': old_root, 'nCk': math.comb,
+        'E': lambda operand1, operand2: operand1 * 10 ** operand2,
+        '\u2295': lambda operand1, operand2: math.sqrt(operand1 ** 2
+                                                       + operand2 ** 2)},
+    1: {'\u221a': old_root, 'sin': math.sin, 'cos': math.cos,
+        'tan': math.tan, 'asin': math.asin, 'acos': math.acos,
+        'atan': math.atan, 'sinh': math.sinh, 'cosh': math.cosh,
+        'tanh': math.tanh, 'asinh': math.asinh, 'acosh': math.acosh,
+        'atanh': math.atanh, 'ln': math.log, 'log': math.log10,
+        'lg2': math.log2, '1/x': lambda operand: 1 / operand,
+        '!': lambda operand: math.factorial(operand)
+        if type(operand) == int else math.gamma(operand + 1),
+        '=': int, 'x^2': lambda operand: operand ** 2,
+        '2^x': lambda operand: 2 ** operand, '\u2684': old_dice},
+    0: {'\u03c0': lambda: math.pi, '\u03c4': lambda: 2 * math.pi,
+        'e': lambda: math.e, '\u03c6': lambda: (1 + math.sqrt(5)) / 2,
+        'Rand': random.random},
+}
+OLD_OPERANDS = {2: [(7, 2), (6, 3), (2.5, 4), (-3, 2), (5, 0), (-8, 3)],
+                1: [(0.5,), (3,), (-2,), (0,), (20.0,)],
+                0: [()]}
+
+
+@pytest.mark.parametrize('arity', [0, 1, 2])
+def test_registry_has_the_old_operators(arity):
+    assert set(OLD_OPERATORS[arity]) <= rpn.OPERATOR_SETS[arity]
+    for name in OLD_OPERATORS[arity]:
+        assert rpn.OPERATORS[name].arity == arity
+
+
+@pytest.mark.parametrize('arity, name', [
+    (arity, name) for arity in OLD_OPERATORS for name in OLD_OPERATORS[arity]])
+def test_registry_dispatches_like_the_old_chains(arity, name):
+    for operands in OLD_OPERANDS[arity]:
+        random.seed(1)
+        try:
+            old = [OLD_OPERATORS[arity][name](*operands)]
+        except (ArithmeticError, ValueError, TypeError):
+            old = RPNError
+        random.seed(1)
+        new = outcome(name, *operands)
+        if old is RPNError:
+            assert issubclass(new, RPNError), operands
+        else:
+            assert new == old, operands
+            assert type(new[0]) is type(old[0]), operands
+
+
+# Splitting programs into tokens
+
+@pytest.mark.parametrize('text, tokens', [
+    ('', []),
+    (' \t\n', []),
+    ('\t1\n2 ', ['1', '2']),
+    ('3 4+5*', ['3', '4', '+', '5', '\u00d7']),
+    ('1 -2 -', ['1', '-2', '-']),
+    ('1-2', ['1', '-', '2']),
+    ('--1', ['-', '-', '1']),
+    ('.5 5. +.5 2.5e-3 2E3', ['.5', '5.', '+.5', '2.5e-3', '2E3']),
+    ('1e5e5', ['1e5', 'e', '5']),
+    ('1e', ['1', 'e']),
+    ('21/x 1/x1/x', ['2', '1/x', '1/x', '1/x']),
+    ('2^x2 10nCk nCk5', ['2^x', '2', '10', 'nCk', 'nCk', '5']),
+    ('-sin lnln \u03c0e', ['-', 'sin', 'ln', 'ln', '\u03c0', 'e']),
+    ('sum 1 2 sumk', ['\u03a3', '1', '2', '\u03a3k']),
+    ('1_000 -2_0.5_5e1_0', ['1_000', '-2_0.5_5e1_0']),
+    ('1__0 1_', ['1', '__0', '1', '_']),
+    ('abc 1,5', ['abc', '1', ',5']),
+])
+def test_tokenize(text, tokens):
+    assert rpn.tokenize(text) == tokens
+
+
+@pytest.mark.parametrize('program, result', [('1_000 2 \u00d7', [2000]),
+                                             ('1_0.5', [10.5]),
+                                             ('1__0', rpn.ParseError),
+                                             ('1,5', rpn.ParseError)])
+def test_numbers_parse_like_python(program, result):
+    assert outcome(program) == result
+
+
+def test_tokenize_long_programs():
+    assert rpn.tokenize('1 2+' * 100000) == ['1', '2', '+'] * 100000
+
+
+# The stack
+
+def test_each_calculator_has_its_own_stack():
+    first, second = RPN(), RPN()
+    first.run('1 2')
+    assert first.stack == [1, 2]
+    assert second.stack == []
+
+
+@pytest.mark.parametrize('program, result', [('1 2 +', [3]),
+                                             ('1 2 swap', [2, 1]),
+                                             ('1 dup', [1, 1]),
+                                             ('1 2 drop', [1]),
+                                             ('1 2 3 \u03a3', [6])])
+def test_operators_update_the_stack_in_place(program, result):
+    calculator = RPN()
+    stack = calculator.stack
+    calculator.run(program)
+    assert calculator.stack is stack
+    assert stack == result
+
+
+@pytest.mark.parametrize('operands, token', [([1, 0], '/'), ([1], '+'),
+                                             ([-1], '\u221a'), ([2], 'x')])
+def test_failed_token_leaves_the_stack_as_it_was(operands, token):
+    calculator = RPN()
+    calculator.stack.extend(operands)
+    with pytest.raises(RPNError):
+        calculator.process_token(token)
+    assert calculator.stack == operands
+
+
+# Errors and error policies
+
+@pytest.mark.parametrize('program, error', [
+    ('1 +', rpn.StackUnderflowError),
+    ('1 0 /', rpn.DomainError),
+    ('-1 ln', rpn.DomainError),
+    ('0 1/x', rpn.DomainError),
+    ('10.0 400 ^', rpn.RPNOverflowError),
+    ('171.5 !', rpn.RPNOverflowError),
+    ('1 2 x +', rpn.ParseError),
+])
+def test_errors_are_typed(program, error):
+    assert outcome(program) is error
+
+
+def test_nan_policy_carries_on():
+    calculator = RPN(error_policy='nan')
+    calculator.run('1 0 / 2 + 4 5 +')
+    assert math.isnan(calculator.stack[0])
+    assert calculator.stack[1:] == [9]
+    assert calculator.error_counts == {'DomainError': 1}
+
+
+def test_skip_policy_skips_the_program():
+    calculator = RPN(error_policy='skip')
+    calculator.stack.append(7)
+    assert not calculator.run('1 0 / 2')
+    assert not calculator.run('1 2 x')
+    assert calculator.stack == [7]
+    assert calculator.run('2 +')
+    assert calculator.stack == [9]
+    assert calculator.error_counts == {'DomainError': 1, 'ParseError': 1}
+
+
+def test_unknown_error_policy():
+    with pytest.raises(ValueError):
+        RPN(error_policy='ignore')
+
+
+@pytest.mark.parametrize('policy, lines', [
+    ('raise', ['3', 'Error: Too few operands to +.',
+               'Error: ln: math domain error']),
+    ('nan', ['3', 'nan', 'nan']),
+    ('skip', ['3', '', '']),
+])
+def test_batch_counts_errors(tmp_path, capsys, policy, lines):
+    import io
+
+    path = tmp_path / 'programs'
+    path.write_text('1 2 +\n1 +\n0 ln\n')
+    out = io.StringIO()
+    rpn.run_batch(str(path), out, error_policy=policy)
+    assert out.getvalue().splitlines() == lines
+    assert capsys.readouterr().err.endswith(
+        "2 errors: DomainError 1, StackUnderflowError 1\n")
+
+
+# Operators on arrays give what they give for each element on its own
+
+@pytest.fixture
+def np():
+    numpy = pytest.importorskip('numpy')
+    rpn.enable_arrays()
+    return numpy
+
+
+@pytest.mark.parametrize('token, operands', [
+    ('2^x', [64]),
+    ('2^x', [70]),
+    ('^', [3, 40]),
+    ('^', [2, -1]),
+    ('^', [10.0, 400]),
+    ('E', [7, 30]),
+    ('x^2', [10 ** 10]),
+    ('x^2', [1e200]),
+    ('+', [2 ** 62, 2 ** 62]),
+    ('×', [2 ** 40, 2 ** 40]),
+    ('!', [-1]),
+    ('!', [-2.0]),
+    ('!', [25]),
+    ('!', [2.5]),
+    ('!', [200.0]),
+    ('=', [1e30]),
+    ('ln', [0.0]),
+    ('ln', [-1.0]),
+    ('log', [0]),
+    ('lg2', [-4]),
+    ('asin', [2.0]),
+    ('acos', [-1.5]),
+    ('acosh', [0.5]),
+    ('atanh', [1.0]),
+    ('cosh', [1000.0]),
+    ('1/x', [0]),
+    ('1/x', [4]),
+    ('%', [5, 0]),
+    ('/', [6, 4]),
+])
+def test_array_matches_scalar(np, token, operands):
+    scalar = outcome(token, *operands)
+    vector = outcome(token, np.array([operands[0]]), *operands[1:])
+    if isinstance(scalar, type):
+        assert vector is scalar
+    else:
+        assert len(vector) == 1
+        value, = vector[0].tolist()
+        assert type(value) is type(scalar[0])
+        assert value == (scalar[0] if type(value) is int
+                         else pytest.approx(scalar[0]))
+
+
+def test_array_errors_raise_whatever_the_errstate(np):
+    with np.errstate(all='warn'):
+        assert outcome('ln', np.array([1.0, 0.0])) is rpn.DomainError
+
+
+# Checking and folding programs
+
+def plan(program):
+    """The Plan of program, a string."""
+    return rpn.plan_program(tuple(rpn.tokenize(program)))
+
+
+@pytest.mark.parametrize('program, items', [
+    ('\u03c0 2 \u00d7', [2 * math.pi]),
+    ('2 10 ^', [1024]),
+    ('\u03c6 1/x', [2 / (1 + math.sqrt(5))]),
+    ('3 4 swap -', [1]),
+    ('1 2 dup', [1, 2, 2]),
+])
+def test_constants_are_folded(program, items):
+    assert plan(program).items == pytest.approx(items)
+
+
+@pytest.mark.parametrize('program, operators', [
+    ('Rand 2 \u00d7', ['Rand', '\u00d7']),  # Not pure
+    ('1 0 /', ['/']),  # Fails when run
+    ('100000 !', ['!']),  # Too large
+    ('1 2 3 \u03a3 2 \u00d7', ['\u03a3', '\u00d7']),
+    ('2 + 3 \u00d7', ['+', '\u00d7']),
+])
+def test_operators_left_to_run(program, operators):
+    assert [item.name for item in plan(program).items
+            if type(item) is rpn.Operator] == operators
+
+
+@pytest.mark.parametrize('program, needed, pure', [
+    ('1 +', 1, True),
+    ('+ \u00d7 2', 3, True),
+    ('drop drop 1', 2, True),
+    ('Rand +', 1, False),
+    ('\u03a3k', 1, False),
+])
+def test_plan_counts_operands(program, needed, pure):
+    assert plan(program)[1:3] == (needed, pure)
+
+
+@pytest.mark.parametrize('program, depth, error, token', [
+    ('1 + x', 0, rpn.StackUnderflowError, '+'),
+    ('1 2 x +', 0, rpn.ParseError, 'x'),
+    ('+ +', 2, rpn.StackUnderflowError, '+'),
+    ('\u03a3k', 0, rpn.StackUnderflowError, '\u03a3k'),
+])
+def test_check_finds_the_failing_token(program, depth, error, token):
+    with pytest.raises(error) as raised:
+        rpn.check_program(tuple(rpn.tokenize(program)), depth)
+    assert raised.value.token == token
+
+
+@pytest.mark.parametrize('program, depth', [('1 +', 1), ('+ +', 3),
+                                            ('1 2 3 \u03a3 +', 0)])
+def test_check_passes_valid_programs(program, depth):
+    rpn.check_program(tuple(rpn.tokenize(program)), depth)
+
+
+def test_program_underflowing_late_fails_before_running():
+    calculator = RPN()
+    calculator.stack.append(5)
+    with pytest.raises(rpn.StackUnderflowError):
+        calculator.run('! 2 \u00d7 +')
+    assert calculator.stack == [5]
+
+
+# Compiled programs
+
+@pytest.mark.parametrize('body, operands', [
+    ('0 /', [1]),
+    ('ln 2 +', [-1]),
+    ('x^2 swap x^2 + \u221a', [1e200, 1]),
+    ('swap / 1 +', [0, 1]),
+    ('2 ^ sin', [1e200]),
+    ('1 swap - 3 \u00d7 acos', [5]),
+])
+def test_compiled_errors_match_interpreted(body, operands):
+    names = [f"in{index}" for index in range(len(operands))]
+    function = RPN.compile(' '.join(names + [body]), inputs=names)
+    with pytest.raises(RPNError) as compiled:
+        function(*operands)
+    calculator = RPN()
+    calculator.stack.extend(operands)
+    with pytest.raises(RPNError) as interpreted:
+        calculator.run(body)
+    assert type(compiled.value) is type(interpreted.value)
+    assert str(compiled.value) == str(interpreted.value)
+    assert compiled.value.consumed == interpreted.value.consumed
+
+
+def test_compiled_array_errors_match_interpreted(np):
+    operands = np.array([1.0, 0.0]), np.array([70])
+    function = RPN.compile('a ln b 2^x \u00d7', inputs=('a', 'b'))
+    with pytest.raises(RPNError) as compiled:
+        function(*operands)
+    calculator = RPN()
+    calculator.stack.extend(operands)
+    with pytest.raises(RPNError) as interpreted:
+        calculator.run('swap ln swap 2^x \u00d7')
+    assert type(compiled.value) is type(interpreted.value) is rpn.DomainError
+    assert str(compiled.value) == str(interpreted.value)
+    assert function(np.array([1.0]), np.array([70])).tolist() == [0.0]
+
+
+def test_programs_compiled_before_numpy_take_arrays():
+    pytest.importorskip('numpy')
+    script = """if True:
+        import rpn
+        rpn.define_word('sn', 'sin 1 +')
+        rpn.RPN.compile('x sin', inputs=('x',))
+        import numpy
+        rpn.enable_arrays()
+        zeros = numpy.zeros(2)
+        print(*rpn.RPN.compile('x sin', inputs=('x',))(zeros))
+        calculator = rpn.RPN()
+        calculator.stack.append(zeros)
+        calculator.process_token('sn')
+        print(*calculator.stack[0], rpn.WORDS['sn'].body)
+    """
+    assert python(script).splitlines() == ['0.0 0.0', '1.0 1.0 sin 1 +']
+
+
+# Monte Carlo
+
+def test_monte_carlo_counts_failures_with_and_without_numpy(np, monkeypatch):
+    program = 'Rand 0.5 - 1/x ln'
+    with_numpy = rpn.monte_carlo(program, 1000, seed=1)
+
+    def no_numpy():
+        raise ImportError
+    monkeypatch.setattr(rpn, 'np', None)
+    monkeypatch.setattr(rpn, 'enable_arrays', no_numpy)
+    monkeypatch.setattr(rpn, 'arrays_in_use', lambda: False)
+    without_numpy = rpn.monte_carlo(program, 1000, seed=1)
+    for distribution in (with_numpy, without_numpy):
+        assert distribution.trials == 1000
+        assert 400 < distribution.failures < 600
+        assert math.isfinite(distribution.mean)
+
+
+@pytest.mark.parametrize('program, failing', [
+    ('Rand 0.001 - ln', 0.001),
+    ('Rand 0.5 - \u221a', 0.5),  # Raises for the whole array
+    ('3 Rand 2 \u00d7 = \u00f7', 0.5),
+    ('Rand 0.5 - \u221a drop 1', 0.5),  # Fails, even if dropped later
+])
+def test_monte_carlo_fails_only_the_failing_trials(np, monkeypatch, program,
+                                                   failing):
+    def one_at_a_time(seed):
+        raise AssertionError("The block was run one trial at a time.")
+    monkeypatch.setattr(rpn.random, 'Random', one_at_a_time)
+    distribution = rpn.monte_carlo(program, 100000, seed=1)
+    assert distribution.failures == pytest.approx(100000 * failing, rel=0.1)
+    assert math.isfinite(distribution.mean)
+
+
+def test_summarize_drops_nan():
+    distribution = rpn.summarize([2.0, math.nan, 1.0], failures=1)
+    assert distribution.trials == 4
+    assert distribution.failures == 2
+    assert distribution.mean == 1.5
+    assert distribution.minimum == 1.0
+    assert distribution.maximum == 2.0
+
+
+# Instrumentation
+
+@pytest.mark.parametrize('program, name', [('1 +', '+'),
+                                           ('1 2 hello +', 'number')])
+def test_rejected_programs_are_counted(program, name):
+    calculator = RPN(error_policy='skip')
+    statistics = rpn.Instrumentation()
+    calculator.instrument(statistics)
+    assert not calculator.run(program)
+    assert statistics.errors == {name: 1}
+    assert statistics.calls[name] == 1
+    assert calculator.error_counts
+
+
+# Caches
+
+@pytest.fixture
+def cache():
+    cache = rpn.OperatorCache()
+    rpn.enable_cache(cache)
+    yield cache
+    rpn.enable_cache(None)
+
+
+def test_program_cache_keeps_modes_apart(cache):
+    assert isinstance(outcome('20000 !', approximate=True)[0], rpn.Approx)
+    assert type(outcome('20000 !')[0]) is int
+    assert isinstance(outcome('20000 !', approximate=True)[0], rpn.Approx)
+
+
+def test_operator_cache_keeps_modes_apart(cache):
+    for approximate in (False, True, False):
+        calculator = RPN(approximate=approximate)
+        calculator.stack.append(20000)
+        calculator.process_token('!')
+        assert isinstance(calculator.stack[0], rpn.Approx) == approximate
+    assert cache.hits
+
+
+def test_program_cache_hits(cache):
+    assert outcome('3 x^2 4 x^2 + √') == [5.0]
+    assert outcome('3 x^2 4 x^2 + √') == [5.0]
+    assert cache.hits
+
+
+# Approximate mode
+
+@pytest.mark.parametrize('program, result', [
+    ('100000 ! dup /', [1]),
+    ('100000 ! 99999 ! /', [100000]),
+    ('100000 ! 3 ^ 100000 ! 3 ^ /', [1]),
+    ('100000 ! 99999 ! \u00f7', [100000]),
+    ('5 100000 ! \u00f7', [0]),
+    ('-5 100000 ! \u00f7', [-1]),
+    ('5 100000 ! %', [5]),
+    ('100000 ! 2 %', rpn.DomainError),
+    ('100000 ! dup %', rpn.DomainError),
+])
+def test_approximations_give_numbers_when_they_can(program, result):
+    assert outcome(program, approximate=True) == result
+
+
+@pytest.mark.parametrize('number', [20000, 100000])
+def test_approximations_show_only_known_digits(number):
+    approximation, = outcome(f'{number} !', approximate=True)
+    mantissa, exponent = str(approximation).split('\u00d710^')
+    exact = rpn.int_to_string(math.factorial(number))
+    assert int(exponent) == len(exact) - 1
+    digits = mantissa.replace('.', '')
+    assert 9 <= len(digits) <= 10
+    assert int(digits) == round(int(exact[:len(digits) + 1]), -1) // 10
+
+
+def test_remainder_of_approximation_is_exact():
+    calculator = RPN(approximate=True)
+    calculator.run('-5 100000 ! %')
+    assert isinstance(calculator.stack[0], rpn.Approx)
+    calculator.run('=')
+    assert calculator.stack == [math.factorial(100000) - 5]
+
+
+# Operators on the whole stack
+
+@pytest.mark.parametrize('program', ['Σ', 'Π', 'mean', 'var', 'stdev',
+                                     '1 2 dot', 'min', 'max'])
+def test_stack_operators_on_approximations(program):
+    result, = outcome('5 100000 ! ' + program, approximate=True)
+    assert isinstance(result, (rpn.Approx, int))
+
+
+def test_stack_statistics():
+    assert outcome('1 2 3 4 Σ') == [10]
+    assert outcome('0.1 0.2 0.3 Σ') == [0.6]
+    assert outcome('1 2 3 4 mean') == [2.5]
+    assert outcome('1 2 3 4 stdev') == [pytest.approx(1.2909944487358056)]
+    assert outcome('1 2 3 4 2 vark') == [1, 2, 0.5]
+
+
+# Batch mode
+
+def test_batch_reports_unwritable_results_per_line(tmp_path, monkeypatch):
+    import io
+
+    monkeypatch.setattr(rpn, 'format_value', str)  # Fails beyond 4300 digits
+    path = tmp_path / 'programs'
+    path.write_text('5000 !\n1 2 +\n')
+    out = io.StringIO()
+    rpn.run_batch(str(path), out)
+    first, second = out.getvalue().splitlines()
+    assert first.startswith('Error: ')
+    assert second == '3'
+
+
+def test_batch_writes_huge_results():
+    assert rpn.evaluate_line(RPN(), '5000 !') \
+        == rpn.int_to_string(math.factorial(5000))
+
+
+@pytest.mark.parametrize('policy', ['raise', 'skip'])
+def test_parallel_batch_matches_serial(tmp_path, capsys, policy):
+    import io
+
+    path = tmp_path / 'programs'
+    path.write_text(''.join(f"{number} 7 % {number % 7} / 2 ^ 300 !\n"
+                            for number in range(500)))
+    outputs = []
+    for jobs in (1, 2):
+        out = io.StringIO()
+        rpn.run_batch(str(path), out, error_policy=policy, jobs=jobs,
+                      chunk_size=64)
+        outputs.append((out.getvalue(),
+                        capsys.readouterr().err.splitlines()[1:]))
+    serial, parallel = outputs
+    assert parallel == serial
+    lines = serial[0].splitlines()
+    assert len(lines) == 500
+    assert lines[8].startswith('1 ')
+    assert serial[1] == ["72 errors: DomainError 72"]
+
+
+# Startup and sessions
+
+def test_import_leaves_out_slow_modules():
+    script = ("import sys, rpn; print(*{'re', 'decimal', 'struct', 'json', "
+              + "'numpy', 'tkinter'} & set(sys.modules))")
+    loaded = subprocess.run([sys.executable, '-c', script], check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(rpn.__file__)))
+    assert loaded.stdout.split() == []
+
+
+def test_session_round_trip(tmp_path):
+    path = tmp_path / 'session'
+    stack = [1.5, -0.0, 2 ** 100, -3, 0, 10 ** 5000, -1.5 + 2j,
+             rpn.Approx(-1, 500.5)]
+    history = ['1 2 +', ': sq dup \u00d7 ;', '']
+    rpn.save_session(path, stack, history, {'digits': 5})
+    loaded, loaded_history, settings = rpn.load_session(path)
+    assert loaded[:-1] == stack[:-1]
+    assert list(map(type, loaded)) == list(map(type, stack))
+    assert math.copysign(1, loaded[1]) == -1
+    assert (loaded[-1].sign, loaded[-1].log10) == (-1, 500.5)
+    assert loaded_history == history
+    assert settings == {'digits': 5}
+
+
+def test_session_refuses_arrays(np, tmp_path):
+    with pytest.raises(TypeError):
+        rpn.save_session(tmp_path / 'session', [np.array([1.0])])
+
+
+@pytest.mark.parametrize('cut', [1, 3, 10, 20])
+def test_truncated_session_fails(tmp_path, cut):
+    path = tmp_path / 'session'
+    rpn.save_session(path, [2 ** 100], ['1 2 +'])
+    path.write_bytes(path.read_bytes()[:-cut])
+    with pytest.raises(ValueError):
+        rpn.load_session(path)
+
+
+# Undo and redo
+
+def apply(calculator, undo, program):
+    """Run program, recording the change of the whole stack in undo."""
+    before = tuple(calculator.stack)
+    calculator.run(program)
+    undo.record(calculator.stack, 0, before)
+
+
+def test_undo_and_redo():
+    calculator, undo = RPN(), rpn.UndoLog()
+    apply(calculator, undo, '1 2 3')
+    apply(calculator, undo, '+')
+    apply(calculator, undo, '10 \u00d7')
+    assert calculator.stack == [1, 50]
+    assert undo.undo(calculator.stack)
+    assert calculator.stack == [1, 5]
+    assert undo.undo(calculator.stack)
+    assert calculator.stack == [1, 2, 3]
+    assert undo.redo(calculator.stack)
+    assert undo.redo(calculator.stack)
+    assert not undo.redo(calculator.stack)
+    assert calculator.stack == [1, 50]
+    for _ in range(3):
+        assert undo.undo(calculator.stack)
+    assert not undo.undo(calculator.stack)
+    assert calculator.stack == []
+
+
+def test_undo_gives_back_the_same_values():
+    calculator, undo = RPN(), rpn.UndoLog()
+    calculator.stack.append(2 ** 100000)
+    operand = calculator.stack[0]
+    apply(calculator, undo, '2 \u00d7')
+    undo.undo(calculator.stack)
+    assert calculator.stack[0] is operand
+
+
+def test_new_change_drops_the_undone_changes():
+    calculator, undo = RPN(), rpn.UndoLog()
+    apply(calculator, undo, '1 2')
+    apply(calculator, undo, '+')
+    undo.undo(calculator.stack)
+    apply(calculator, undo, '\u00d7')
+    assert not undo.redo(calculator.stack)
+    assert calculator.stack == [2]
+
+
+def test_unchanged_stack_is_not_recorded():
+    calculator, undo = RPN(), rpn.UndoLog()
+    apply(calculator, undo, '1')
+    apply(calculator, undo, '')
+    apply(calculator, undo, 'dup drop')
+    assert len(undo.undos) == 1
+
+
+def test_undo_keeps_only_the_latest_changes():
+    calculator, undo = RPN(), rpn.UndoLog(depth=2)
+    for number in range(5):
+        apply(calculator, undo, str(number))
+    while undo.undo(calculator.stack):
+        pass
+    assert calculator.stack == [0, 1, 2]
+
+
+# Journal
+
+def test_journal_writes_in_batches(tmp_path):
+    path = tmp_path / 'journal'
+    journal = rpn.Journal(path, batch_size=3)
+    journal.append('1 2 +')
+    journal.append(': cube\n dup dup \u00d7 \u00d7 ;')
+    assert not path.exists()
+    assert list(journal) == ['1 2 +', ': cube dup dup \u00d7 \u00d7 ;']
+    journal.append('3')
+    assert path.read_text(encoding='utf-8').splitlines() == list(journal)
+    journal.append('4')
+    journal.flush()
+    assert list(rpn.Journal(path)) == [
+        '1 2 +', ': cube dup dup \u00d7 \u00d7 ;', '3', '4']
+
+
+@pytest.mark.parametrize('count', [0, 1, 5, 999, 1000, 2000])
+def test_journal_tail(tmp_path, count):
+    path = tmp_path / 'journal'
+    path.write_text(''.join(f"{number} 1 +\n" for number in range(998)))
+    journal = rpn.Journal(path)
+    journal.append('998')
+    journal.append('999')
+    lines = [f"{number} 1 +" for number in range(998)] + ['998', '999']
+    last = lines[max(0, len(lines) - count):]
+    assert journal.tail(count, block_size=16) == last
+    assert journal.tail(count) == last
+
+
+def test_journal_replay(tmp_path):
+    journal = rpn.Journal(tmp_path / 'journal', batch_size=2)
+    for text in ['1 2 +', ': cube dup dup \u00d7 \u00d7 ;', 'cube', '1 0 /',
+                 'x', '1', '2 +']:
+        journal.append(text)
+    calculator = RPN()
+    assert journal.replay(calculator) == 7
+    assert calculator.stack == [27, 1, 0, 3]
+    assert rpn.Journal(tmp_path / 'missing').replay(calculator) == 0
+
+
+# User-defined words
+
+@pytest.mark.parametrize('name', ['sum', 'prod', '*', 'sumk', '\u03a3', ':'])
+def test_word_names_of_operators_are_rejected(name):
+    with pytest.raises(rpn.ParseError):
+        rpn.define_word(name, '1 +')
+    assert name not in rpn.WORDS
@@ -0,0 +1,387 @@
+import collections
+import math
+
+import pytest
+
+pytest.importorskip('tkinter')
+
+import rpn  # noqa: E402
+import rpn_gui  # noqa: E402
+from rpn import RPN  # noqa: E402
+
+
+class Widget():
+    """Stands in for a label or button, keeping what it was configured
+    with."""
+
+    def __init__(self):
+        self.options = {}
+
+    def config(self, **options):
+        self.options.update(options)
+
+
+class Entry():
+    """Stands in for the entry field."""
+
+    def __init__(self):
+        self.text = ''
+
+    def get(self):
+        return self.text
+
+    def delete(self, first, last=None):
+        self.text = ''
+
+    def insert(self, index, text):
+        self.text += text
+
+
+@pytest.fixture
+def gui(monkeypatch):
+    """A CalculatorGUI without a window, so it runs without a display.
+
+    Callbacks given to after() and after_idle() wait in app.pending until
+    run_pending() calls them, like the event loop would."""
+    app = rpn_gui.CalculatorGUI.__new__(rpn_gui.CalculatorGUI)
+    app.rpn = RPN()
+    app.rpn.stack_label = Widget()
+    app.history_label = Widget()
+    app.clear_button = Widget()
+    app.entry = Entry()
+    app.history = collections.deque(maxlen=rpn_gui.HISTORY_SIZE)
+    app.journal = None
+    app.session = None
+    app.saving = None
+    app.undo_log = rpn.UndoLog()
+    app.pool = None
+    app.job = None
+    app.slow_sizes = {}
+    app.settings_digits = 17
+    app.settings_shown = 8
+    app.settings_layout = 'small'
+    app.settings_timeout = 60
+    app.sci_mode = app.hyp_mode = 0
+    app.stack_strings = {}
+    app.refresh_pending = False
+    app.pending = []
+    app.errors = []
+    app.destroyed = False
+    app.after = lambda ms, function, *args: app.pending.append(
+        (function, args))
+    app.after_idle = lambda function, *args: app.pending.append(
+        (function, args))
+    app.config = lambda **options: None
+    app.bell = lambda: None
+
+    def destroy():
+        app.destroyed = True
+    app.destroy = destroy
+    monkeypatch.setattr(rpn_gui.messagebox, 'showerror',
+                        lambda title, message: app.errors.append(title))
+    return app
+
+
+@pytest.fixture
+def np():
+    return pytest.importorskip('numpy')
+
+
+def run_pending(app):
+    """Call the waiting callbacks, and those they add, until none are
+    left."""
+    calls = 0
+    while app.pending:
+        function, args = app.pending.pop(0)
+        function(*args)
+        calls += 1
+    return calls
+
+
+def run_turn(app):
+    """Call the callbacks waiting now, but not those they add, like one
+    turn of the event loop."""
+    pending, app.pending = app.pending, []
+    for function, args in pending:
+        function(*args)
+
+
+def shown(app):
+    """The text of the stack display."""
+    return app.rpn.stack_label.options['text']
+
+
+# Showing the stack
+
+def test_display_shows_any_value(gui):
+    gui.rpn.stack.extend([2 ** 5000, -8, 0.5])
+    gui.rpn.process_token('^')
+    gui.rpn.stack.append(2 ** 10)
+    gui.update_display()
+    assert shown(gui).startswith("Stack: [1.41246703213942")
+    assert "(1506 digits)" in shown(gui)
+    assert "j)" in shown(gui)
+    assert shown(gui).endswith(", 1024]")
+
+
+class Counted():
+    """A stack value counting how often it is formatted."""
+    formatted = 0
+
+    def __str__(self):
+        Counted.formatted += 1
+        return "c"
+
+
+def test_display_shows_only_the_top_of_the_stack(gui):
+    gui.settings_shown = 3
+    gui.rpn.stack.extend(range(100000))
+    gui.history.extend(str(number) for number in range(5))
+    gui.update_display()
+    assert shown(gui) == "Stack: [\u202699997 more, 99997, 99998, 99999]"
+    assert gui.history_label.options['text'] \
+        == "History: ['\u20262', '2', '3', '4']"
+
+
+def test_display_formats_only_new_entries(gui, monkeypatch):
+    monkeypatch.setattr(Counted, 'formatted', 0)
+    gui.rpn.stack.extend(Counted() for _ in range(1000))
+    gui.update_display()
+    assert Counted.formatted == gui.settings_shown
+    gui.update_display()
+    assert Counted.formatted == gui.settings_shown
+    gui.rpn.stack.append(Counted())
+    gui.update_display()
+    assert Counted.formatted == gui.settings_shown + 1
+    gui.rpn.stack.pop()
+    gui.update_display()
+    assert Counted.formatted == gui.settings_shown + 2  # Back into view
+
+
+def test_display_formats_again_with_other_digits(gui):
+    gui.rpn.stack.append(2 / 3)
+    gui.update_display()
+    assert shown(gui) == "Stack: [0.66666666666666663]"
+    gui.set_digits(4)
+    gui.update_display()
+    assert shown(gui) == "Stack: [0.6667]"
+
+
+# Slow operations in the worker
+
+class Result():
+    """Stands in for the AsyncResult of a worker, ready once finished."""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.finished = False
+
+    def ready(self):
+        return self.finished
+
+    def get(self):
+        return self.function(*self.args)
+
+
+class Pool():
+    """Stands in for the worker pool, keeping the work it was given."""
+
+    def __init__(self):
+        self.results = []
+        self.terminated = False
+
+    def apply_async(self, function, args):
+        self.results.append(Result(function, args))
+        return self.results[-1]
+
+    def terminate(self):
+        self.terminated = True
+
+
+@pytest.fixture
+def worker(gui):
+    gui.pool = Pool()
+    gui.slow_sizes['!'] = 64  # 30! and larger go to the worker
+    return gui.pool
+
+
+def test_slow_operation_runs_in_the_worker(gui, worker):
+    gui.process_text('2 30 ! 1 +')
+    run_turn(gui)
+    run_turn(gui)  # Polls once, the result is not ready yet
+    assert gui.rpn.stack == [2, 30]
+    assert shown(gui) == "Working on !\u2026"
+    assert gui.clear_button.options['text'] == "Cancel"
+    worker.results[0].finished = True
+    run_pending(gui)
+    assert gui.rpn.stack == [2, math.factorial(30) + 1]
+    assert gui.clear_button.options['text'] == "Clear"
+    assert gui.undo_log.undo(gui.rpn.stack)
+    assert gui.undo_log.undo(gui.rpn.stack)
+    assert gui.rpn.stack == [2, 30]
+
+
+def test_cancelled_operation_leaves_the_stack(gui, worker):
+    gui.process_text('2 30 ! 1 +')
+    gui.on_button_click("Clear")
+    assert worker.terminated
+    assert gui.pool is None
+    run_pending(gui)
+    assert gui.rpn.stack == [2, 30]
+    assert shown(gui) == "Stack: [2, 30]"
+    assert gui.clear_button.options['text'] == "Clear"
+
+
+def test_operation_times_out(gui, worker):
+    gui.settings_timeout = 0
+    gui.process_text('30 !')
+    run_pending(gui)
+    assert worker.terminated
+    assert gui.errors == ["Timeout"]
+    assert gui.job is None
+    assert gui.rpn.stack == [30]
+
+
+def test_failure_in_the_worker_is_shown(gui, worker):
+    gui.process_text('1000.5 !')
+    worker.results[0].finished = True
+    run_pending(gui)
+    assert gui.errors == ["RPNOverflowError"]
+    assert gui.rpn.stack == [1000.5]
+
+
+# Undo and redo
+
+def test_undo_clear_and_operators(gui):
+    gui.process_text('1 2 3')
+    gui.process_text('+')
+    gui.clear()
+    assert gui.rpn.stack == []
+    gui.undo()
+    assert gui.rpn.stack == [1, 5]
+    gui.undo()
+    assert gui.rpn.stack == [1, 2, 3]
+    gui.redo()
+    assert gui.rpn.stack == [1, 5]
+    run_pending(gui)
+    assert shown(gui) == "Stack: [1, 5]"
+
+
+def test_undo_waits_for_the_worker(gui, worker, monkeypatch):
+    bells = []
+    monkeypatch.setattr(gui, 'bell', lambda: bells.append(True))
+    gui.process_text('30')
+    gui.process_text('!')
+    gui.undo()
+    assert bells == [True]
+    assert gui.rpn.stack == [30]
+    worker.results[0].finished = True
+    run_pending(gui)
+    gui.undo()
+    assert gui.rpn.stack == [30]
+    gui.undo()
+    gui.undo()
+    assert gui.rpn.stack == []
+    assert bells == [True, True]
+
+
+# Long input and redraws
+
+def test_redraws_are_coalesced(gui, monkeypatch):
+    drawn = []
+    update_display = gui.update_display
+
+    def counted_update_display():
+        drawn.append(True)
+        update_display()
+    monkeypatch.setattr(gui, 'update_display', counted_update_display)
+    for text in ('1', '2', '+', '3 \u00d7'):
+        gui.process_text(text)
+    assert run_pending(gui) == 1
+    assert drawn == [True]
+    gui.process_text('4')
+    run_pending(gui)
+    assert drawn == [True, True]
+    assert shown(gui) == "Stack: [9, 4]"
+
+
+def test_long_input_is_applied_in_steps(gui, monkeypatch):
+    monkeypatch.setattr(rpn_gui, 'BULK_TOKENS', 10)
+    gui.process_text(' '.join(['1'] * 24 + ['\u03a3']))
+    assert gui.rpn.stack == [1] * 10
+    gui.process_input()  # Busy with the rest
+    run_pending(gui)
+    assert gui.rpn.stack == [24]
+    assert shown(gui) == "Stack: [24]"
+    assert gui.undo_log.undo(gui.rpn.stack)
+    assert gui.rpn.stack == [1] * 20
+
+
+def test_long_input_stops_at_an_error(gui, monkeypatch):
+    monkeypatch.setattr(rpn_gui, 'BULK_TOKENS', 2)
+    gui.process_text('1 2 3 4 + x 5 6')
+    run_pending(gui)
+    assert gui.rpn.stack == [1, 2, 7]
+    assert gui.errors == ["ParseError"]
+
+
+def test_paste_applies_lines_at_once(gui, monkeypatch):
+    monkeypatch.setattr(gui, 'clipboard_get', lambda: '2 3\n\u00d7\n',
+                        raising=False)
+    gui.entry.insert(0, '1')
+    assert gui.paste() == "break"
+    assert gui.rpn.stack == [1, 6]
+    assert gui.entry.get() == ''
+    assert list(gui.history) == ['1 2 3\n\u00d7']
+
+
+def test_short_paste_goes_to_the_entry(gui, monkeypatch):
+    monkeypatch.setattr(gui, 'clipboard_get', lambda: '2 3',
+                        raising=False)
+    assert gui.paste() is None
+    assert gui.rpn.stack == []
+
+
+# History
+
+def test_history_keeps_the_latest_inputs(gui, tmp_path):
+    gui.history = collections.deque(maxlen=5)
+    gui.settings_shown = 3
+    gui.journal = rpn.Journal(tmp_path / 'journal', batch_size=4)
+    for number in range(12):
+        gui.process_text(str(number))
+    gui.process_text('1 +')
+    gui.process_input()  # Empty, not recorded
+    run_pending(gui)
+    assert list(gui.history) == ['8', '9', '10', '11', '1 +']
+    assert gui.journal.tail(13) == [str(number) for number in range(12)] \
+        + ['1 +']
+    assert gui.history_label.options['text'] \
+        == "History: ['\u20262', '10', '11', '1 +']"
+
+
+def test_history_shows_long_inputs_cut_short(gui):
+    gui.process_text(' '.join(['1'] * 100))
+    gui.update_display()
+    text = gui.history_label.options['text']
+    assert text.endswith("\u2026']")
+    assert len(text) < rpn_gui.HISTORY_CHARS + 20
+
+
+# Sessions
+
+def test_close_saves_complex_values(gui, tmp_path):
+    gui.session = tmp_path / 'session'
+    gui.rpn.run('-8 0.5 ^ 2')
+    gui.close()
+    assert gui.destroyed
+    assert rpn.load_session(gui.session)[0] == gui.rpn.stack
+
+
+def test_close_even_if_the_session_is_not_saved(gui, tmp_path, np):
+    gui.session = tmp_path / 'session'
+    gui.rpn.stack.append(np.array([1.0]))
+    gui.close()
+    assert gui.destroyed
+    assert gui.errors == ["Session not saved"]
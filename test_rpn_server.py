@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import math
+
+import pytest
+
+import rpn
+import rpn_server
+
+
+class RecordingPool(ThreadPoolExecutor):
+    """Runs work in a thread, and counts the work it was given."""
+
+    def __init__(self):
+        super().__init__(1)
+        self.submitted = 0
+
+    def submit(self, function, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(function, *args, **kwargs)
+
+
+@pytest.fixture
+def session():
+    pool = RecordingPool()
+    yield rpn_server.Session(pool)
+    pool.shutdown()
+
+
+def evaluate(session, *lines):
+    async def run():
+        return [await session.evaluate(line) for line in lines]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('line', ['1 0 /', '2 3 ln 0 /', '-1 √', '2 0 ÷ 5',
+                                  'Σ 0 /', 'nosuchthing', '4 + + +'])
+def test_failing_line_leaves_stack(session, line):
+    evaluate(session, '7 8')
+    reply, = evaluate(session, line)
+    assert reply.startswith("Error: ")
+    assert session.rpn.stack == [7, 8]
+
+
+def test_failing_line_in_pool_leaves_stack(session):
+    evaluate(session, '7 8')
+    reply, = evaluate(session, '3 ! 0 /')
+    assert reply.startswith("Error: ")
+    assert session.rpn.stack == [7, 8]
+    assert session.pool.submitted == 1
+
+
+def test_light_line_stays_in_event_loop(session):
+    assert evaluate(session, '1 2 +', '3 ×') == ['3', '9']
+    assert session.pool.submitted == 0
+
+
+def test_huge_operands_go_to_pool(session):
+    evaluate(session, '5000 !')
+    submitted = session.pool.submitted
+    reply, = evaluate(session, '1 +')
+    assert session.pool.submitted == submitted + 1
+    assert reply == rpn.int_to_string(math.factorial(5000) + 1)
+    assert session.rpn.stack == [math.factorial(5000) + 1]
+
+
+def test_huge_reply_is_formatted_in_pool(session):
+    evaluate(session, '5000 ! 1')
+    submitted = session.pool.submitted
+    reply, = evaluate(session, 'drop')
+    assert session.pool.submitted == submitted + 1
+    assert reply == rpn.int_to_string(math.factorial(5000))
+
+
+# Over sockets, with worker processes
+
+def test_line_and_http_clients_over_localhost():
+    async def run():
+        server = rpn_server.Server(jobs=1)
+        try:
+            line_server, http_server = await server.start(0, 0)
+            port = line_server.sockets[0].getsockname()[1]
+            http_port = http_server.sockets[0].getsockname()[1]
+
+            reader, writer = await asyncio.open_connection(
+                rpn_server.HOST, port, limit=rpn_server.LINE_LIMIT)
+            # Sent without waiting, one in the worker processes
+            writer.write(b'1 2 +\n2000 !\ndrop 4 \xc3\x97\n1 0 /\n')
+            await writer.drain()
+            replies = [(await reader.readline()).decode('utf-8').strip()
+                       for _ in range(4)]
+            writer.close()
+
+            reader, writer = await asyncio.open_connection(rpn_server.HOST,
+                                                           http_port)
+            body = b'3 4 +\n2 \xc3\x97\n'
+            writer.write(b'POST / HTTP/1.1\r\nContent-Length: '
+                         + str(len(body)).encode() + b'\r\n\r\n' + body)
+            response = await reader.read()
+            writer.close()
+            for listening in (line_server, http_server):
+                listening.close()
+            return replies, response
+        finally:
+            server.close()
+
+    replies, response = asyncio.run(run())
+    assert replies[0] == '3'
+    assert replies[1] == rpn.int_to_string(math.factorial(2000))
+    assert replies[2] == '12'
+    assert replies[3].startswith('Error: ')
+    assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert response.endswith(b'\r\n\r\n7\n14\n')
+
+
+def test_closing_drops_work_not_started():
+    import time
+
+    server = rpn_server.Server(jobs=1)
+    futures = [server.pool.submit(time.sleep, 0.2) for _ in range(5)]
+    server.close()
+    assert any(future.cancelled() for future in futures)
+    assert all(future.done() for future in futures)